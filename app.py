@@ -4,7 +4,7 @@ from datetime import datetime, timedelta
 import threading
 import time
 from dateutil import parser
-from functools import wraps
+from functools import wraps, lru_cache
 import qrcode 
 import io
 import base64
@@ -13,6 +13,9 @@ import json
 import logging
 import requests
 import urllib.parse
+import queue
+import zlib
+import atexit
 import re
 from typing import Optional, Tuple, Dict, Any, List
 import ssl
@@ -26,6 +29,14 @@ from realtime_integration import (
 )
 #------Sistema Autocomplete modal--------
 import cliente_autocomplete
+from response_analyzer import ResponseAnalyzer, rescore_client_responses
+from evolution_client import get_evolution_client, get_connection_state, CircuitOpenError, get_all_stats as get_evolution_client_stats
+from outbox import get_outbox
+from migrations import run_migrations, column_exists
+from database import (get_connection, release_thread_connections, ensure_epoch_column, to_epoch, day_bounds,
+                      get_stats as get_database_stats)
+from repositories import (MeetingRepository, ResponseRepository, WhatsAppLogRepository, EventRepository,
+                          BirthdayRepository)
 
 #------DISPARADOR---------
 import pandas as pd
@@ -59,14 +70,44 @@ app = Flask(__name__)
 app.secret_key = 'sua_chave_secreta_muito_segura_aqui_2024'
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=2)
 
+
+@app.teardown_request
+def _release_db(exc=None):
+    """Conexões SQLite são por thread: não deixa transação pendurada entre requisições"""
+    release_thread_connections()
+
+
 DATABASE = 'reunioes.db'
 
+# Leituras tipadas (colunas explícitas, linhas como NamedTuple)
+meetings_repo = MeetingRepository(DATABASE)
+responses_repo = ResponseRepository(DATABASE)
+whatsapp_logs_repo = WhatsAppLogRepository(DATABASE)
+eventos_repo = EventRepository(DATABASE)
+aniversariantes_repo = BirthdayRepository('sistema.db')
+
 # Configurações da Evolution API
+# (EVOLUTION_BASE_URL aponta o app para o evolution_stub.py em testes de carga)
 EVOLUTION_API_CONFIG = {
-    'base_url': 'http://82.25.69.24:8090',
-    'api_key': 'olvjg1k1ldmbhyl8owi6',  # ← CORRIGIDO: Use a key da imagem
-    'instance_name': 'marco_reunioes_bot',
-    'webhook_url': 'http://82.25.69.24:3000/webhook/evolution'
+    'base_url': os.getenv('EVOLUTION_BASE_URL', 'http://82.25.69.24:8090'),
+    'api_key': os.getenv('EVOLUTION_API_KEY', 'olvjg1k1ldmbhyl8owi6'),  # ← CORRIGIDO: Use a key da imagem
+    'instance_name': os.getenv('EVOLUTION_INSTANCE', 'marco_reunioes_bot'),
+    'webhook_url': os.getenv('EVOLUTION_WEBHOOK_URL', 'http://82.25.69.24:3000/webhook/evolution')
+}
+
+# Fila de processamento do webhook (modo aceita-e-enfileira)
+WEBHOOK_QUEUE_CONFIG = {
+    'async_mode': os.getenv('WEBHOOK_ASYNC_MODE', 'true').lower() in ('1', 'true', 'yes'),
+    'max_size': int(os.getenv('WEBHOOK_QUEUE_SIZE', '1000')),
+    'workers': int(os.getenv('WEBHOOK_WORKERS', '4'))
+}
+
+# Gravação em lote de webhook_incoming_logs
+WEBHOOK_LOG_CONFIG = {
+    'flush_interval_ms': int(os.getenv('WEBHOOK_LOG_FLUSH_MS', '500')),
+    'batch_size': int(os.getenv('WEBHOOK_LOG_BATCH_SIZE', '200')),
+    'max_pending': int(os.getenv('WEBHOOK_LOG_MAX_PENDING', '10000')),
+    'compression_level': 6
 }
 #---------------------------
 '''
@@ -131,150 +172,6 @@ register_page_route(app)
 init_disparador_module()
 
 #--------------------------------
-class ResponseAnalyzer:
-    """Analisa respostas de clientes para determinar confirmação - VERSÃO CORRIGIDA v2"""
-    
-    @staticmethod
-    def normalize_text(text: str) -> str:
-        """Normaliza texto removendo acentos e convertendo para minúsculas"""
-        import unicodedata
-        
-        if not text:
-            return ""
-        
-        # Remove acentos
-        normalized = unicodedata.normalize('NFKD', text)
-        normalized = ''.join([c for c in normalized if not unicodedata.combining(c)])
-        
-        # Lowercase
-        return normalized.lower().strip()
-    
-    @staticmethod
-    def analyze_response(message: str) -> Dict[str, Any]:
-        """Analisa mensagem e retorna status de confirmação - VERSÃO CORRIGIDA"""
-        if not message:
-            return {
-                'status': 'unclear',
-                'confidence': 0.0,
-                'scores': {'positive': 0, 'negative': 0, 'reschedule': 0},
-                'original_message': message
-            }
-        
-        # CORREÇÃO 1: Normaliza SEMPRE
-        message_normalized = ResponseAnalyzer.normalize_text(message)
-        
-        logger.info(f"🔍 Analisando: '{message}' → Normalizado: '{message_normalized}'")
-        
-        # CORREÇÃO 2: Listas SEM acentos e ordenadas por especificidade (do maior para o menor)
-        confirmacao_positiva = [
-            'com certeza', 'ate la', 'nos vemos', 'tudo bem', 'pode ser',
-            'confirmado', 'comparecerei', 'perfeito', 'tranquilo', 'concordo',
-            'combinado', 'agendado', 'positivo', 'presente', 'estarei',
-            'aceito', 'fechado', 'certeza', 'bacana', 'obvio', 'claro',
-            'beleza', 'massa', 'confirmo', 'show', 'joia', 'certo',
-            'sim', 'ok', 'vou', 'blz', 'yes', 'sure',
-            '👍', '✅', '🤝', '😊', '👌', '💪'
-        ]
-        
-        confirmacao_negativa = [
-            # FRASES COMPLETAS (PRIORIDADE MÁXIMA) - SEM ACENTOS (normalizado)
-            'nao posso', 'nao consigo', 'nao vou poder', 'nao da', 'nao vai dar',
-            'nao tenho como', 'impossivel', 'inviavel', 'indisponivel',
-            'nao confirmado', 'nao vou confirmar', 'nao posso confirmar',
-            'nao consigo confirmar', 'nao da pra confirmar', 
-            
-            # Negativas contextuais
-            'agenda cheia', 'outro compromisso', 'outro dia', 'outra data',
-            'ocupado', 'conflito', 'cancelar', 'desmarcar', 'impedimento',
-            'sinto muito', 'infelizmente', 'lamento',
-            
-            # Frases médias
-            'nao posso ir', 'nao vou conseguir', 'nao estarei disponivel',
-            'nao vai ser possivel', 'nao tenho disponibilidade',
-            
-            # Palavras individuais (MENOR PRIORIDADE)
-            'jamais', 'nunca', 'nao', 'nope', 'no', 'negativo',
-            
-            # Emojis
-            '👎', '❌', '😞', '🚫', '😔'
-        ]
-        
-        reagendamento = [
-            'outro horario', 'semana que vem', 'mais tarde', 'nao sei',
-            'disponibilidade', 'reagendar', 'remarcar', 'mudanca',
-            'proxima', 'possivel', 'alterar', 'trocar', 'duvida',
-            'verificar', 'conferir', 'horarios', 'talvez', 'quando',
-            'incerto', 'agenda', 'depois'
-        ]
-        
-        score_positivo = 0
-        score_negativo = 0
-        score_reagendamento = 0
-        
-        # CORREÇÃO 3: Verifica do mais específico para o menos específico
-        for palavra in confirmacao_positiva:
-            if palavra in message_normalized:
-                # Peso proporcional ao tamanho da palavra
-                peso = max(2, len(palavra.split()))  # Frases valem mais
-                score_positivo += peso
-                logger.debug(f"  ✅ Encontrado '{palavra}' → +{peso} positivo")
-        
-        for palavra in confirmacao_negativa:
-            if palavra in message_normalized:
-                peso = max(2, len(palavra.split()))
-                score_negativo += peso
-                logger.debug(f"  ❌ Encontrado '{palavra}' → +{peso} negativo")
-        
-        for palavra in reagendamento:
-            if palavra in message_normalized:
-                peso = max(1, len(palavra.split()))
-                score_reagendamento += peso
-                logger.debug(f"  🔄 Encontrado '{palavra}' → +{peso} reagendar")
-        
-        # CORREÇÃO 4: Respostas ultra-curtas têm peso EXTRA
-        if len(message_normalized.strip()) <= 5:
-            if message_normalized in ['sim', 'ok', 'yes', 'claro']:
-                score_positivo += 10  # Peso MASSIVO
-                logger.debug(f"  🎯 Resposta curta POSITIVA detectada → +10")
-            elif message_normalized in ['nao', 'no', 'nope', 'nunca', 'jamais']:
-                score_negativo += 10  # Peso MASSIVO
-                logger.debug(f"  🎯 Resposta curta NEGATIVA detectada → +10")
-        
-        # CORREÇÃO 5: Cálculo de status com thresholds claros
-        total_score = score_positivo + score_negativo + score_reagendamento
-        
-        if total_score == 0:
-            status = 'unclear'
-            confidence = 0.0
-        elif score_positivo > score_negativo and score_positivo > score_reagendamento:
-            status = 'confirmed'
-            # Confiança proporcional: quanto maior o score, mais confiança
-            confidence = min(0.5 + (score_positivo / (total_score + 1)) * 0.5, 1.0)
-        elif score_negativo > score_positivo and score_negativo > score_reagendamento:
-            status = 'declined'
-            confidence = min(0.5 + (score_negativo / (total_score + 1)) * 0.5, 1.0)
-        elif score_reagendamento > 0 and score_reagendamento >= max(score_positivo, score_negativo):
-            status = 'reschedule'
-            confidence = min(0.4 + (score_reagendamento / (total_score + 1)) * 0.4, 0.9)
-        else:
-            status = 'unclear'
-            confidence = 0.2
-        
-        result = {
-            'status': status,
-            'confidence': confidence,
-            'scores': {
-                'positive': score_positivo,
-                'negative': score_negativo,
-                'reschedule': score_reagendamento
-            },
-            'original_message': message
-        }
-        
-        logger.info(f"💭 RESULTADO: {status.upper()} (confiança: {confidence:.2%}) | Scores: P={score_positivo} N={score_negativo} R={score_reagendamento}")
-        
-        return result
-
 # CORREÇÃO 1: Substitua COMPLETAMENTE a classe EvolutionAPIManager
 class EvolutionAPIManager:
     """VERSÃO CORRIGIDA - Resolver erro de instância duplicada"""
@@ -285,21 +182,17 @@ class EvolutionAPIManager:
         self.base_url = config['base_url']
         self.api_key = config['api_key']
         self.webhook_url = config['webhook_url']
-        self.session = requests.Session()
-        
-        # Headers exatos do teste que funcionou
-        self.session.headers.update({
-            'Content-Type': 'application/json',
-            'apikey': self.api_key,
-            'Accept': 'application/json'
-        })
+        # Cliente HTTP compartilhado (pool keep-alive + métricas por endpoint)
+        self.client = get_evolution_client(self.base_url, self.api_key)
+        self.session = self.client.session
+        # Estado da conexão em cache (prober em background via connectionState)
+        self.connection = get_connection_state(self.client, self.instance_name)
         self.connected = False
         self.qr_code = None
 
-    def _make_request(self, method: str, endpoint: str, data: Dict = None, timeout: int = 15) -> Tuple[bool, Dict]:
+    def _make_request(self, method: str, endpoint: str, data: Dict = None, timeout: Any = None) -> Tuple[bool, Dict]:
         """Requisição com logs detalhados para debug"""
         try:
-            url = f"{self.base_url}{endpoint}"
             logger.info(f"🔍 Testando: {endpoint}")
 
             kwargs = {'timeout': timeout}
@@ -308,7 +201,7 @@ class EvolutionAPIManager:
             elif method.upper() == 'GET' and data:
                 kwargs['params'] = data
 
-            response = getattr(self.session, method.lower())(url, **kwargs)
+            response = self.client.request(method, endpoint, **kwargs)
             
             logger.info(f"   Status: {response.status_code}")
 
@@ -335,6 +228,9 @@ class EvolutionAPIManager:
                 logger.error(f"❌ HTTP {response.status_code}: {error_text}")
                 return False, {"error": f"HTTP {response.status_code}: {response.text}"}
 
+        except CircuitOpenError as e:
+            logger.warning(f"⛔ {e}")
+            return False, {"error": str(e), "circuit_open": True}
         except requests.exceptions.Timeout:
             logger.error("⏰ Timeout na requisição")
             return False, {"error": "Timeout na requisição"}
@@ -480,11 +376,14 @@ class EvolutionAPIManager:
             else:
                 error_msg = result.get('error', 'Erro desconhecido')
                 logger.error(f"❌ FALHA NO ENVIO: {error_msg}")
+                # Erro real de envio: reavalia o estado da conexão agora
+                self.connection.force_refresh()
                 return False, error_msg
                     
         except Exception as e:
             error_msg = f"Erro interno no envio: {str(e)}"
             logger.error(f"💥 {error_msg}")
+            self.connection.force_refresh()
             return False, error_msg
 
     def restart_instance(self) -> Tuple[bool, str]:
@@ -493,6 +392,7 @@ class EvolutionAPIManager:
             success, result = self._make_request('PUT', f'/instance/restart/{self.instance_name}')
             if success:
                 self.connected = False
+                self.connection.force_refresh()
                 return True, "Instância reiniciada com sucesso"
             return False, result.get('error', 'Erro ao reiniciar')
         except Exception as e:
@@ -504,14 +404,22 @@ class EvolutionAPIManager:
             success, result = self._make_request('DELETE', f'/instance/delete/{self.instance_name}')
             if success:
                 self.connected = False
+                self.connection.force_refresh()
                 return True, "Instância deletada com sucesso"
             return False, result.get('error', 'Erro ao deletar')
         except Exception as e:
             return False, f"Erro crítico: {str(e)}"
 
-    def check_connection_status(self) -> Tuple[bool, str]:
-        """Verifica status de conexão"""
-        return self.check_existing_instance()
+    def check_connection_status(self, force: bool = False) -> Tuple[bool, str]:
+        """Status de conexão do cache (O(1)); force=True consulta connectionState agora"""
+        if force:
+            self.connection.force_refresh(wait=True)
+        connected, state = self.connection.get()
+        self.connected = connected
+        if connected:
+            return True, f"Instância '{self.instance_name}' conectada e pronta"
+        error = self.connection.snapshot()['error']
+        return False, error or f"Instância '{self.instance_name}' encontrada mas status: {state}"
 
     def get_instance_status(self) -> Tuple[bool, Dict]:
         """Status da instância"""
@@ -556,45 +464,187 @@ class EvolutionAPIManager:
                 "timestamp": datetime.now().isoformat()
             }
 
-    def send_message_with_retry(self, phone: str, message: str, max_retries: int = 3) -> Tuple[bool, str]:
-        """Retry automático"""
-        for attempt in range(max_retries):
-            try:
-                logger.info(f"Tentativa {attempt + 1}/{max_retries} de envio para {phone}")
-                
-                success, result = self.send_message(phone, message)
-                
-                if success:
-                    logger.info(f"✅ Sucesso na tentativa {attempt + 1}")
-                    return True, result
-                
-                if "não existe no WhatsApp" in result:
-                    return False, result
-                
-                if attempt < max_retries - 1:
-                    wait_time = (attempt + 1) * 2
-                    logger.warning(f"Tentativa {attempt + 1} falhou: {result}. Aguardando {wait_time}s...")
-                    time.sleep(wait_time)
-                else:
-                    logger.error(f"Falha definitiva após {max_retries} tentativas: {result}")
-                    return False, f"Falha após {max_retries} tentativas: {result}"
-                    
-            except Exception as e:
-                logger.error(f"Erro na tentativa {attempt + 1}: {e}")
-                if attempt == max_retries - 1:
-                    return False, f"Erro após {max_retries} tentativas: {str(e)}"
-                time.sleep(2)
-        
-        return False, f"Falha após {max_retries} tentativas"
-    
+class PhoneMatchIndex:
+    """Índice imutável de telefones monitorados para busca O(1)
+
+    Reproduz as estratégias de comparação do monitor (exato, últimos 11/10/9
+    dígitos, contenção e diferença apenas no 9) com consultas em dicionários.
+    Cada chave aponta para as entradas na ordem de inserção; a mais recente vence.
+    """
+
+    MIN_DIGITS = 9
+
+    def __init__(self, entries=()):
+        self.entries = tuple(entries)
+        self.exact = {}
+        self.last11 = {}
+        self.last10 = {}
+        self.last9 = {}
+        self.substrings = {}
+        self.len12 = {}
+        self.without_nine = {}
+
+        for entry in self.entries:
+            clean = self.canonical(entry[0])
+            if not clean:
+                continue
+
+            self._put(self.exact, clean, entry)
+            if len(clean) >= 11:
+                self._put(self.last11, clean[-11:], entry)
+            if len(clean) >= 10:
+                self._put(self.last10, clean[-10:], entry)
+            if len(clean) >= 9:
+                self._put(self.last9, clean[-9:], entry)
+            for part in self._substrings(clean):
+                self._put(self.substrings, part, entry)
+            if len(clean) == 12:
+                self._put(self.len12, clean, entry)
+            elif len(clean) == 13:
+                self._put(self.without_nine, clean[:4] + clean[5:], entry)
+
+    @staticmethod
+    def canonical(phone_input) -> str:
+        """Mesma normalização de WhatsAppMonitor._normalize_phone_robust, sem logs"""
+        if not phone_input:
+            return ""
+        phone_clean = str(phone_input).split('@')[0]
+        digits_only = re.sub(r'\D', '', phone_clean)
+        if digits_only.startswith('5555'):
+            digits_only = digits_only[2:]
+        return digits_only
+
+    @staticmethod
+    def _put(mapping: Dict, key: str, entry: Tuple):
+        mapping[key] = mapping.get(key, ()) + (entry,)
+
+    @classmethod
+    def _substrings(cls, digits: str):
+        """Todos os trechos com pelo menos MIN_DIGITS dígitos"""
+        size = len(digits)
+        return {
+            digits[start:end]
+            for start in range(size - cls.MIN_DIGITS + 1)
+            for end in range(start + cls.MIN_DIGITS, size + 1)
+        }
+
+    def __len__(self):
+        return len(self.entries)
+
+    def find(self, from_number_clean: str) -> Tuple[Optional[Tuple], int]:
+        """Retorna (entrada, estratégia) ou (None, 0)"""
+        f = from_number_clean
+        if not f or not self.entries:
+            return None, 0
+
+        candidates = (
+            # 1. Igualdade exata
+            (1, self.exact, f),
+            # 2. Últimos 11 dígitos (celular brasileiro com DDD)
+            (2, self.last11, f[-11:] if len(f) >= 11 else None),
+            # 3. Últimos 10 dígitos (número sem código país)
+            (3, self.last10, f[-10:] if len(f) >= 10 else None),
+            # 4. Últimos 9 dígitos (número sem DDD)
+            (4, self.last9, f[-9:] if len(f) >= 9 else None),
+            # 5a. Número recebido contido no monitorado
+            (5, self.substrings, f if len(f) >= self.MIN_DIGITS else None),
+        )
+        for strategy, mapping, key in candidates:
+            if key is not None and key in mapping:
+                return mapping[key][-1], strategy
+
+        # 5b. Número monitorado contido no recebido
+        for part in sorted(self._substrings(f), key=len, reverse=True):
+            if part in self.exact:
+                return self.exact[part][-1], 5
+
+        # 6. Diferença apenas no 9 (celular)
+        if len(f) == 13 and f[:4] + f[5:] in self.len12:
+            return self.len12[f[:4] + f[5:]][-1], 6
+        if len(f) == 12 and f in self.without_nine:
+            return self.without_nine[f][-1], 6
+
+        return None, 0
+
+
 class WhatsAppMonitor:
-    """Monitor para capturar respostas do WhatsApp via webhook - VERSÃO COMPLETA CORRIGIDA"""
+    """Monitor para capturar respostas do WhatsApp via webhook - VERSÃO COMPLETA CORRIGIDA
+    
+    Os telefones monitorados ficam na tabela monitoring_registry (compartilhada
+    entre processos). Cada processo mantém o índice em memória como cache e só
+    o recarrega quando monitoring_registry_version muda.
+    """
     
-    def __init__(self, evolution_manager):
+    # Por quanto tempo após a reunião o telefone continua monitorado
+    EXPIRY_GRACE_DAYS = 7
+    
+    def __init__(self, evolution_manager, db_path: str = DATABASE):
         self.evolution_manager = evolution_manager
+        self.db_path = db_path
         self.monitoring = False
-        self.monitored_phones = set()
+        # Copy-on-write: leitores usam o snapshot atual sem lock,
+        # escritores reconstroem o índice e trocam a referência sob o lock
+        self._index_lock = threading.Lock()
+        self._phone_index = PhoneMatchIndex()
+        self._registry_version = None
+        self.monitored_phones = frozenset()
         logger.info("Monitor WhatsApp inicializado")
+
+    def _swap_index(self, entries):
+        """Publica um novo índice imutável (chamar com _index_lock adquirido)"""
+        index = PhoneMatchIndex(entries)
+        self._phone_index = index
+        self.monitored_phones = frozenset(index.entries)
+        return index
+
+    @staticmethod
+    def _bump_registry_version(cursor):
+        cursor.execute('UPDATE monitoring_registry_version SET version = version + 1 WHERE id = 1')
+
+    def refresh_registry(self, force: bool = False) -> bool:
+        """Recarrega o cache local se a versão do registro mudou (read-through)"""
+        try:
+            with get_connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT version FROM monitoring_registry_version WHERE id = 1')
+                row = cursor.fetchone()
+                version = row[0] if row else 0
+                
+                if not force and version == self._registry_version:
+                    return False
+                
+                cursor.execute('''
+                    SELECT phone, meeting_id FROM monitoring_registry
+                    WHERE expires_at > ?
+                    ORDER BY updated_at, meeting_id
+                ''', (int(time.time()),))
+                entries = cursor.fetchall()
+            
+            with self._index_lock:
+                self._swap_index(entries)
+                self._registry_version = version
+            return True
+            
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Registro de monitoramento indisponível, usando cache local: {e}")
+            return False
+
+    def purge_expired(self) -> int:
+        """Remove do registro os telefones de reuniões já expiradas"""
+        try:
+            with get_connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM monitoring_registry WHERE expires_at <= ?', (int(time.time()),))
+                removed = cursor.rowcount
+                if removed:
+                    self._bump_registry_version(cursor)
+                conn.commit()
+            if removed:
+                logger.info(f"🧹 {removed} telefone(s) expirado(s) removido(s) do monitoramento")
+            return removed
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Erro ao limpar registro de monitoramento: {e}")
+            return 0
     
     def start_monitoring(self):
         """Inicia monitoramento de respostas"""
@@ -611,148 +661,378 @@ class WhatsAppMonitor:
         normalized_phone = self.evolution_manager.normalize_phone_number(phone)
         phone_clean = normalized_phone.replace('@s.whatsapp.net', '')
         
-        # Remove duplicatas do mesmo meeting_id
-        self.monitored_phones = {(p, mid) for p, mid in self.monitored_phones if mid != meeting_id}
+        now = time.time()
+        fallback_expiry = int(now) + self.EXPIRY_GRACE_DAYS * 86400
         
-        # Adiciona o novo telefone
-        self.monitored_phones.add((phone_clean, meeting_id))
+        try:
+            with get_connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                # Um telefone por reunião; expira alguns dias após a data da reunião
+                cursor.execute('''
+                    INSERT OR REPLACE INTO monitoring_registry (meeting_id, phone, expires_at, updated_at)
+                    VALUES (?, ?, COALESCE(
+                        (SELECT data_hora_ts + ? FROM reunioes WHERE id = ?),
+                        ?
+                    ), ?)
+                ''', (meeting_id, phone_clean, self.EXPIRY_GRACE_DAYS * 86400, meeting_id, fallback_expiry, now))
+                self._bump_registry_version(cursor)
+                conn.commit()
+            self.refresh_registry()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Falha ao persistir monitoramento, mantendo só em memória: {e}")
+            with self._index_lock:
+                # Remove duplicatas do mesmo meeting_id e adiciona o novo telefone
+                entries = [e for e in self._phone_index.entries if e[1] != meeting_id]
+                entries.append((phone_clean, meeting_id))
+                self._swap_index(entries)
         
         logger.info(f"📱 ADICIONADO AO MONITORAMENTO: {phone_clean} (reunião {meeting_id})")
-        logger.info(f"📊 Total monitorado agora: {len(self.monitored_phones)}")
-        logger.info(f"📋 Lista completa: {list(self.monitored_phones)}")
+        logger.info(f"📊 Total monitorado agora: {len(self._phone_index)}")
         
         # Auto-inicia monitoramento se não estiver ativo
         if not self.monitoring:
             self.start_monitoring()
             logger.info("🚀 Monitoramento auto-iniciado")
     
-    def process_webhook_message(self, webhook_data: Dict) -> bool:
-        """Processa mensagem - VERSÃO CORRIGIDA COM LOGS DETALHADOS"""
+    # Confiança mínima para alterar o status da reunião
+    MIN_STATUS_CONFIDENCE = 0.15
+
+    @staticmethod
+    def extract_message(webhook_data: Dict) -> Tuple[Optional[str], Optional[str]]:
+        """Extrai (remetente, texto) de uma mensagem do webhook"""
+        # Estratégia 1: Estrutura padrão Evolution v2
+        key_info = webhook_data.get('key') or {}
+        from_number = key_info.get('remoteJid') or key_info.get('from')
+        
+        message_info = webhook_data.get('message') or {}
+        message_text = (
+            message_info.get('conversation') or
+            (message_info.get('extendedTextMessage') or {}).get('text') or
+            message_info.get('text') or
+            (message_info.get('imageMessage') or {}).get('caption') or
+            (message_info.get('videoMessage') or {}).get('caption')
+        )
+        
+        # Estratégia 2: Fallback para formato direto
+        if not (from_number and message_text):
+            from_number = webhook_data.get('from') or webhook_data.get('remoteJid')
+            message_text = webhook_data.get('body') or webhook_data.get('text')
+        
+        return from_number, message_text
+
+    @staticmethod
+    def extract_message_id(webhook_data: Dict) -> Optional[str]:
+        """Id da mensagem no WhatsApp (key.id), usado como chave de idempotência"""
+        return (webhook_data.get('key') or {}).get('id') or webhook_data.get('id') or None
+
+    def process_inbound(self, webhook_data: Dict) -> Dict[str, Any]:
+        """Pipeline único: extrai, encontra, analisa e grava uma vez (uma transação)"""
+        result = {
+            'processed': False,
+            'reason': None,
+            'from_number': None,
+            'message_id': None,
+            'meeting_id': None,
+            'status': None,
+            'confidence': 0.0,
+            'response_id': None,
+            'duplicate': False,
+            'status_updated': False,
+            'timings_ms': {}
+        }
+        timings = result['timings_ms']
+        started = time.perf_counter()
+        
+        def mark(stage, since):
+            now = time.perf_counter()
+            timings[stage] = round((now - since) * 1000, 3)
+            return now
+        
         try:
-            logger.info(f"📥 Processando webhook...")
-            logger.info(f"📊 Estrutura: {json.dumps(webhook_data, indent=2)[:300]}...")
-            
-            # Extração robusta
-            from_number = None
-            message_text = None
-            
-            # Estratégia 1: Estrutura padrão Evolution v2
-            key_info = webhook_data.get('key', {})
-            from_number = key_info.get('remoteJid') or key_info.get('from')
-            
-            message_info = webhook_data.get('message', {})
-            message_text = (
-                message_info.get('conversation') or
-                message_info.get('extendedTextMessage', {}).get('text') or
-                message_info.get('text') or
-                message_info.get('imageMessage', {}).get('caption') or
-                message_info.get('videoMessage', {}).get('caption')
-            )
-            
-            # Estratégia 2: Fallback para formato direto
-            if not (from_number and message_text):
-                from_number = webhook_data.get('from') or webhook_data.get('remoteJid')
-                message_text = webhook_data.get('body') or webhook_data.get('text')
+            # 1. Extração
+            from_number, message_text = self.extract_message(webhook_data)
+            message_id = self.extract_message_id(webhook_data)
+            result['message_id'] = message_id
+            checkpoint = mark('extract', started)
             
-            # Validação
             if not from_number:
-                logger.warning(f"❌ 'from_number' não encontrado")
-                logger.info(f"📋 Keys disponíveis: {list(webhook_data.keys())}")
-                return False
+                logger.warning(f"❌ 'from_number' não encontrado (keys: {list(webhook_data.keys())})")
+                result['reason'] = 'missing_sender'
+                return result
             
             if not message_text:
-                logger.warning(f"❌ 'message_text' não encontrado")
-                logger.info(f"📋 Message keys: {list(message_info.keys())}")
-                return False
-            
-            logger.info(f"📱 De: {from_number}")
-            logger.info(f"💬 Texto: {message_text}")
+                logger.warning(f"❌ 'message_text' não encontrado de {from_number}")
+                result['reason'] = 'missing_text'
+                return result
             
-            # Normalização e busca
+            # 2. Correspondência no índice de telefones
             from_number_clean = self._normalize_phone_robust(from_number)
-            logger.info(f"📱 Normalizado: {from_number_clean}")
-            
+            result['from_number'] = from_number_clean
             matching_entry = self._find_matching_phone_improved(from_number_clean)
+            checkpoint = mark('match', checkpoint)
             
             if not matching_entry:
-                logger.info(f"⚠️ Número não monitorado: {from_number_clean}")
-                logger.info(f"📋 Monitorados: {[p[0] for p in self.monitored_phones]}")
-                return False
+                logger.info(f"⚠️ Número não monitorado: {from_number_clean} ({len(self._phone_index)} monitorados)")
+                result['reason'] = 'not_monitored'
+                return result
             
             meeting_id = matching_entry[1]
-            logger.info(f"🎯 MATCH! Reunião: {meeting_id}")
+            result['meeting_id'] = meeting_id
             
-            # Análise e salvamento
+            # 3. Análise
             analysis = ResponseAnalyzer.analyze_response(message_text)
-            logger.info(f"📊 Status: {analysis['status']} (confiança: {analysis['confidence']:.2%})")
-            
-            response_id = self._save_client_response_improved(
-                meeting_id=meeting_id,
-                response_text=message_text,
-                status=analysis['status'],
-                confidence=analysis['confidence'],
-                analysis_data=analysis
+            result['status'] = analysis['status']
+            result['confidence'] = analysis['confidence']
+            checkpoint = mark('analyze', checkpoint)
+            
+            # 4. Resposta + status na mesma transação
+            response_id, duplicate, status_updated = self._persist_response_and_status(
+                meeting_id, message_text, analysis, message_id
             )
+            mark('persist', checkpoint)
+            
+            result['response_id'] = response_id
+            result['duplicate'] = duplicate
+            result['status_updated'] = status_updated
             
             if not response_id:
-                logger.error("❌ Falha ao salvar resposta")
-                return False
+                result['reason'] = 'persist_failed'
+                return result
             
-            # Atualiza reunião se confiança suficiente
-            if analysis['confidence'] >= 0.15:
-                success = self._update_meeting_status_improved(meeting_id, analysis['status'], response_id)
+            result['processed'] = True
+            
+            if status_updated and analysis['status'] in ['confirmed', 'declined']:
+                self._remove_from_monitoring(meeting_id)
+            
+            logger.info(
+                f"🎯 Reunião {meeting_id}: {analysis['status']} ({analysis['confidence']:.2%}) "
+                f"resposta={response_id}{' (duplicada)' if duplicate else ''}"
+            )
+            return result
+            
+        except Exception as e:
+            logger.error(f"💥 Erro no processamento: {e}", exc_info=True)
+            result['reason'] = f'error: {e}'
+            return result
+        finally:
+            timings['total'] = round((time.perf_counter() - started) * 1000, 3)
+
+    @staticmethod
+    def _message_timestamp(message: Dict) -> int:
+        """messageTimestamp pode vir como número, texto ou Long ({"low": ...})"""
+        value = message.get('messageTimestamp') or 0
+        if isinstance(value, dict):
+            value = value.get('low') or 0
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return 0
+
+    def process_inbound_batch(self, messages: List[Dict]) -> Dict[str, Any]:
+        """Processa um lote (messages.set / messaging-history.set) em uma transação
+        
+        Uma busca no índice por remetente único, um executemany para as
+        respostas e um commit para o lote todo. Mensagens enviadas por nós
+        (key.fromMe) são ignoradas: o histórico reenviado também as contém.
+        """
+        summary = {
+            'received': len(messages),
+            'processed': 0,
+            'skipped': 0,
+            'duplicates': 0,
+            'meetings_updated': [],
+            'timings_ms': {}
+        }
+        timings = summary['timings_ms']
+        started = time.perf_counter()
+        
+        def mark(stage, since):
+            now = time.perf_counter()
+            timings[stage] = round((now - since) * 1000, 3)
+            return now
+        
+        try:
+            # 1. Extração (com o horário da própria mensagem; sem ele, agora)
+            now_ts = int(time.time())
+            extracted = []
+            for m in messages:
+                if not isinstance(m, dict) or (m.get('key') or {}).get('fromMe'):
+                    continue
+                sender, text = self.extract_message(m)
+                if sender and text:
+                    sent_ts = self._message_timestamp(m) or now_ts
+                    extracted.append((self._normalize_phone_robust(sender), text, self.extract_message_id(m), sent_ts))
+            checkpoint = mark('extract', started)
+            
+            # 2. Uma busca por remetente único
+            matches = {}
+            for sender in {f for f, _, _, _ in extracted}:
+                entry = self._find_matching_phone_improved(sender)
+                if entry:
+                    matches[sender] = entry[1]
+            checkpoint = mark('match', checkpoint)
+            
+            # 3. Análise
+            rows = []
+            seen = set()
+            for sender, text, message_id, sent_ts in extracted:
+                meeting_id = matches.get(sender)
+                dedup_key = message_id or (meeting_id, text)
+                if meeting_id is None or dedup_key in seen:
+                    continue
+                seen.add(dedup_key)
+                analysis = ResponseAnalyzer.analyze_response(text)
+                rows.append((meeting_id, text, analysis, message_id, sent_ts))
+            checkpoint = mark('analyze', checkpoint)
+            
+            # 4. Gravação em uma única transação
+            if rows:
+                meeting_ids = sorted({row[0] for row in rows})
+                placeholders = ','.join('?' * len(meeting_ids))
                 
-                if success:
-                    logger.info(f"✅ Reunião {meeting_id} atualizada para: {analysis['status']}")
+                with get_connection(DATABASE) as conn:
+                    cursor = conn.cursor()
                     
-                    if analysis['status'] in ['confirmed', 'declined']:
-                        self._remove_from_monitoring(meeting_id)
-                else:
-                    logger.error(f"❌ Falha ao atualizar reunião {meeting_id}")
-            
-            return True
+                    # Ids já gravados: uma consulta no índice único para o lote todo
+                    message_ids = [r[3] for r in rows if r[3]]
+                    known_ids = set()
+                    if message_ids:
+                        cursor.execute(f'''
+                            SELECT message_id FROM client_responses
+                            WHERE message_id IN ({','.join('?' * len(message_ids))})
+                        ''', message_ids)
+                        known_ids = {row[0] for row in cursor.fetchall()}
+                    
+                    # Mensagens sem id: regra antiga de texto igual em 5 minutos
+                    # (em torno do horário da mensagem, não do recebimento do lote)
+                    recent = {}
+                    no_id = [r for r in rows if not r[3]]
+                    if no_id:
+                        cursor.execute(f'''
+                            SELECT meeting_id, response_text, received_at_ts FROM client_responses
+                            WHERE meeting_id IN ({placeholders})
+                            AND received_at_ts BETWEEN ? AND ?
+                        ''', [*meeting_ids, min(r[4] for r in no_id) - 300, max(r[4] for r in no_id) + 300])
+                        for mid, text, ts in cursor.fetchall():
+                            recent.setdefault((mid, text), []).append(ts or 0)
+                    
+                    def is_duplicate(r):
+                        if r[3]:
+                            return r[3] in known_ids
+                        return any(abs(ts - r[4]) <= 300 for ts in recent.get((r[0], r[1]), ()))
+                    
+                    new_rows = sorted((r for r in rows if not is_duplicate(r)), key=lambda r: r[4])
+                    summary['duplicates'] = len(rows) - len(new_rows)
+                    
+                    cursor.executemany('''
+                        INSERT INTO client_responses (meeting_id, response_text, status, confidence, analysis_data, received_at, message_id)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT DO NOTHING
+                    ''', [
+                        (mid, text, a['status'], a['confidence'], json.dumps(a),
+                         datetime.fromtimestamp(sent_ts).isoformat(), message_id)
+                        for mid, text, a, message_id, sent_ts in new_rows
+                    ])
+                    
+                    # Só respostas novas mudam o status; a mais recente (messageTimestamp) prevalece
+                    final_status = {}
+                    for mid, _, a, _, _ in new_rows:
+                        if a['confidence'] >= self.MIN_STATUS_CONFIDENCE:
+                            final_status[mid] = a['status']
+                    updates = [(status, mid) for mid, status in final_status.items()]
+                    cursor.executemany('UPDATE reunioes SET status_confirmacao = ? WHERE id = ?', updates)
+                    conn.commit()
+                
+                summary['processed'] = len(new_rows)
+                summary['meetings_updated'] = [mid for _, mid in updates]
+                
+                for status, mid in updates:
+                    if status in ['confirmed', 'declined']:
+                        self._remove_from_monitoring(mid)
+            
+            mark('persist', checkpoint)
+            summary['skipped'] = summary['received'] - summary['processed'] - summary['duplicates']
+            logger.info(
+                f"📦 Lote processado: {summary['processed']}/{summary['received']} respostas, "
+                f"{len(summary['meetings_updated'])} reunião(ões) atualizada(s)"
+            )
+            return summary
             
         except Exception as e:
-            logger.error(f"💥 Erro no processamento: {e}")
-            import traceback
-            logger.error(f"📋 Traceback:\n{traceback.format_exc()}")
-            return False
+            logger.error(f"💥 Erro no processamento do lote: {e}", exc_info=True)
+            summary['error'] = str(e)
+            return summary
+        finally:
+            timings['total'] = round((time.perf_counter() - started) * 1000, 3)
+
+    def process_webhook_message(self, webhook_data: Dict) -> bool:
+        """Processa mensagem do webhook (compatibilidade: retorna apenas sucesso)"""
+        return self.process_inbound(webhook_data)['processed']
 
-    def _save_client_response_improved(self, meeting_id: int, response_text: str, status: str, confidence: float, analysis_data: dict) -> Optional[int]:
-        """Salva resposta do cliente com verificação de duplicatas"""
+    def _persist_response_and_status(self, meeting_id: int, response_text: str, analysis: Dict,
+                                     message_id: Optional[str] = None) -> Tuple[Optional[int], bool, bool]:
+        """Grava resposta e status da reunião em uma única transação
+        
+        Com message_id a deduplicação é feita pelo índice único (retentativas do
+        webhook viram no-op); sem ele, vale a regra antiga de texto igual em 5 min.
+        
+        Returns:
+            (response_id, duplicada, status_atualizado)
+        """
         try:
-            with sqlite3.connect(DATABASE) as conn:
+            with get_connection(DATABASE) as conn:
                 cursor = conn.cursor()
                 
-                # Verifica se já existe resposta idêntica nos últimos 5 minutos
-                cursor.execute('''
-                    SELECT id FROM client_responses 
-                    WHERE meeting_id = ? 
-                    AND response_text = ?
-                    AND datetime(received_at) >= datetime('now', '-5 minutes')
-                    LIMIT 1
-                ''', (meeting_id, response_text))
+                if message_id:
+                    cursor.execute('''
+                        INSERT INTO client_responses (meeting_id, response_text, status, confidence, analysis_data, received_at, message_id)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT DO NOTHING
+                    ''', (meeting_id, response_text, analysis['status'], analysis['confidence'],
+                          json.dumps(analysis), datetime.now().isoformat(), message_id))
+                    
+                    if cursor.rowcount == 0:
+                        cursor.execute('SELECT id FROM client_responses WHERE message_id = ?', (message_id,))
+                        existing = cursor.fetchone()
+                        logger.info(f"⚠️ Mensagem {message_id} já processada (ID existente: {existing[0] if existing else '?'})")
+                        return (existing[0] if existing else None), True, False
+                else:
+                    # Sem id da mensagem: verifica resposta idêntica nos últimos 5 minutos
+                    cursor.execute('''
+                        SELECT id FROM client_responses 
+                        WHERE meeting_id = ? 
+                        AND response_text = ?
+                        AND received_at_ts >= ?
+                        LIMIT 1
+                    ''', (meeting_id, response_text, int(time.time()) - 300))
+                    
+                    existing = cursor.fetchone()
+                    if existing:
+                        logger.info(f"⚠️ Resposta duplicada ignorada (ID existente: {existing[0]})")
+                        return existing[0], True, False
+                    
+                    cursor.execute('''
+                        INSERT INTO client_responses (meeting_id, response_text, status, confidence, analysis_data, received_at)
+                        VALUES (?, ?, ?, ?, ?, ?)
+                    ''', (meeting_id, response_text, analysis['status'], analysis['confidence'],
+                          json.dumps(analysis), datetime.now().isoformat()))
                 
-                existing = cursor.fetchone()
-                if existing:
-                    logger.info(f"⚠️ Resposta duplicada ignorada (ID existente: {existing[0]})")
-                    return existing[0]
+                response_id = cursor.lastrowid
                 
-                # Insere nova resposta
-                cursor.execute('''
-                    INSERT INTO client_responses (meeting_id, response_text, status, confidence, analysis_data, received_at)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (meeting_id, response_text, status, confidence, json.dumps(analysis_data), datetime.now().isoformat()))
+                status_updated = False
+                if analysis['confidence'] >= self.MIN_STATUS_CONFIDENCE:
+                    cursor.execute('UPDATE reunioes SET status_confirmacao = ? WHERE id = ?',
+                                   (analysis['status'], meeting_id))
+                    status_updated = cursor.rowcount > 0
+                    if not status_updated:
+                        logger.error(f"❌ Reunião {meeting_id} não existe")
                 
-                response_id = cursor.lastrowid
                 conn.commit()
-                
-                logger.info(f"💾 Resposta salva com ID: {response_id}")
-                return response_id
+                return response_id, False, status_updated
                 
         except Exception as e:
-            logger.error(f"❌ Erro ao salvar resposta: {e}")
-            return None
+            logger.error(f"❌ Erro ao salvar resposta/status: {e}")
+            return None, False, False
 
 
     def _normalize_phone_robust(self, phone_input):
@@ -773,139 +1053,51 @@ class WhatsAppMonitor:
         if digits_only.startswith('5555'):
             digits_only = digits_only[2:]
         
-        logger.info(f"🔄 Normalização: '{phone_input}' → '{digits_only}'")
+        logger.debug(f"🔄 Normalização: '{phone_input}' → '{digits_only}'")
         return digits_only
     
     # CORREÇÃO CRÍTICA: Adicione estes métodos na classe WhatsAppMonitor
 
     def _find_matching_phone_improved(self, from_number_clean):
-        """MÉTODO QUE ESTAVA FALTANDO - Busca correspondência melhorada"""
-        logger.info(f"🔍 Buscando match melhorado para: {from_number_clean}")
-        
-        for monitored_phone, meeting_id in self.monitored_phones:
-            monitored_clean = self._normalize_phone_robust(monitored_phone)
-            
-            logger.info(f"   Comparando: {from_number_clean} vs {monitored_clean}")
-            
-            # Estratégias de comparação (da mais específica para mais genérica)
-            strategies = [
-                # 1. Igualdade exata
-                lambda f, m: f == m,
-                
-                # 2. Últimos 11 dígitos (celular brasileiro com DDD)
-                lambda f, m: len(f) >= 11 and len(m) >= 11 and f[-11:] == m[-11:],
-                
-                # 3. Últimos 10 dígitos (número sem código país)
-                lambda f, m: len(f) >= 10 and len(m) >= 10 and f[-10:] == m[-10:],
-                
-                # 4. Últimos 9 dígitos (número sem DDD)
-                lambda f, m: len(f) >= 9 and len(m) >= 9 and f[-9:] == m[-9:],
-                
-                # 5. Um contém o outro (mínimo 9 dígitos)
-                lambda f, m: len(min(f, m)) >= 9 and (f in m or m in f),
-                
-                # 6. Diferença apenas no 9 (celular)
-                lambda f, m: (len(f) == 13 and len(m) == 12 and f[:4] + f[5:] == m) or
-                            (len(m) == 13 and len(f) == 12 and m[:4] + m[5:] == f)
-            ]
-            
-            for i, strategy in enumerate(strategies):
-                try:
-                    if strategy(from_number_clean, monitored_clean):
-                        logger.info(f"🎯 MATCH via estratégia {i+1}!")
-                        return (monitored_phone, meeting_id)
-                except:
-                    continue
+        """Busca correspondência no índice de telefones (O(1) por estratégia)"""
+        self.refresh_registry()
+        entry, strategy = self._phone_index.find(from_number_clean)
         
-        logger.info(f"❌ Nenhum match encontrado")
-        return None
+        if entry:
+            logger.info(f"🎯 MATCH via estratégia {strategy}: {from_number_clean} → {entry[0]}")
+        else:
+            logger.info(f"❌ Nenhum match encontrado para {from_number_clean}")
+        return entry
 
-    def _update_meeting_status_improved(self, meeting_id: int, status: str, response_id: int) -> bool:
-        """Atualiza status da reunião - MÉTODO QUE ESTAVA FALTANDO"""
-        try:
-            logger.info(f"🔄 DEBUG: Atualizando reunião {meeting_id} para {status}")
-            
-            with sqlite3.connect(DATABASE) as conn:
-                cursor = conn.cursor()
-                
-                # Busca reunião atual
-                cursor.execute('SELECT id, titulo, status_confirmacao FROM reunioes WHERE id = ?', (meeting_id,))
-                current = cursor.fetchone()
-                
-                if not current:
-                    logger.error(f"❌ Reunião {meeting_id} não existe")
-                    return False
-                
-                old_status = current[2]
-                
-                # Atualiza status
-                cursor.execute('UPDATE reunioes SET status_confirmacao = ? WHERE id = ?', (status, meeting_id))
-                rows = cursor.rowcount
-                conn.commit()
-                
-                logger.info(f"✅ Status atualizado: {old_status} → {status} ({rows} linha(s))")
-                return rows > 0
-                
-        except Exception as e:
-            logger.error(f"❌ Erro ao atualizar: {e}")
-            return False
-        
     def _find_matching_phone(self, from_number_clean):
-        """Busca correspondência com múltiplas estratégias - MÉTODO QUE ESTAVA FALTANDO"""
-        logger.info(f"🔍 Buscando match para: {from_number_clean}")
-        
-        for monitored_phone, meeting_id in self.monitored_phones:
-            monitored_clean = self._normalize_phone_robust(monitored_phone)
-            
-            logger.info(f"   Comparando: {from_number_clean} vs {monitored_clean}")
-            
-            # Estratégias de comparação (da mais específica para mais genérica)
-            strategies = [
-                # 1. Igualdade exata
-                lambda f, m: f == m,
-                
-                # 2. Últimos 11 dígitos (celular brasileiro com DDD)
-                lambda f, m: len(f) >= 11 and len(m) >= 11 and f[-11:] == m[-11:],
-                
-                # 3. Últimos 10 dígitos (número sem código país)
-                lambda f, m: len(f) >= 10 and len(m) >= 10 and f[-10:] == m[-10:],
-                
-                # 4. Últimos 9 dígitos (número sem DDD)
-                lambda f, m: len(f) >= 9 and len(m) >= 9 and f[-9:] == m[-9:],
-                
-                # 5. Um contém o outro (mínimo 9 dígitos)
-                lambda f, m: len(min(f, m)) >= 9 and (f in m or m in f),
-                
-                # 6. Diferença apenas no 9 (celular)
-                lambda f, m: (len(f) == 13 and len(m) == 12 and f[:4] + f[5:] == m) or
-                            (len(m) == 13 and len(f) == 12 and m[:4] + m[5:] == f)
-            ]
-            
-            for i, strategy in enumerate(strategies):
-                try:
-                    if strategy(from_number_clean, monitored_clean):
-                        logger.info(f"🎯 MATCH via estratégia {i+1}!")
-                        return (monitored_phone, meeting_id)
-                except:
-                    continue
-        
-        logger.info(f"❌ Nenhum match encontrado")
-        return None
+        """Alias mantido por compatibilidade"""
+        return self._find_matching_phone_improved(from_number_clean)
         
     def _remove_from_monitoring(self, meeting_id: int):
         """Remove reunião do monitoramento"""
-        before_count = len(self.monitored_phones)
-        self.monitored_phones = {(phone, mid) for phone, mid in self.monitored_phones if mid != meeting_id}
-        after_count = len(self.monitored_phones)
+        before_count = len(self._phone_index)
+        try:
+            with get_connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM monitoring_registry WHERE meeting_id = ?', (meeting_id,))
+                if cursor.rowcount:
+                    self._bump_registry_version(cursor)
+                conn.commit()
+            self.refresh_registry()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Falha ao remover do registro de monitoramento: {e}")
+            with self._index_lock:
+                self._swap_index([e for e in self._phone_index.entries if e[1] != meeting_id])
+        after_count = len(self._phone_index)
         
         if before_count > after_count:
             logger.info(f"✅ Reunião {meeting_id} removida do monitoramento ({before_count} -> {after_count})")
-            logger.info(f"📊 Telefones ainda monitorados: {list(self.monitored_phones)}")
         else:
             logger.warning(f"⚠️ Reunião {meeting_id} não encontrada para remoção do monitoramento")
     
     def get_monitoring_status(self):
         """Retorna status atual do monitoramento"""
+        self.refresh_registry()
         return {
             'monitoring_active': self.monitoring,
             'monitored_count': len(self.monitored_phones),
@@ -914,8 +1106,17 @@ class WhatsAppMonitor:
     
     def clear_all_monitoring(self):
         """Limpa todo o monitoramento (útil para debug)"""
-        before_count = len(self.monitored_phones)
-        self.monitored_phones.clear()
+        before_count = len(self._phone_index)
+        try:
+            with get_connection(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute('DELETE FROM monitoring_registry')
+                self._bump_registry_version(cursor)
+                conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Falha ao limpar registro de monitoramento: {e}")
+        with self._index_lock:
+            self._swap_index(())
         logger.info(f"🧹 Monitoramento limpo: {before_count} telefones removidos")
 
 class MessageTemplateManager:
@@ -940,53 +1141,103 @@ Por favor, confirme sua presença respondendo esta mensagem com "SIM" ou "NÃO".
 Atenciosamente,
 **Equipe 2D Consultores** ✨"""
     
+    # Placeholders aceitos no template
+    PLACEHOLDERS = ('nome_convidado', 'data_reuniao', 'hora_reuniao', 'assunto',
+                    'nome_cliente', 'local_reuniao', 'link_reuniao')
+    _PLACEHOLDER_RE = re.compile(r'\{(' + '|'.join(PLACEHOLDERS) + r')\}')
+    
+    # Cache em processo: (versão, texto). A versão é o id da linha em whatsapp_config
+    # (AUTOINCREMENT: cada save_template gera um id maior), então um save feito em
+    # outro processo é visto aqui em até TEMPLATE_VERSION_TTL segundos.
+    TEMPLATE_VERSION_TTL = float(os.getenv('TEMPLATE_VERSION_TTL', '5'))
+    _cached = None
+    _checked_at = 0.0
+    _cache_lock = threading.Lock()
+    
+    @staticmethod
+    def _store_cache(version: int, template: str):
+        """Nunca troca uma versão mais nova por uma mais antiga"""
+        with MessageTemplateManager._cache_lock:
+            cached = MessageTemplateManager._cached
+            if cached is None or cached[0] <= version:
+                MessageTemplateManager._cached = (version, template)
+            MessageTemplateManager._checked_at = time.monotonic()
+    
+    @staticmethod
+    @lru_cache(maxsize=32)
+    def compile_template(template: str) -> Tuple[Tuple[str, ...], Tuple[Tuple[int, str], ...]]:
+        """Divide o template em (segmentos, [(posição, placeholder)]) para renderizar com um join"""
+        parts = MessageTemplateManager._PLACEHOLDER_RE.split(template)
+        # re.split com grupo: índices ímpares são os nomes dos placeholders
+        slots = tuple((i, parts[i]) for i in range(1, len(parts), 2))
+        return tuple(parts), slots
+    
     @staticmethod
     def save_template(template: str) -> bool:
         """Salva template no banco com validação"""
         try:
-            with sqlite3.connect(DATABASE) as conn:
+            with get_connection(DATABASE) as conn:
                 cursor = conn.cursor()
                 cursor.execute('DELETE FROM whatsapp_config')
                 cursor.execute(
                     'INSERT INTO whatsapp_config (template_message) VALUES (?)', 
                     (template,)
                 )
+                version = cursor.lastrowid
                 conn.commit()
-                logger.info("Template salvo com sucesso")
-                return True
+            MessageTemplateManager._store_cache(version, template)
+            logger.info("Template salvo com sucesso")
+            return True
         except Exception as e:
             logger.error(f"Erro ao salvar template: {e}")
             return False
     
     @staticmethod
     def load_template() -> str:
-        """Carrega template do banco"""
+        """Carrega template (cache em processo, revalidado pelo id em whatsapp_config a cada TTL)"""
+        cached = MessageTemplateManager._cached
+        if cached and time.monotonic() - MessageTemplateManager._checked_at < MessageTemplateManager.TEMPLATE_VERSION_TTL:
+            return cached[1]
         try:
-            with sqlite3.connect(DATABASE) as conn:
+            with get_connection(DATABASE) as conn:
                 cursor = conn.cursor()
-                cursor.execute('SELECT template_message FROM whatsapp_config ORDER BY id DESC LIMIT 1')
+                if cached:
+                    cursor.execute('SELECT MAX(id) FROM whatsapp_config')
+                    row = cursor.fetchone()
+                    if row and row[0] == cached[0]:
+                        MessageTemplateManager._checked_at = time.monotonic()
+                        return cached[1]
+                # Versão e texto na mesma consulta: um save concorrente não mistura os dois
+                cursor.execute('SELECT id, template_message FROM whatsapp_config ORDER BY id DESC LIMIT 1')
                 result = cursor.fetchone()
-                
-                if result and result[0]:
-                    return result[0]
-                else:
-                    # Salva e retorna template padrão
-                    default = MessageTemplateManager.get_default_template()
-                    MessageTemplateManager.save_template(default)
-                    return default
+            
+            if result and result[1]:
+                version, template = result
+                MessageTemplateManager._store_cache(version, template)
+                return template
+            else:
+                # Salva e retorna template padrão
+                default = MessageTemplateManager.get_default_template()
+                MessageTemplateManager.save_template(default)
+                return default
         except Exception as e:
             logger.error(f"Erro ao carregar template: {e}")
             return MessageTemplateManager.get_default_template()
     
+    @staticmethod
+    def _parse_data_hora(data_hora: str) -> datetime:
+        """ISO-8601 pelo caminho rápido; dateutil só para formatos livres"""
+        try:
+            return datetime.fromisoformat(data_hora)
+        except (TypeError, ValueError):
+            return parser.parse(data_hora)
+    
     @staticmethod
     def format_message(template: str, meeting_data: Dict[str, Any]) -> str:
         """Formata mensagem substituindo placeholders - VERSÃO CORRIGIDA"""
         try:
             # Parse da data/hora
-            data_hora = meeting_data.get('data_hora', '')
-            data_obj = parser.parse(data_hora)
-            data_formatada = data_obj.strftime('%d/%m/%Y')
-            hora_formatada = data_obj.strftime('%H:%M')
+            data_obj = MessageTemplateManager._parse_data_hora(meeting_data.get('data_hora', ''))
             
             # Monta link da reunião se existir
             link_reuniao = ""
@@ -994,131 +1245,104 @@ Atenciosamente,
                 link_reuniao = f"🔗 **Link da Reunião:** {meeting_data['link']}"
             
             # MAPEAMENTO CORRETO dos placeholders
-            replacements = {
-                '{nome_convidado}': meeting_data.get('convidado', ''),
-                '{data_reuniao}': data_formatada,
-                '{hora_reuniao}': hora_formatada,
-                '{assunto}': meeting_data.get('assunto', ''),
-                '{nome_cliente}': meeting_data.get('nome_cliente', ''),
-                '{local_reuniao}': meeting_data.get('local_reuniao', 'A definir'),
-                '{link_reuniao}': link_reuniao
+            values = {
+                'nome_convidado': meeting_data.get('convidado', ''),
+                'data_reuniao': f"{data_obj.day:02d}/{data_obj.month:02d}/{data_obj.year:04d}",
+                'hora_reuniao': f"{data_obj.hour:02d}:{data_obj.minute:02d}",
+                'assunto': meeting_data.get('assunto', ''),
+                'nome_cliente': meeting_data.get('nome_cliente', ''),
+                'local_reuniao': meeting_data.get('local_reuniao', 'A definir'),
+                'link_reuniao': link_reuniao
             }
             
-            # Substitui cada placeholder
-            formatted_message = template
-            for placeholder, value in replacements.items():
-                formatted_message = formatted_message.replace(placeholder, str(value) if value else '')
-            
-            return formatted_message
+            # Renderiza com um único join sobre os segmentos pré-compilados
+            segments, slots = MessageTemplateManager.compile_template(template)
+            parts = list(segments)
+            for index, name in slots:
+                value = values[name]
+                parts[index] = str(value) if value else ''
+            return ''.join(parts)
             
         except Exception as e:
             logger.error(f"Erro ao formatar mensagem: {e}")
             return template
 
 class AutoMessageSender:
-    """Classe para envio automático de mensagens em background"""
+    """Envio automático de confirmações via outbox (durável, com retry no dispatcher)"""
     
     @staticmethod
-    def send_confirmation_message_async(meeting_id: int, delay_seconds: int = 2):
-        """Envia mensagem de confirmação de forma assíncrona"""
-        def _send_message():
-            try:
-                # Aguarda um pouco para garantir que a reunião foi salva
-                time.sleep(delay_seconds)
-                
-                # Busca dados da reunião
-                with sqlite3.connect(DATABASE) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute('SELECT * FROM reunioes WHERE id = ?', (meeting_id,))
-                    meeting = cursor.fetchone()
-                    
-                    if not meeting:
-                        logger.error(f"Reunião {meeting_id} não encontrada para envio automático")
-                        return
-                
-                # Verifica se tem telefone
-                telefone_cliente = meeting[7] if len(meeting) > 7 else None
-                if not telefone_cliente:
-                    logger.warning(f"Reunião {meeting_id} sem telefone - não enviando confirmação automática")
-                    return
-                
-                # Verifica se WhatsApp está conectado
-                connected, _ = evolution_manager.check_connection_status()
-                if not connected:
-                    logger.warning(f"WhatsApp não conectado - não enviando confirmação automática para reunião {meeting_id}")
-                    # Salva tentativa no log mesmo sem enviar
-                    log_whatsapp_message(
-                        meeting_id=meeting_id,
-                        phone=telefone_cliente,
-                        message="[AUTOMÁTICO] Tentativa de envio - WhatsApp não conectado",
-                        status="failed",
-                        error_message="WhatsApp não estava conectado no momento do envio automático"
-                    )
-                    return
-                
-                # Prepara dados para formatação
-                meeting_data = {
-                    'id': meeting[0],
-                    'titulo': meeting[1],
-                    'convidado': meeting[2],
-                    'data_hora': meeting[3],
-                    'assunto': meeting[4],
-                    'link': meeting[5] or '',
-                    'nome_cliente': meeting[6] or '',
-                    'telefone_cliente': telefone_cliente,
-                    'local_reuniao': meeting[8] if len(meeting) > 8 else ''
-                }
-                
-                # Carrega e formata template
-                template = MessageTemplateManager.load_template()
-                formatted_message = MessageTemplateManager.format_message(template, meeting_data)
-                
-                # Adiciona indicador de mensagem automática
-                formatted_message = "" + formatted_message
-                
-                # Normaliza telefone
-                normalized_phone = evolution_manager.normalize_phone_number(telefone_cliente)
-                
-                logger.info(f"Enviando confirmação automática para reunião {meeting_id}, telefone: {normalized_phone}")
-                
-                # Envia mensagem
-                success, result_message = evolution_manager.send_message(telefone_cliente, formatted_message)
-                
-                # Registra log
-                log_whatsapp_message(
-                    meeting_id=meeting_id,
-                    phone=normalized_phone,
-                    message=formatted_message,
-                    status="success" if success else "failed",
-                    error_message=None if success else result_message
-                )
-                
-                if success:
-                    logger.info(f"Confirmação automática enviada com sucesso para reunião {meeting_id}")
-                    
-                    # Adiciona telefone ao monitoramento para capturar resposta
-                    whatsapp_monitor.add_phone_to_monitor(telefone_cliente, meeting_id)
-                    
-                else:
-                    logger.error(f"Falha no envio automático para reunião {meeting_id}: {result_message}")
-                    
-            except Exception as e:
-                logger.error(f"Erro no envio automático para reunião {meeting_id}: {e}")
-                # Registra erro no log
-                try:
-                    log_whatsapp_message(
-                        meeting_id=meeting_id,
-                        phone="",
-                        message="[AUTOMÁTICO] Erro no envio",
-                        status="error",
-                        error_message=f"Erro interno: {str(e)}"
-                    )
-                except:
-                    pass
-        
-        # Executa em thread separada para não bloquear a resposta
-        thread = threading.Thread(target=_send_message, daemon=True)
-        thread.start()
+    def send_confirmation_message_async(meeting_id: int, delay_seconds: int = 1) -> Tuple[bool, str]:
+        """Formata a confirmação da reunião e enfileira na outbox"""
+        try:
+            meeting = meetings_repo.get(meeting_id)
+            
+            if not meeting:
+                logger.error(f"Reunião {meeting_id} não encontrada")
+                return False, "Reunião não encontrada"
+            
+            telefone_cliente = meeting.telefone_cliente
+            if not telefone_cliente:
+                logger.warning(f"Reunião {meeting_id} sem telefone")
+                AutoMessageSender._log_failed_attempt(meeting_id, "", "Telefone não informado", "no_phone")
+                return False, "Telefone não informado"
+            
+            meeting_data = {
+                'convidado': meeting.convidado,
+                'data_hora': meeting.data_hora,
+                'assunto': meeting.assunto,
+                'link': meeting.link or '',
+                'nome_cliente': meeting.nome_cliente or '',
+                'local_reuniao': meeting.local_reuniao or ''
+            }
+            
+            # Carrega e formata template
+            template = MessageTemplateManager.load_template()
+            formatted_message = MessageTemplateManager.format_message(template, meeting_data)
+            
+            outbox_id = outbox.enqueue(
+                'confirmacao', telefone_cliente, formatted_message,
+                ref_id=meeting_id,
+                dedupe_key=f"confirmacao:{meeting_id}",
+                delay_seconds=delay_seconds
+            )
+            if outbox_id is None:
+                return True, "Confirmação já estava na fila"
+            
+            logger.info(f"🚀 Confirmação da reunião {meeting_id} enfileirada (outbox {outbox_id})")
+            return True, "Confirmação na fila de envio"
+            
+        except Exception as e:
+            logger.error(f"💥 Erro ao enfileirar confirmação da reunião {meeting_id}: {e}")
+            AutoMessageSender._log_failed_attempt(meeting_id, "", f"Erro interno: {str(e)}", "internal_error")
+            return False, f"Erro interno: {str(e)}"
+    
+    @staticmethod
+    def _log_success(meeting_id: int, phone: str, message: str):
+        """Registra sucesso no envio automático"""
+        try:
+            with get_connection(DATABASE) as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO whatsapp_logs (meeting_id, phone, message, status, error_message)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (meeting_id, phone, message, "auto_success", None))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Erro ao registrar sucesso: {e}")
+    
+    @staticmethod
+    def _log_failed_attempt(meeting_id: int, phone: str, error_msg: str, error_type: str):
+        """Registra falha no envio automático"""
+        try:
+            with get_connection(DATABASE) as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO whatsapp_logs (meeting_id, phone, message, status, error_message)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (meeting_id, phone, f"[AUTOMÁTICO] Falha: {error_type}", "auto_failed", error_msg))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Erro ao registrar falha: {e}")
 
 # Instâncias globais
 evolution_manager = EvolutionAPIManager(EVOLUTION_API_CONFIG)
@@ -1127,201 +1351,162 @@ whatsapp_monitor = WhatsAppMonitor(evolution_manager)
 # ==========================
 # === BANCO DE DADOS =======
 # ==========================
-def init_db():
-    with sqlite3.connect(DATABASE) as conn:
-        cursor = conn.cursor()
-        
-        # Verifica e cria/atualiza tabela reunioes
-        cursor.execute("PRAGMA table_info(reunioes)")
-        colunas = [coluna[1] for coluna in cursor.fetchall()]
-        
-        if 'reunioes' not in [table[0] for table in cursor.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()]:
-            cursor.execute('''
-                CREATE TABLE reunioes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    titulo TEXT NOT NULL,
-                    convidado TEXT NOT NULL,
-                    data_hora TEXT NOT NULL,
-                    assunto TEXT NOT NULL,
-                    link TEXT,
-                    nome_cliente TEXT,
-                    telefone_cliente TEXT,
-                    local_reuniao TEXT,
-                    status_confirmacao TEXT DEFAULT 'pending'
-                )
-            ''')
-            logger.info("Tabela reunioes criada")
-        else:
-            # Adiciona colunas se não existirem
-            if 'local_reuniao' not in colunas:
-                cursor.execute('ALTER TABLE reunioes ADD COLUMN local_reuniao TEXT')
-                logger.info("Coluna local_reuniao adicionada")
-            
-            if 'status_confirmacao' not in colunas:
-                cursor.execute('ALTER TABLE reunioes ADD COLUMN status_confirmacao TEXT DEFAULT "pending"')
-                logger.info("Coluna status_confirmacao adicionada")
-        
-        # Tabela para configurações do WhatsApp
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS whatsapp_config (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                template_message TEXT,
-                last_update DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Tabela para log de mensagens enviadas
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS whatsapp_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                meeting_id INTEGER,
-                phone TEXT,
-                message TEXT,
-                status TEXT,
-                sent_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                error_message TEXT,
-                FOREIGN KEY (meeting_id) REFERENCES reunioes (id)
-            )
-        ''')
-        
-        # Tabela de respostas dos clientes
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS client_responses (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                meeting_id INTEGER,
-                response_text TEXT,
-                status TEXT,
-                confidence REAL,
-                analysis_data TEXT,
-                received_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                processed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (meeting_id) REFERENCES reunioes (id)
-            )
-        ''')
-
-          # Tabela para log de payloads recebidos no webhook
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS webhook_incoming_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                received_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                event TEXT,
-                instance TEXT,
-                raw_payload TEXT
-            )
-        ''')
-
-        # ========== 🆕 TABELA DE EVENTOS ==========
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS eventos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                titulo TEXT NOT NULL,
-                tipo TEXT NOT NULL,
-                data_inicio TEXT NOT NULL,
-                data_fim TEXT NOT NULL,
-                local TEXT,
-                descricao TEXT,
-                participantes TEXT,
-                cor TEXT DEFAULT 'amarelo',
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        if 'numero_pessoas' not in colunas:
-            cursor.execute('ALTER TABLE reunioes ADD COLUMN numero_pessoas INTEGER')
-            logger.info("Coluna numero_pessoas adicionada")
-
-        conn.commit()
-
-def ensure_created_at_column():
-    """Garante a existência da coluna created_at em reunioes, migrando se necessário."""
-    with sqlite3.connect(DATABASE) as conn:
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA table_info(reunioes)")
-        colunas_existentes = [c[1] for c in cursor.fetchall()]
+def _migracao_agenda_tabelas_base(conn):
+    """v1: tabelas do app (idempotente para bancos anteriores ao schema_version)"""
+    cursor = conn.cursor()
 
-        if 'created_at' in colunas_existentes:
-            return
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reunioes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            titulo TEXT NOT NULL,
+            convidado TEXT NOT NULL,
+            data_hora TEXT NOT NULL,
+            assunto TEXT NOT NULL,
+            link TEXT,
+            nome_cliente TEXT,
+            telefone_cliente TEXT,
+            local_reuniao TEXT,
+            status_confirmacao TEXT DEFAULT 'pending'
+        )
+    ''')
+    if not column_exists(conn, 'reunioes', 'local_reuniao'):
+        cursor.execute('ALTER TABLE reunioes ADD COLUMN local_reuniao TEXT')
+    if not column_exists(conn, 'reunioes', 'status_confirmacao'):
+        cursor.execute("ALTER TABLE reunioes ADD COLUMN status_confirmacao TEXT DEFAULT 'pending'")
+    if not column_exists(conn, 'reunioes', 'numero_pessoas'):
+        cursor.execute('ALTER TABLE reunioes ADD COLUMN numero_pessoas INTEGER')
+
+    # Tabela para configurações do WhatsApp
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS whatsapp_config (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            template_message TEXT,
+            last_update DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Tabela para log de mensagens enviadas
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS whatsapp_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            meeting_id INTEGER,
+            phone TEXT,
+            message TEXT,
+            status TEXT,
+            sent_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            error_message TEXT,
+            FOREIGN KEY (meeting_id) REFERENCES reunioes (id)
+        )
+    ''')
+
+    # Tabela de respostas dos clientes
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS client_responses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            meeting_id INTEGER,
+            response_text TEXT,
+            status TEXT,
+            confidence REAL,
+            analysis_data TEXT,
+            received_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            processed_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (meeting_id) REFERENCES reunioes (id)
+        )
+    ''')
+
+    # Tabela para log de payloads recebidos no webhook
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_incoming_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            received_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            event TEXT,
+            instance TEXT,
+            raw_payload TEXT
+        )
+    ''')
+
+    # Id da mensagem no WhatsApp (key.id) - torna o processamento idempotente
+    if not column_exists(conn, 'client_responses', 'message_id'):
+        cursor.execute('ALTER TABLE client_responses ADD COLUMN message_id TEXT')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_client_responses_message_id ON client_responses (message_id)')
+
+    # Payload compactado (zlib) - raw_payload fica só para registros antigos
+    if not column_exists(conn, 'webhook_incoming_logs', 'raw_payload_zlib'):
+        cursor.execute('ALTER TABLE webhook_incoming_logs ADD COLUMN raw_payload_zlib BLOB')
+
+    # Registro persistente de telefones monitorados (compartilhado entre processos)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS monitoring_registry (
+            meeting_id INTEGER PRIMARY KEY,
+            phone TEXT NOT NULL,
+            expires_at INTEGER NOT NULL,
+            updated_at REAL NOT NULL,
+            FOREIGN KEY (meeting_id) REFERENCES reunioes (id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_monitoring_registry_phone ON monitoring_registry (phone)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_monitoring_registry_expires ON monitoring_registry (expires_at)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS monitoring_registry_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO monitoring_registry_version (id, version) VALUES (1, 0)')
+
+    # ========== 🆕 TABELA DE EVENTOS ==========
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS eventos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            titulo TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            data_inicio TEXT NOT NULL,
+            data_fim TEXT NOT NULL,
+            local TEXT,
+            descricao TEXT,
+            participantes TEXT,
+            cor TEXT DEFAULT 'amarelo',
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
 
-        # Tenta via ALTER TABLE primeiro
-        try:
-            cursor.execute('ALTER TABLE reunioes ADD COLUMN created_at TEXT')
-            cursor.execute('UPDATE reunioes SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL')
-            conn.commit()
-            logger.info("Coluna created_at adicionada via ALTER TABLE e populada")
-            return
-        except sqlite3.OperationalError as e:
-            logger.warning(f"ALTER TABLE created_at falhou, migrando tabela: {e}")
 
-        # Migração completa recriando a tabela
-        cursor.execute("PRAGMA table_info(reunioes)")
-        colunas_existentes = [c[1] for c in cursor.fetchall()]
+def _migracao_agenda_created_at(conn):
+    """v2: reunioes.created_at, preenchida nas linhas antigas"""
+    if not column_exists(conn, 'reunioes', 'created_at'):
+        conn.execute('ALTER TABLE reunioes ADD COLUMN created_at TEXT')
+    conn.execute('UPDATE reunioes SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL')
 
-        sel_local_reuniao = 'local_reuniao' if 'local_reuniao' in colunas_existentes else "'' AS local_reuniao"
-        sel_status = 'status_confirmacao' if 'status_confirmacao' in colunas_existentes else "'pending' AS status_confirmacao"
 
-        cursor.execute('PRAGMA foreign_keys = OFF')
-        cursor.execute('BEGIN TRANSACTION')
+def _migracao_agenda_colunas_epoch(conn):
+    """v3: epoch UTC indexado para filtros por intervalo (mantido por trigger)"""
+    ensure_epoch_column(conn, 'reunioes', 'data_hora')
+    ensure_epoch_column(conn, 'client_responses', 'received_at')
+    ensure_epoch_column(conn, 'whatsapp_logs', 'sent_at', source_is_utc=True)
 
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS reunioes_new (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                titulo TEXT NOT NULL,
-                convidado TEXT NOT NULL,
-                data_hora TEXT NOT NULL,
-                assunto TEXT NOT NULL,
-                link TEXT,
-                nome_cliente TEXT,
-                telefone_cliente TEXT,
-                local_reuniao TEXT,
-                status_confirmacao TEXT DEFAULT 'pending',
-                created_at TEXT
-            )
-        ''')
 
-        insert_sql = f'''
-            INSERT INTO reunioes_new (
-                id, titulo, convidado, data_hora, assunto, link, nome_cliente,
-                telefone_cliente, local_reuniao, status_confirmacao, created_at
-            )
-            SELECT
-                id, titulo, convidado, data_hora, assunto, link, nome_cliente,
-                telefone_cliente, {sel_local_reuniao}, {sel_status}, CURRENT_TIMESTAMP
-            FROM reunioes
-        '''
-        cursor.execute(insert_sql)
+MIGRACOES_AGENDA = [
+    (1, 'tabelas_base', _migracao_agenda_tabelas_base),
+    (2, 'reunioes_created_at', _migracao_agenda_created_at),
+    (3, 'colunas_epoch', _migracao_agenda_colunas_epoch),
+]
 
-        cursor.execute('DROP TABLE reunioes')
-        cursor.execute('ALTER TABLE reunioes_new RENAME TO reunioes')
 
-        cursor.execute('COMMIT')
-        cursor.execute('PRAGMA foreign_keys = ON')
-        logger.info("Tabela reunioes migrada com created_at")
+def init_db():
+    """Aplica as migrações pendentes do banco de reuniões (uma vez, na inicialização)"""
+    run_migrations(DATABASE, 'agenda', MIGRACOES_AGENDA)
 
 def get_reunioes():
     try:
-        with sqlite3.connect(DATABASE) as conn:
-            cursor = conn.cursor()
-            
-            # SELECT explícito - ordem garantida
-            cursor.execute("""
-                SELECT 
-                    id, titulo, convidado, data_hora, assunto, 
-                    link, nome_cliente, telefone_cliente, 
-                    local_reuniao, status_confirmacao, numero_pessoas
-                FROM reunioes 
-                ORDER BY data_hora
-            """)
-            
-            return cursor.fetchall()
+        return meetings_repo.list_all()
     except Exception as e:
         logger.error(f"Erro ao buscar reuniões: {e}")
         return []
 
 def salvar_reuniao_db(titulo, convidado, data_hora, departamentos, link, nome_cliente, telefone_cliente, local_reuniao, numero_pessoas=None):
-    """VERSÃO CORRIGIDA - Garante created_at e insere a reunião com numero_pessoas"""
-    ensure_created_at_column()
-    with sqlite3.connect(DATABASE) as conn:
+    """Insere a reunião com numero_pessoas e created_at (schema garantido pelas migrações do boot)"""
+    with get_connection(DATABASE) as conn:
         cursor = conn.cursor()
         cursor.execute('''
             INSERT INTO reunioes (titulo, convidado, data_hora, assunto, link, nome_cliente, telefone_cliente, local_reuniao, numero_pessoas, status_confirmacao, created_at)
@@ -1335,7 +1520,7 @@ def salvar_reuniao_db(titulo, convidado, data_hora, departamentos, link, nome_cl
 def log_whatsapp_message(meeting_id: int, phone: str, message: str, status: str, error_message: str = None):
     """Registra log de mensagem enviada"""
     try:
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO whatsapp_logs (meeting_id, phone, message, status, error_message)
@@ -1348,7 +1533,7 @@ def log_whatsapp_message(meeting_id: int, phone: str, message: str, status: str,
 def save_client_response(meeting_id: int, response_text: str, status: str, confidence: float, analysis_data: str, received_at: str):
     """Salva resposta do cliente no banco"""
     try:
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO client_responses (meeting_id, response_text, status, confidence, analysis_data, received_at)
@@ -1362,7 +1547,7 @@ def save_client_response(meeting_id: int, response_text: str, status: str, confi
 def update_meeting_status(meeting_id: int, status: str):
     """Atualiza status de confirmação da reunião - VERSÃO CORRIGIDA"""
     try:
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             
             # CORREÇÃO: Verifica se a reunião existe primeiro
@@ -1466,7 +1651,7 @@ def verificar_duplicata_recente(titulo, convidado, data_hora, janela_segundos=30
         agora = datetime.now()
         inicio_janela = agora - timedelta(seconds=janela_segundos)
         
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT id, titulo, convidado, created_at
@@ -1500,19 +1685,10 @@ def whatsapp_health_check():
     Verifica saúde da Evolution API sem fazer requisições pesadas
     """
     try:
-        # CORREÇÃO: Use variáveis ou concatenação simples
-        api_url = 'http://82.25.69.24:8090'
-        instance_name = 'marco_reunioes_bot'
-        api_key = 'olvjg1k1ldmbhyl8owi6'
-        
-        # Monta URL corretamente
-        url = f'{api_url}/instance/connectionState/{instance_name}'
-        
-        # Tenta conexão simples com timeout curto
-        response = requests.get(
-            url,
-            headers={'apikey': api_key},
-            timeout=3  # 3 segundos apenas
+        # Tenta conexão simples com timeout curto (cliente compartilhado)
+        response = evolution_manager.client.get(
+            f'/instance/connectionState/{evolution_manager.instance_name}',
+            timeout=(3, 3)  # 3 segundos apenas
         )
         
         if response.status_code == 200:
@@ -1551,6 +1727,40 @@ def whatsapp_health_check():
             'state': 'error',
             'error': str(e)
         }), 200  # Retorna 200 mesmo com erro
+
+
+@app.route('/whatsapp/api-metrics')
+@login_requerido
+def whatsapp_api_metrics():
+    """Latência por endpoint da Evolution API (cliente compartilhado)"""
+    return jsonify({
+        'success': True,
+        'clients': get_evolution_client_stats(),
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/whatsapp/outbox')
+@login_requerido
+def whatsapp_outbox_status():
+    """Estado da fila de saída (por tipo/estado) e últimas mensagens que desistiram"""
+    try:
+        return jsonify({
+            'success': True,
+            'outbox': outbox.get_stats(),
+            'dead_letters': outbox.dead_letters(limit=int(request.args.get('limit', 20))),
+            'timestamp': datetime.now().isoformat()
+        })
+    except Exception as e:
+        logger.error(f"Erro ao consultar outbox: {e}")
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/whatsapp/outbox/<int:outbox_id>/requeue', methods=['POST'])
+@login_requerido
+def whatsapp_outbox_requeue(outbox_id):
+    """Devolve uma mensagem que desistiu para a fila"""
+    if outbox.requeue(outbox_id):
+        return jsonify({'success': True, 'message': f'Mensagem {outbox_id} recolocada na fila'})
+    return jsonify({'success': False, 'message': 'Mensagem não encontrada ou não está em falha definitiva'}), 404
         
 # ROTA ATUALIZADA
 @app.route('/agenda/salvar', methods=['POST'])
@@ -1632,84 +1842,24 @@ def salvar_reuniao():
         )
         logger.info(f"💾 Reunião salva com ID: {meeting_id}")
         
-        # CORREÇÃO: Envio automático com assunto corrigido
+        # Envio automático: a confirmação vai para a outbox e o dispatcher envia
         if auto_envio and telefone_cliente:
             logger.info(f"🚀 PROCESSANDO ENVIO AUTOMÁTICO para reunião {meeting_id}")
             
-            try:
-                # Verifica conexão WhatsApp
-                connected, status = evolution_manager.check_connection_status()
-                if not connected:
-                    logger.warning(f"⚠️ WhatsApp não conectado: {status}")
-                    return jsonify({
-                        "mensagem": "Reunião salva com sucesso!",
-                        "auto_send_error": f"WhatsApp não conectado: {status}",
-                        "meeting_id": meeting_id
-                    })
-                
-                # CORREÇÃO: Prepara dados da mensagem com assunto corrigido
-                meeting_data = {
-                    'convidado': convidado,
-                    'data_hora': data_hora,
-                    'assunto': assunto_processado,
-                    'link': dados.get('link', ''),
-                    'nome_cliente': dados.get('nome_cliente', ''),
-                    'local_reuniao': dados.get('local_reuniao', '')
-                }
-                
-                # Carrega e formata template
-                template = MessageTemplateManager.load_template()
-                formatted_message = MessageTemplateManager.format_message(template, meeting_data)
-                formatted_message = f"{formatted_message}"
-                
-                # Envio direto (sem timeout complexo)
-                success, result = evolution_manager.send_message(telefone_cliente, formatted_message)
-                
-                # Registra log
-                log_whatsapp_message(
-                    meeting_id=meeting_id,
-                    phone=evolution_manager.normalize_phone_number(telefone_cliente),
-                    message=formatted_message,
-                    status="success" if success else "failed",
-                    error_message=None if success else result
-                )
-                
-                if success:
-                    logger.info(f"✅ ENVIO AUTOMÁTICO BEM-SUCEDIDO!")
-                    
-                    # Adiciona ao monitoramento
-                    whatsapp_monitor.add_phone_to_monitor(telefone_cliente, meeting_id)
-                    
-                    return jsonify({
-                        "mensagem": "Reunião salva com sucesso!",
-                        "whatsapp_auto_sent": True,
-                        "auto_send_status": "success",
-                        "meeting_id": meeting_id
-                    })
-                else:
-                    logger.error(f"❌ FALHA no envio automático: {result}")
-                    return jsonify({
-                        "mensagem": "Reunião salva com sucesso!",
-                        "auto_send_error": result,
-                        "meeting_id": meeting_id
-                    })
-                
-            except Exception as e:
-                logger.error(f"💥 ERRO no envio automático: {e}")
-                
-                log_whatsapp_message(
-                    meeting_id=meeting_id,
-                    phone=telefone_cliente,
-                    message="[AUTOMÁTICO] Erro crítico",
-                    status="error",
-                    error_message=str(e)
-                )
-                
+            queued, result = AutoMessageSender.send_confirmation_message_async(meeting_id, delay_seconds=0)
+            if queued:
                 return jsonify({
                     "mensagem": "Reunião salva com sucesso!",
-                    "auto_send_error": f"Erro: {str(e)}",
+                    "auto_send_status": "queued",
+                    "whatsapp_message": result,
                     "meeting_id": meeting_id
                 })
+            
+            return jsonify({
+                "mensagem": "Reunião salva com sucesso!",
+                "auto_send_error": result,
+                "meeting_id": meeting_id
+            })
         
         # Sem auto-send
         return jsonify({
@@ -1734,7 +1884,7 @@ def get_recent_changes():
         if not since:
             since = (datetime.now() - timedelta(minutes=5)).isoformat()
         
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             
             # Busca reuniões com respostas recentes
@@ -1750,9 +1900,9 @@ def get_recent_changes():
                     cr.confidence
                 FROM reunioes r
                 INNER JOIN client_responses cr ON r.id = cr.meeting_id
-                WHERE datetime(cr.received_at) >= datetime(?)
-                ORDER BY cr.received_at DESC
-            ''', (since,))
+                WHERE cr.received_at_ts >= ?
+                ORDER BY cr.received_at_ts DESC
+            ''', (to_epoch(since),))
             
             changes = []
             for row in cursor.fetchall():
@@ -1785,7 +1935,7 @@ def get_recent_changes():
 def limpar_duplicatas():
     """Remove duplicatas existentes baseado em título + convidado + data"""
     try:
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             
             # Busca duplicatas (mesmo título, convidado e data)
@@ -1848,7 +1998,7 @@ def test_webhook():
         }
         
         logger.info("🧪 Testando webhook com dados simulados")
-        result = whatsapp_monitor.process_webhook_message(test_data)
+        result = whatsapp_monitor.process_inbound(test_data["data"])
         
         return jsonify({
             "success": True,
@@ -1864,176 +2014,61 @@ def test_webhook():
             "error": str(e)
         })
 
-# CLASSE AUTOMSGSENDER MELHORADA
-class AutoMessageSender:
-    """Classe para envio automático de mensagens em background - VERSÃO MELHORADA"""
-    
-    @staticmethod
-    def send_confirmation_message_async(meeting_id: int, delay_seconds: int = 1):
-        """Envia mensagem de confirmação de forma assíncrona com melhor tratamento de erros"""
-        def _send_message():
-            max_retries = 3
-            retry_delay = 2
-            
-            for attempt in range(max_retries):
-                try:
-                    # Aguarda antes de enviar
-                    time.sleep(delay_seconds if attempt == 0 else retry_delay)
-                    
-                    logger.info(f"📤 Tentativa {attempt + 1}/{max_retries} - Enviando automático para reunião {meeting_id}")
-                    
-                    # Busca dados da reunião
-                    with sqlite3.connect(DATABASE) as conn:
-                        cursor = conn.cursor()
-                        cursor.execute('SELECT * FROM reunioes WHERE id = ?', (meeting_id,))
-                        meeting = cursor.fetchone()
-                        
-                        if not meeting:
-                            logger.error(f"Reunião {meeting_id} não encontrada")
-                            return
-                    
-                    # Verifica se tem telefone
-                    telefone_cliente = meeting[7] if len(meeting) > 7 else None
-                    if not telefone_cliente:
-                        logger.warning(f"Reunião {meeting_id} sem telefone")
-                        AutoMessageSender._log_failed_attempt(meeting_id, "", "Telefone não informado", "no_phone")
-                        return
-                    
-                    # Verifica conexão com timeout baixo
-                    try:
-                        logger.info(f"🔍 Verificando conexão WhatsApp (tentativa {attempt + 1})...")
-                        connected, status = evolution_manager.check_connection_status()
-                        
-                        if not connected:
-                            logger.warning(f"⚠️ WhatsApp não conectado (tentativa {attempt + 1}): {status}")
-                            
-                            # Se última tentativa, registra falha definitiva
-                            if attempt == max_retries - 1:
-                                AutoMessageSender._log_failed_attempt(
-                                    meeting_id, telefone_cliente, 
-                                    f"WhatsApp não conectado após {max_retries} tentativas: {status}", 
-                                    "not_connected"
-                                )
-                                return
-                            else:
-                                # Tenta novamente
-                                logger.info(f"🔄 Tentando novamente em {retry_delay}s...")
-                                continue
-                                
-                    except Exception as conn_error:
-                        logger.error(f"❌ Erro ao verificar conexão (tentativa {attempt + 1}): {conn_error}")
-                        
-                        if attempt == max_retries - 1:
-                            AutoMessageSender._log_failed_attempt(
-                                meeting_id, telefone_cliente, 
-                                f"Erro na verificação de conexão: {conn_error}", 
-                                "connection_check_error"
-                            )
-                            return
-                        else:
-                            continue
-                    
-                    # Prepara dados da mensagem
-                    logger.info("📝 Preparando mensagem...")
-                    meeting_data = {
-                        'convidado': meeting[2],
-                        'data_hora': meeting[3],
-                        'assunto': meeting[4],
-                        'link': meeting[5] or '',
-                        'nome_cliente': meeting[6] or '',
-                        'local_reuniao': meeting[8] if len(meeting) > 8 else ''
-                    }
-                    
-                    # Carrega e formata template
-                    template = MessageTemplateManager.load_template()
-                    formatted_message = MessageTemplateManager.format_message(template, meeting_data)
-                    formatted_message = f"{formatted_message}"
-                    
-                    # Normaliza telefone
-                    normalized_phone = evolution_manager.normalize_phone_number(telefone_cliente)
-                    logger.info(f"📱 Enviando para: {normalized_phone}")
-                    
-                    # ENVIA MENSAGEM
-                    success, result = evolution_manager.send_message(telefone_cliente, formatted_message)
-                    
-                    # Registra log do resultado
-                    log_whatsapp_message(
-                        meeting_id=meeting_id,
-                        phone=normalized_phone,
-                        message=formatted_message,
-                        status="success" if success else "failed",
-                        error_message=None if success else result
-                    )
-                    
-                    if success:
-                        logger.info(f"✅ ENVIO AUTOMÁTICO BEM-SUCEDIDO! (tentativa {attempt + 1})")
-                        
-                        # Adiciona ao monitoramento para capturar resposta
-                        whatsapp_monitor.add_phone_to_monitor(telefone_cliente, meeting_id)
-                        
-                        # Registra sucesso na base
-                        AutoMessageSender._log_success(meeting_id, normalized_phone, formatted_message)
-                        return
-                    
-                    else:
-                        logger.error(f"❌ FALHA no envio (tentativa {attempt + 1}): {result}")
-                        
-                        # Se última tentativa, registra falha definitiva
-                        if attempt == max_retries - 1:
-                            AutoMessageSender._log_failed_attempt(
-                                meeting_id, normalized_phone, result, "send_failed"
-                            )
-                            return
-                        else:
-                            # Aguarda antes de tentar novamente
-                            logger.info(f"🔄 Tentando novamente em {retry_delay}s...")
-                            continue
-                            
-                except Exception as e:
-                    logger.error(f"💥 Erro interno na tentativa {attempt + 1}: {e}")
-                    
-                    if attempt == max_retries - 1:
-                        AutoMessageSender._log_failed_attempt(
-                            meeting_id, telefone_cliente, f"Erro interno: {str(e)}", "internal_error"
-                        )
-                        return
-                    else:
-                        continue
-            
-            logger.error(f"❌ FALHA DEFINITIVA após {max_retries} tentativas para reunião {meeting_id}")
-        
-        # Executa em thread separada para não bloquear resposta HTTP
-        thread = threading.Thread(target=_send_message, daemon=True)
-        thread.start()
-        logger.info(f"🚀 Thread de envio automático iniciada para reunião {meeting_id}")
-    
-    @staticmethod
-    def _log_success(meeting_id: int, phone: str, message: str):
-        """Registra sucesso no envio automático"""
-        try:
-            with sqlite3.connect(DATABASE) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO whatsapp_logs (meeting_id, phone, message, status, error_message)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (meeting_id, phone, message, "auto_success", None))
-                conn.commit()
-        except Exception as e:
-            logger.error(f"Erro ao registrar sucesso: {e}")
-    
-    @staticmethod
-    def _log_failed_attempt(meeting_id: int, phone: str, error_msg: str, error_type: str):
-        """Registra falha no envio automático"""
-        try:
-            with sqlite3.connect(DATABASE) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    INSERT INTO whatsapp_logs (meeting_id, phone, message, status, error_message)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (meeting_id, phone, f"[AUTOMÁTICO] Falha: {error_type}", "auto_failed", error_msg))
-                conn.commit()
-        except Exception as e:
-            logger.error(f"Erro ao registrar falha: {e}")
+# ===============================
+# === OUTBOX (FILA DE SAÍDA) ====
+# ===============================
+outbox = get_outbox(DATABASE)
+
+def _send_outbox_text(item: Dict) -> Tuple[bool, str]:
+    """Sender padrão da outbox: texto pelo manager global"""
+    return evolution_manager.send_message(item['phone'], item['message'])
+
+def _on_confirmacao_result(item: Dict, success: bool, result: str):
+    """Resultado final da confirmação automática"""
+    meeting_id = item['ref_id']
+    normalized_phone = evolution_manager.normalize_phone_number(item['phone'])
+    log_whatsapp_message(
+        meeting_id=meeting_id,
+        phone=normalized_phone,
+        message=item['message'],
+        status="success" if success else "failed",
+        error_message=None if success else result
+    )
+    if success:
+        logger.info(f"✅ ENVIO AUTOMÁTICO BEM-SUCEDIDO! (reunião {meeting_id}, tentativa {item['attempts']})")
+        # Adiciona ao monitoramento para capturar resposta
+        whatsapp_monitor.add_phone_to_monitor(item['phone'], meeting_id)
+        AutoMessageSender._log_success(meeting_id, normalized_phone, item['message'])
+    else:
+        AutoMessageSender._log_failed_attempt(meeting_id, normalized_phone, result, "send_failed")
+
+def _on_aniversario_result(item: Dict, success: bool, result: str):
+    """Registra o envio de aniversário em logs_aniversarios (sistema.db)"""
+    ctx = item['context']
+    try:
+        with get_connection('sistema.db') as conn:
+            conn.execute('''
+                INSERT INTO logs_aniversarios 
+                (aniversariante_id, nome_aniversariante, empresa_aniversariante, whatsapp, data_envio, status, erro)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                item['ref_id'], ctx.get('nome'), ctx.get('empresa'), item['phone'], datetime.now(),
+                'success' if success else 'error',
+                None if success else str(result)
+            ))
+            conn.commit()
+    except Exception as e:
+        logger.error(f"Erro ao registrar log de aniversário: {e}")
+
+def _on_relatorio_result(item: Dict, success: bool, result: str):
+    if success:
+        logger.info(f"✅ Relatório enviado para {item['phone']}")
+    else:
+        logger.error(f"❌ Falha definitiva no relatório para {item['phone']}: {result}")
+
+outbox.register('confirmacao', _send_outbox_text, _on_confirmacao_result)
+outbox.register('aniversario', _send_outbox_text, _on_aniversario_result)
+outbox.register('relatorio', _send_outbox_text, _on_relatorio_result)
 
 # FUNÇÕES DE VERIFICAÇÃO DE CONFLITO DE HORÁRIO
 def verificar_conflito_horario(data_hora: str, meeting_id: int = None, tolerancia_minutos: int = 15) -> dict:
@@ -2056,7 +2091,7 @@ def verificar_conflito_horario(data_hora: str, meeting_id: int = None, toleranci
         inicio_janela = nova_data - timedelta(minutes=tolerancia_minutos)
         fim_janela = nova_data + timedelta(minutes=tolerancia_minutos)
         
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             
             # Query para buscar reuniões conflitantes
@@ -2066,17 +2101,17 @@ def verificar_conflito_horario(data_hora: str, meeting_id: int = None, toleranci
                     SELECT id, titulo, convidado, data_hora, nome_cliente
                     FROM reunioes 
                     WHERE id != ? 
-                    AND datetime(data_hora) BETWEEN datetime(?) AND datetime(?)
-                    ORDER BY data_hora
-                ''', (meeting_id, inicio_janela.isoformat(), fim_janela.isoformat()))
+                    AND data_hora_ts BETWEEN ? AND ?
+                    ORDER BY data_hora_ts
+                ''', (meeting_id, to_epoch(inicio_janela), to_epoch(fim_janela)))
             else:
                 # Para nova reunião: verifica todos
                 cursor.execute('''
                     SELECT id, titulo, convidado, data_hora, nome_cliente
                     FROM reunioes 
-                    WHERE datetime(data_hora) BETWEEN datetime(?) AND datetime(?)
-                    ORDER BY data_hora
-                ''', (inicio_janela.isoformat(), fim_janela.isoformat()))
+                    WHERE data_hora_ts BETWEEN ? AND ?
+                    ORDER BY data_hora_ts
+                ''', (to_epoch(inicio_janela), to_epoch(fim_janela)))
             
             reuniao_conflitante = cursor.fetchone()
             
@@ -2162,33 +2197,29 @@ def verificar_conflito_ajax():
 def get_meeting_details(meeting_id):
     """Retorna dados atualizados de uma reunião específica"""
     try:
-        with sqlite3.connect(DATABASE) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM reunioes WHERE id = ?', (meeting_id,))
-            meeting = cursor.fetchone()
-            
-            if not meeting:
-                return jsonify({'success': False, 'message': 'Reunião não encontrada'}), 404
-            
-            # Converte para formato esperado pelo frontend
-            meeting_data = {
-                'id': meeting[0],
-                'title': meeting[1],
-                'convidado': meeting[2],
-                'datetime': meeting[3],
-                'assunto': meeting[4],
-                'link': meeting[5] or '',
-                'client': meeting[6] or '',
-                'phone': meeting[7] or '',
-                'local': meeting[8] if len(meeting) > 8 else '',
-                'status_confirmacao': meeting[9] if len(meeting) > 9 else 'pending'
-            }
-            
-            return jsonify({
-                'success': True,
-                'meeting': meeting_data
-            })
-            
+        meeting = meetings_repo.get(meeting_id)
+        if not meeting:
+            return jsonify({'success': False, 'message': 'Reunião não encontrada'}), 404
+
+        # Converte para formato esperado pelo frontend
+        meeting_data = {
+            'id': meeting.id,
+            'title': meeting.titulo,
+            'convidado': meeting.convidado,
+            'datetime': meeting.data_hora,
+            'assunto': meeting.assunto,
+            'link': meeting.link or '',
+            'client': meeting.nome_cliente or '',
+            'phone': meeting.telefone_cliente or '',
+            'local': meeting.local_reuniao or '',
+            'status_confirmacao': meeting.status_confirmacao
+        }
+
+        return jsonify({
+            'success': True,
+            'meeting': meeting_data
+        })
+
     except Exception as e:
         logger.error(f"Erro ao buscar reunião: {e}")
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -2232,7 +2263,7 @@ def gerar_sugestoes_horario(data_hora_original: str, tolerancia: int = 15) -> li
 def get_auto_send_status(meeting_id):
     """Verifica status do envio automático de uma reunião"""
     try:
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT status, error_message, sent_at 
@@ -2272,31 +2303,9 @@ def get_auto_send_status(meeting_id):
 @login_requerido
 def dados_reunioes():
     try:
-        reunioes = get_reunioes()
-        lista = []
-        
-        for r in reunioes:
-            # Ordem garantida pelo SELECT explícito:
-            # 0=id, 1=titulo, 2=convidado, 3=data_hora, 4=assunto,
-            # 5=link, 6=nome_cliente, 7=telefone_cliente, 
-            # 8=local_reuniao, 9=status_confirmacao, 10=numero_pessoas
-            
-            lista.append({
-                "id": r[0],
-                "title": r[1],
-                "convidado": r[2],
-                "datetime": r[3],
-                "assunto": r[4],
-                "link": r[5] or "",
-                "client": r[6] or "",
-                "phone": r[7] or "",
-                "local": r[8] or "",
-                "status_confirmacao": r[9] if len(r) > 9 else "pending",
-                "numero_pessoas": r[10] if len(r) > 10 else None  # ✅ ÍNDICE 10 CORRETO
-            })
-        
-        return jsonify(lista)
-        
+        # JSON montado pelo SQLite em uma consulta (sem dict por linha)
+        return app.response_class(meetings_repo.to_json(MeetingRepository.AGENDA_JSON), mimetype='application/json')
+
     except Exception as e:
         logger.error(f"Erro ao buscar dados: {e}")
         return jsonify({"erro": f"Erro ao buscar dados: {str(e)}"}), 500
@@ -2305,7 +2314,7 @@ def dados_reunioes():
 @login_requerido
 def excluir_reuniao(id):
     try:
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT id FROM reunioes WHERE id = ?', (id,))
             if not cursor.fetchone():
@@ -2355,7 +2364,7 @@ def editar_reuniao(id):
         except Exception:
             return jsonify({"erro": "Data inválida"}), 400
 
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT id FROM reunioes WHERE id = ?', (id,))
             if not cursor.fetchone():
@@ -2378,45 +2387,243 @@ def editar_reuniao(id):
 # ===============================
 # === WEBHOOK EVOLUTION API =====
 # ===============================
-@app.route('/webhook/evolution', methods=['POST'])
-def evolution_webhook():
-    """WEBHOOK COMPLETO — Valida, processa e registra eventos da Evolution API"""
+class WebhookLogWriter:
+    """Grava webhook_incoming_logs em lote (group commit) com payload zlib"""
+
+    def __init__(self, db_path: str, flush_interval_ms: int = 500, batch_size: int = 200,
+                 max_pending: int = 10000, compression_level: int = 6):
+        self.db_path = db_path
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.batch_size = max(1, batch_size)
+        self.compression_level = compression_level
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.bytes_raw = 0
+        self.bytes_compressed = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="webhook-log-writer", daemon=True)
+            self._thread.start()
+
+    def log(self, data: Dict) -> bool:
+        """Enfileira um payload; a compactação acontece aqui, fora da transação"""
+        if not self._thread:
+            self.start()
+        try:
+            raw = json.dumps(data, ensure_ascii=False).encode('utf-8')
+            row = (
+                datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                data.get("event", ""),
+                data.get("instance", data.get("instanceName", "")),
+                sqlite3.Binary(zlib.compress(raw, self.compression_level))
+            )
+            self._queue.put_nowait((row, len(raw)))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        except Exception as e:
+            logger.warning(f"⚠️ Erro ao preparar log do webhook: {e}")
+            return False
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch):
+        try:
+            with get_connection(self.db_path) as conn:
+                conn.executemany("""
+                    INSERT INTO webhook_incoming_logs (received_at, event, instance, raw_payload_zlib)
+                    VALUES (?, ?, ?, ?)
+                """, [row for row, _ in batch])
+                conn.commit()
+            with self._lock:
+                self.written += len(batch)
+                self.batches += 1
+                self.bytes_raw += sum(size for _, size in batch)
+                self.bytes_compressed += sum(len(row[3]) for row, _ in batch)
+        except Exception as e:
+            with self._lock:
+                self.dropped += len(batch)
+            logger.error(f"❌ Erro ao gravar lote de logs do webhook ({len(batch)}): {e}")
+
+    def flush(self):
+        """Grava imediatamente o que estiver pendente (usado no encerramento)"""
+        batch = []
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if batch:
+            self._write(batch)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'pending': self._queue.qsize(),
+                'written': self.written,
+                'batches': self.batches,
+                'dropped': self.dropped,
+                'bytes_raw': self.bytes_raw,
+                'bytes_compressed': self.bytes_compressed,
+                'compression_ratio': round(self.bytes_compressed / self.bytes_raw, 3) if self.bytes_raw else None
+            }
+
+
+def decode_webhook_payload(raw_payload_zlib, raw_payload=None) -> Optional[Dict]:
+    """Decodifica um payload de webhook_incoming_logs (compactado ou legado em texto)"""
     try:
+        if raw_payload_zlib is not None:
+            return json.loads(zlib.decompress(raw_payload_zlib).decode('utf-8'))
+        if raw_payload:
+            return json.loads(raw_payload)
+    except Exception as e:
+        logger.warning(f"⚠️ Payload de webhook ilegível: {e}")
+    return None
 
-        expected_key = os.getenv("EVOLUTION_API_KEY", EVOLUTION_API_CONFIG.get("api_key", ""))
 
+webhook_log_writer = WebhookLogWriter(DATABASE, **WEBHOOK_LOG_CONFIG)
+atexit.register(webhook_log_writer.flush)
 
-        # =============================
-        # 2️⃣ Leitura e validação do JSON
-        # =============================
+
+class WebhookQueue:
+    """Filas limitadas por worker para os eventos do webhook
+
+    Cada remetente (remoteJid) cai sempre no mesmo worker: as respostas de um
+    cliente ("SIM" e depois "NÃO, desculpe") são processadas uma de cada vez e
+    na ordem de chegada, como na entrega síncrona da Evolution.
+    """
+
+    def __init__(self, handler, max_size: int = 1000, workers: int = 4):
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.max_size = max_size
+        per_worker = max(1, -(-max_size // self.workers))
+        self._queues = [queue.Queue(maxsize=per_worker) for _ in range(self.workers)]
+        self._lock = threading.Lock()
+        self._threads = []
+        self.enqueued = 0
+        self.dropped = 0
+        self.processed = 0
+        self.failed = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.last_processing_time = 0.0
+
+    def start(self):
+        """Inicia os workers (idempotente)"""
+        with self._lock:
+            if self._threads:
+                return
+            for i, worker_queue in enumerate(self._queues):
+                worker = threading.Thread(target=self._worker, args=(worker_queue,),
+                                          name=f"webhook-worker-{i}", daemon=True)
+                worker.start()
+                self._threads.append(worker)
+        logger.info(f"✅ Fila do webhook iniciada com {self.workers} worker(s)")
+
+    @staticmethod
+    def sender_of(data: Dict) -> str:
+        """remoteJid do evento (lotes: o da primeira mensagem)"""
+        payload = data.get('data', data)
+        if isinstance(payload, dict) and isinstance(payload.get('messages'), list):
+            payload = payload['messages']
+        if isinstance(payload, list):
+            payload = payload[0] if payload else {}
+        if not isinstance(payload, dict):
+            return ''
+        key_info = payload.get('key') or {}
+        return str(key_info.get('remoteJid') or payload.get('remoteJid') or payload.get('from') or data.get('sender') or '')
+
+    def _queue_for(self, data: Dict) -> queue.Queue:
+        return self._queues[zlib.crc32(self.sender_of(data).encode('utf-8')) % self.workers]
+
+    def enqueue(self, data: Dict) -> bool:
+        """Enfileira sem bloquear; retorna False se a fila do remetente estiver cheia"""
+        if not self._threads:
+            self.start()
+        worker_queue = self._queue_for(data)
         try:
-            data = request.get_json(force=True)
-        except Exception as e:
-            logger.error(f"💥 Erro ao decodificar JSON: {e}")
-            return jsonify({"error": "Invalid JSON"}), 400
+            worker_queue.put_nowait((time.monotonic(), data))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            logger.warning(f"⚠️ Fila do webhook cheia ({worker_queue.maxsize} por worker), evento descartado")
+            return False
+        with self._lock:
+            self.enqueued += 1
+        return True
+
+    def depth(self) -> int:
+        return sum(worker_queue.qsize() for worker_queue in self._queues)
+
+    def _worker(self, worker_queue: queue.Queue):
+        while True:
+            enqueued_at, data = worker_queue.get()
+            started = time.monotonic()
+            lag = started - enqueued_at
+            try:
+                ok = self.handler(data)
+            except Exception as e:
+                logger.error(f"💥 Erro no worker do webhook: {e}")
+                ok = False
+            finally:
+                worker_queue.task_done()
+            with self._lock:
+                self.processed += 1
+                if not ok:
+                    self.failed += 1
+                self.last_lag = lag
+                self.max_lag = max(self.max_lag, lag)
+                self.last_processing_time = time.monotonic() - started
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'async_mode': WEBHOOK_QUEUE_CONFIG['async_mode'],
+                'workers': self.workers,
+                'workers_alive': sum(1 for t in self._threads if t.is_alive()),
+                'depth': self.depth(),
+                'depth_per_worker': [worker_queue.qsize() for worker_queue in self._queues],
+                'max_size': self.max_size,
+                'enqueued': self.enqueued,
+                'dropped': self.dropped,
+                'processed': self.processed,
+                'failed': self.failed,
+                'last_lag_ms': round(self.last_lag * 1000, 2),
+                'max_lag_ms': round(self.max_lag * 1000, 2),
+                'last_processing_ms': round(self.last_processing_time * 1000, 2)
+            }
 
-        if not data:
-            logger.warning("⚠️ Webhook sem corpo JSON válido")
-            return jsonify({"error": "No JSON data"}), 400
 
+def process_webhook_payload(data: Dict) -> bool:
+    """Registra e processa um payload de webhook já validado"""
+    try:
         # =============================
         # 3️⃣ Log e auditoria do webhook
         # =============================
-        try:
-            with sqlite3.connect(DATABASE) as conn:
-                cursor = conn.cursor()
-                cursor.execute("""
-                    INSERT INTO webhook_incoming_logs (event, instance, raw_payload)
-                    VALUES (?, ?, ?)
-                """, (
-                    data.get("event", ""),
-                    data.get("instance", data.get("instanceName", "")),
-                    json.dumps(data)
-                ))
-                conn.commit()
-            logger.info("💾 Payload do webhook salvo com sucesso")
-        except Exception as log_err:
-            logger.warning(f"⚠️ Falha ao salvar log do webhook: {log_err}")
+        if not webhook_log_writer.log(data):
+            logger.warning("⚠️ Falha ao enfileirar log do webhook")
 
         logger.info("📥 WEBHOOK RECEBIDO:")
         logger.info(f"   Event: {data.get('event', 'N/A')}")
@@ -2430,128 +2637,114 @@ def evolution_webhook():
             logger.info("🔄 Ativando monitoramento automaticamente...")
             whatsapp_monitor.start_monitoring()
 
-        # =============================
-        # 5️⃣ Validação da instância
-        # =============================
-        instance_name = data.get("instance") or data.get("instanceName")
-        expected_instance = getattr(evolution_manager, "instance_name", None)
-        if expected_instance and instance_name != expected_instance:
-            logger.warning(f"⚠️ Instância incorreta: esperado '{expected_instance}', recebido '{instance_name}'")
-            return jsonify({"status": "ignored", "reason": "wrong_instance"}), 200
-
-        # =============================
-        # 6️⃣ Filtro de eventos válidos
-        # =============================
-        event = str(data.get("event", "")).lower()
-        VALID_EVENTS = {
-            "messages.upsert", "message.upsert", "messages_upsert", "message",
-            "messages", "send.message", "receive.message", "messages.set", "messaging-history.set"
-        }
-        if event and not any(valid in event for valid in VALID_EVENTS):
-            logger.info(f"⚠️ Evento ignorado (não é mensagem): {event}")
-            return jsonify({"status": "ignored", "reason": "not_message_event"}), 200
-
         # =============================
         # 7️⃣ Extração dos dados da mensagem
         # =============================
         try:
             message_data = None
+            batch = None
             if "data" in data:
-                if isinstance(data["data"], list) and data["data"]:
-                    message_data = data["data"][0]
+                if isinstance(data["data"], list):
+                    batch = data["data"]
                 elif isinstance(data["data"], dict):
-                    message_data = data["data"]
+                    if isinstance(data["data"].get("messages"), list):
+                        # messaging-history.set: {"messages": [...], "chats": [...], ...}
+                        batch = data["data"]["messages"]
+                    else:
+                        message_data = data["data"]
             elif "key" in data and "message" in data:
                 message_data = data
 
+            # Lotes (messages.set / messaging-history.set) são processados inteiros
+            if batch is not None:
+                summary = whatsapp_monitor.process_inbound_batch(batch)
+                logger.info(f"📦 Lote do webhook: {summary}")
+                return summary['processed'] > 0 or summary['duplicates'] > 0
+
             if not message_data:
                 raise ValueError("Estrutura de dados não reconhecida")
 
             logger.info("📦 Dados da mensagem extraídos com sucesso")
         except Exception as extract_error:
             logger.error(f"💥 Erro ao extrair dados da mensagem: {extract_error}")
-            return jsonify({"status": "error", "message": str(extract_error)}), 200
+            return False
 
         # =============================
         # 8️⃣ Processamento da mensagem
         # =============================
-        logger.info("🔍 Processando mensagem recebida...")
-        try:
-            result = whatsapp_monitor.process_webhook_message(message_data)
-        except Exception as proc_err:
-            logger.warning(f"⚠️ Erro durante o processamento: {proc_err}")
-            result = False
+        result = whatsapp_monitor.process_inbound(message_data)
+        logger.info(
+            f"🔍 Mensagem processada: {result['processed']} "
+            f"(motivo: {result['reason']}, tempos: {result['timings_ms']})"
+        )
+
+        return result['processed']
+
+    except Exception as e:
+        logger.error(f"💥 Erro ao processar payload do webhook: {e}", exc_info=True)
+        return False
+
+
+@app.route('/webhook/evolution', methods=['POST'])
+def evolution_webhook():
+    """WEBHOOK COMPLETO — Valida e enfileira (ou processa) eventos da Evolution API"""
+    try:
+
+        expected_key = os.getenv("EVOLUTION_API_KEY", EVOLUTION_API_CONFIG.get("api_key", ""))
+
 
         # =============================
-        # 9️⃣ Confirmação automática de reuniões
+        # 2️⃣ Leitura e validação do JSON
         # =============================
         try:
-            message_text = ""
-            sender_number = ""
-
-            # Extrai texto da mensagem
-            if "message" in message_data:
-                message_text = (
-                    message_data.get("message", {}).get("conversation")
-                    or message_data.get("message", {}).get("extendedTextMessage", {}).get("text", "")
-                    or ""
-                )
-
-            # Extrai número do remetente
-            if "key" in message_data:
-                sender_number = (
-                    message_data.get("key", {}).get("remoteJid", "")
-                    .split("@")[0]
-                    .replace(" ", "")
-                    .replace("+", "")
-                )
+            data = request.get_json(force=True)
+        except Exception as e:
+            logger.error(f"💥 Erro ao decodificar JSON: {e}")
+            return jsonify({"error": "Invalid JSON"}), 400
 
-            logger.info(f"💬 Mensagem recebida de {sender_number}: {message_text}")
+        if not data:
+            logger.warning("⚠️ Webhook sem corpo JSON válido")
+            return jsonify({"error": "No JSON data"}), 400
 
-            palavras_confirmacao = ["confirmado", "confirmada", "sim", "ok", "pode confirmar"]
+        # =============================
+        # 5️⃣ Validação da instância
+        # =============================
+        instance_name = data.get("instance") or data.get("instanceName")
+        expected_instance = getattr(evolution_manager, "instance_name", None)
+        if expected_instance and instance_name != expected_instance:
+            logger.warning(f"⚠️ Instância incorreta: esperado '{expected_instance}', recebido '{instance_name}'")
+            return jsonify({"status": "ignored", "reason": "wrong_instance"}), 200
 
-            if sender_number and any(p in message_text.lower() for p in palavras_confirmacao):
-                logger.info(f"✅ Confirmação automática detectada para {sender_number}")
+        # =============================
+        # 6️⃣ Filtro de eventos válidos
+        # =============================
+        event = str(data.get("event", "")).lower()
+        VALID_EVENTS = {
+            "messages.upsert", "message.upsert", "messages_upsert", "message",
+            "messages", "send.message", "receive.message", "messages.set", "messaging-history.set"
+        }
+        if event and not any(valid in event for valid in VALID_EVENTS):
+            logger.info(f"⚠️ Evento ignorado (não é mensagem): {event}")
+            return jsonify({"status": "ignored", "reason": "not_message_event"}), 200
 
-                with sqlite3.connect(DATABASE) as conn:
-                    cursor = conn.cursor()
-                    cursor.execute("""
-                        SELECT id FROM reunioes 
-                        WHERE telefone_cliente LIKE ? 
-                        ORDER BY id DESC LIMIT 1
-                    """, (f"%{sender_number[-8:]}%",))
-                    row = cursor.fetchone()
+        # =============================
+        # 7️⃣ Modo assíncrono: enfileira e responde imediatamente
+        # =============================
+        if WEBHOOK_QUEUE_CONFIG['async_mode']:
+            if webhook_queue.enqueue(data):
+                return jsonify({
+                    "status": "queued",
+                    "queue_depth": webhook_queue.depth(),
+                    "timestamp": datetime.now().isoformat()
+                }), 200
 
-                    if row:
-                        meeting_id = row[0]
-                        cursor.execute("""
-                            UPDATE reunioes
-                            SET status_confirmacao = 'confirmada'
-                            WHERE id = ?
-                        """, (meeting_id,))
-                        cursor.execute("""
-                            INSERT INTO client_responses 
-                                (meeting_id, response_text, status, confidence, analysis_data, received_at)
-                            VALUES (?, ?, ?, ?, ?, ?)
-                        """, (
-                            meeting_id,
-                            "[CONFIRMAÇÃO AUTOMÁTICA] Status alterado para: confirmed",
-                            "confirmed",
-                            1.0,
-                            json.dumps({
-                                "manual": False,
-                                "fonte": "webhook",
-                                "numero": sender_number
-                            }),
-                            datetime.now().isoformat()
-                        ))
-                        conn.commit()
-                        logger.info(f"💾 Reunião {meeting_id} marcada como CONFIRMADA automaticamente")
-                    else:
-                        logger.warning(f"⚠️ Nenhuma reunião encontrada para o número {sender_number}")
+            return jsonify({
+                "status": "error",
+                "message": "Webhook queue full",
+                "timestamp": datetime.now().isoformat()
+            }), 503
 
-        except Exception as auto_err:
-            logger.error(f"💥 Erro na confirmação automática: {auto_err}")
+        result = process_webhook_payload(data)
 
         # =============================
         # 🔚 10️⃣ Retorno final
@@ -2572,10 +2765,72 @@ def evolution_webhook():
             "timestamp": datetime.now().isoformat()
         }), 200
 
-    
+
+
+webhook_queue = WebhookQueue(
+    process_webhook_payload,
+    max_size=WEBHOOK_QUEUE_CONFIG['max_size'],
+    workers=WEBHOOK_QUEUE_CONFIG['workers']
+)
+
+
+@app.route('/webhook/queue-status')
+@login_requerido
+def webhook_queue_status():
+    """Profundidade, descartes e atraso da fila do webhook"""
+    return jsonify({
+        "success": True,
+        "queue": webhook_queue.get_stats(),
+        "log_writer": webhook_log_writer.get_stats(),
+        "analyzer_cache": ResponseAnalyzer.cache_stats(),
+        "timestamp": datetime.now().isoformat()
+    })
+
+
+@app.route('/webhook/logs')
+@login_requerido
+def webhook_incoming_logs_debug():
+    """Últimos payloads recebidos no webhook (debug)"""
+    try:
+        limit = min(int(request.args.get('limit', 20)), 200)
+        event = request.args.get('event')
+
+        with get_connection(DATABASE) as conn:
+            cursor = conn.cursor()
+            query = """
+                SELECT id, received_at, event, instance, raw_payload_zlib, raw_payload
+                FROM webhook_incoming_logs
+            """
+            params = []
+            if event:
+                query += " WHERE event = ?"
+                params.append(event)
+            query += " ORDER BY id DESC LIMIT ?"
+            params.append(limit)
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+
+        return jsonify({
+            "success": True,
+            "logs": [{
+                "id": row[0],
+                "received_at": row[1],
+                "event": row[2],
+                "instance": row[3],
+                "payload": decode_webhook_payload(row[4], row[5])
+            } for row in rows],
+            "total": len(rows)
+        })
+    except Exception as e:
+        logger.error(f"❌ Erro ao listar logs do webhook: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+
 # ===============================
 # === ROTAS EVOLUTION API =======
 # ===============================
+
 @app.route('/whatsapp/connect-existing', methods=['POST'])
 @login_requerido
 def connect_existing_instance():
@@ -2781,7 +3036,7 @@ def force_status_check():
         instance_ok, instance_msg = evolution_manager.check_existing_instance()
         
         # Verifica conexão específica
-        connected, conn_status = evolution_manager.check_connection_status()
+        connected, conn_status = evolution_manager.check_connection_status(force=True)
         
         return jsonify({
             "success": True,
@@ -2820,16 +3075,12 @@ def send_whatsapp_message():
             }), 400
         
         # Verifica se reunião existe
-        with sqlite3.connect(DATABASE) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM reunioes WHERE id = ?', (meeting_id,))
-            meeting = cursor.fetchone()
-            
-            if not meeting:
-                return jsonify({
-                    "success": False,
-                    "message": "Reunião não encontrada"
-                }), 404
+        meeting = meetings_repo.get(meeting_id)
+        if not meeting:
+            return jsonify({
+                "success": False,
+                "message": "Reunião não encontrada"
+            }), 404
         
         # Normaliza telefone
         normalized_phone = evolution_manager.normalize_phone_number(phone)
@@ -2879,26 +3130,22 @@ def send_formatted_message():
             }), 400
         
         # Busca dados da reunião
-        with sqlite3.connect(DATABASE) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM reunioes WHERE id = ?', (meeting_id,))
-            meeting = cursor.fetchone()
-            
-            if not meeting:
-                return jsonify({
-                    "success": False,
-                    "message": "Reunião não encontrada"
-                }), 404
+        meeting = meetings_repo.get(meeting_id)
+        if not meeting:
+            return jsonify({
+                "success": False,
+                "message": "Reunião não encontrada"
+            }), 404
         
         # Prepara dados
         meeting_data = {
-            'convidado': meeting[2],
-            'data_hora': meeting[3],
-            'assunto': meeting[4],
-            'link': meeting[5] or '',
-            'nome_cliente': meeting[6] or '',
-            'telefone_cliente': meeting[7] or '',
-            'local_reuniao': meeting[8] if len(meeting) > 8 else ''
+            'convidado': meeting.convidado,
+            'data_hora': meeting.data_hora,
+            'assunto': meeting.assunto,
+            'link': meeting.link or '',
+            'nome_cliente': meeting.nome_cliente or '',
+            'telefone_cliente': meeting.telefone_cliente or '',
+            'local_reuniao': meeting.local_reuniao or ''
         }
         
         if not meeting_data['telefone_cliente']:
@@ -3003,16 +3250,15 @@ def force_monitor_all_public():
     try:
         logger.info("🔄 Forçando monitoramento de todos os telefones...")
         
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT id, titulo, telefone_cliente 
                 FROM reunioes 
                 WHERE telefone_cliente IS NOT NULL 
                 AND telefone_cliente != ''
-                AND datetime(data_hora) >= datetime('now', '-7 days')
-                AND datetime(data_hora) <= datetime('now', '+30 days')
-            ''')
+                AND data_hora_ts BETWEEN ? AND ?
+            ''', (int(time.time()) - 7 * 86400, int(time.time()) + 30 * 86400))
             
             meetings = cursor.fetchall()
             monitored_count = 0
@@ -3074,7 +3320,7 @@ def simulate_responses():
         
         for meeting_id, response_text in confirmed_meetings:
             # Verifica se já tem resposta
-            with sqlite3.connect(DATABASE) as conn:
+            with get_connection(DATABASE) as conn:
                 cursor = conn.cursor()
                 cursor.execute('SELECT COUNT(*) FROM client_responses WHERE meeting_id = ?', (meeting_id,))
                 existing_count = cursor.fetchone()[0]
@@ -3221,21 +3467,21 @@ def get_monitoring_status_public():
         monitored_phones = list(whatsapp_monitor.monitored_phones)
         
         # Busca reuniões ativas que tem telefone
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT COUNT(*) FROM reunioes 
                 WHERE telefone_cliente IS NOT NULL 
                 AND telefone_cliente != ''
-                AND datetime(data_hora) >= datetime('now')
-            ''')
+                AND data_hora_ts >= ?
+            ''', (int(time.time()),))
             meetings_with_phone = cursor.fetchone()[0]
             
             # Busca respostas recentes (últimas 24h)
             cursor.execute('''
                 SELECT COUNT(*) FROM client_responses 
-                WHERE datetime(received_at) >= datetime('now', '-1 day')
-            ''')
+                WHERE received_at_ts >= ?
+            ''', (int(time.time()) - 86400,))
             recent_responses = cursor.fetchone()[0]
         
         return jsonify({
@@ -3261,42 +3507,93 @@ def get_monitoring_status_public():
 # ===============================
 # === ROTAS DE RESPOSTAS ========
 # ===============================
+
+# Estado do job de reclassificação (um por processo)
+rescore_job = {'running': False, 'started_at': None, 'finished_at': None, 'report': None, 'error': None}
+rescore_job_lock = threading.Lock()
+
+
+def _run_rescore_job(chunk_size: int, workers: Optional[int], dry_run: bool):
+    try:
+        report = rescore_client_responses(DATABASE, chunk_size=chunk_size, workers=workers, dry_run=dry_run)
+        rescore_job.update({'report': report, 'error': None})
+    except Exception as e:
+        logger.error(f"❌ Erro na reclassificação das respostas: {e}", exc_info=True)
+        rescore_job['error'] = str(e)
+    finally:
+        rescore_job.update({'running': False, 'finished_at': datetime.now().isoformat()})
+
+
+@app.route('/admin/rescore-responses', methods=['GET', 'POST'])
+@login_requerido
+def rescore_responses():
+    """Reclassifica o histórico de client_responses com o analisador atual (POST inicia, GET consulta)"""
+    if request.method == 'GET':
+        return jsonify({"success": True, "job": rescore_job})
+    
+    data = request.get_json(silent=True) or {}
+    # Valida antes de marcar o job como em andamento: erro aqui não pode travar o flag
+    try:
+        chunk_size = int(data.get('chunk_size', 2000))
+        workers = int(data['workers']) if data.get('workers') is not None else None
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "chunk_size e workers devem ser inteiros"}), 400
+    if chunk_size < 1 or (workers is not None and workers < 1):
+        return jsonify({"success": False, "message": "chunk_size e workers devem ser maiores que zero"}), 400
+    
+    with rescore_job_lock:
+        if rescore_job['running']:
+            return jsonify({"success": False, "message": "Reclassificação já em andamento", "job": rescore_job}), 409
+        rescore_job.update({
+            'running': True,
+            'started_at': datetime.now().isoformat(),
+            'finished_at': None,
+            'report': None,
+            'error': None
+        })
+    
+    try:
+        threading.Thread(
+            target=_run_rescore_job,
+            args=(chunk_size, workers, bool(data.get('dry_run', False))),
+            daemon=True
+        ).start()
+    except Exception as e:
+        with rescore_job_lock:
+            rescore_job.update({'running': False, 'finished_at': datetime.now().isoformat(), 'error': str(e)})
+        logger.error(f"💥 Falha ao iniciar reclassificação: {e}")
+        return jsonify({"success": False, "message": f"Erro interno: {str(e)}"}), 500
+    
+    return jsonify({"success": True, "message": "Reclassificação iniciada", "job": rescore_job}), 202
+
 @app.route('/agenda/responses/<int:meeting_id>')
 @login_requerido
 def get_meeting_responses(meeting_id):
     """Obtém respostas de uma reunião específica"""
     try:
-        with sqlite3.connect(DATABASE) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT cr.*, r.titulo, r.convidado
-                FROM client_responses cr
-                LEFT JOIN reunioes r ON cr.meeting_id = r.id
-                WHERE cr.meeting_id = ?
-                ORDER BY cr.received_at DESC
-            ''', (meeting_id,))
-            
-            responses = cursor.fetchall()
-            
-            response_list = []
-            for resp in responses:
-                response_list.append({
-                    "id": resp[0],
-                    "response_text": resp[2],
-                    "status": resp[3],
-                    "confidence": resp[4],
-                    "analysis_data": json.loads(resp[5]) if resp[5] else {},
-                    "received_at": resp[6],
-                    "processed_at": resp[7],
-                    "meeting_title": resp[8] if len(resp) > 8 else None,
-                    "meeting_guest": resp[9] if len(resp) > 9 else None
-                })
-            
-            return jsonify({
-                "success": True,
-                "responses": response_list
+        # Todas as respostas são da mesma reunião: busca título/convidado uma vez
+        meeting = meetings_repo.get(meeting_id)
+        
+        response_list = []
+        for resp in responses_repo.for_meeting(meeting_id):
+            response_list.append({
+                "id": resp.id,
+                "response_text": resp.response_text,
+                "status": resp.status,
+                "confidence": resp.confidence,
+                "analysis_data": json.loads(resp.analysis_data) if resp.analysis_data else {},
+                "received_at": resp.received_at,
+                "processed_at": resp.processed_at,
+                "meeting_title": meeting.titulo if meeting else None,
+                "meeting_guest": meeting.convidado if meeting else None,
+                "message_id": resp.message_id
             })
-            
+        
+        return jsonify({
+            "success": True,
+            "responses": response_list
+        })
+        
     except Exception as e:
         logger.error(f"Erro ao buscar respostas: {e}")
         return jsonify({
@@ -3400,25 +3697,21 @@ def preview_message(meeting_id):
     """Preview da mensagem formatada"""
     try:
         # Busca dados da reunião
-        with sqlite3.connect(DATABASE) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM reunioes WHERE id = ?', (meeting_id,))
-            meeting = cursor.fetchone()
-            
-            if not meeting:
-                return jsonify({
-                    "success": False,
-                    "message": "Reunião não encontrada"
-                }), 404
+        meeting = meetings_repo.get(meeting_id)
+        if not meeting:
+            return jsonify({
+                "success": False,
+                "message": "Reunião não encontrada"
+            }), 404
         
         # Converte para dicionário
         meeting_data = {
-            'convidado': meeting[2],
-            'data_hora': meeting[3],
-            'assunto': meeting[4],
-            'link': meeting[5] or '',
-            'nome_cliente': meeting[6] or '',
-            'local_reuniao': meeting[8] if len(meeting) > 8 else ''
+            'convidado': meeting.convidado,
+            'data_hora': meeting.data_hora,
+            'assunto': meeting.assunto,
+            'link': meeting.link or '',
+            'nome_cliente': meeting.nome_cliente or '',
+            'local_reuniao': meeting.local_reuniao or ''
         }
         
         # Formata mensagem
@@ -3443,35 +3736,24 @@ def preview_message(meeting_id):
 def get_whatsapp_logs():
     """Retorna logs de mensagens enviadas"""
     try:
-        with sqlite3.connect(DATABASE) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT wl.*, r.titulo, r.convidado 
-                FROM whatsapp_logs wl
-                LEFT JOIN reunioes r ON wl.meeting_id = r.id
-                ORDER BY wl.sent_at DESC
-                LIMIT 100
-            ''')
-            logs = cursor.fetchall()
-            
-            log_list = []
-            for log in logs:
-                log_list.append({
-                    "id": log[0],
-                    "meeting_id": log[1],
-                    "phone": log[2],
-                    "status": log[4],
-                    "sent_at": log[5],
-                    "error_message": log[6],
-                    "meeting_title": log[7] if len(log) > 7 else None,
-                    "meeting_guest": log[8] if len(log) > 8 else None
-                })
-            
-            return jsonify({
-                "success": True,
-                "logs": log_list
+        log_list = []
+        for log in whatsapp_logs_repo.recent(100):
+            log_list.append({
+                "id": log.id,
+                "meeting_id": log.meeting_id,
+                "phone": log.phone,
+                "status": log.status,
+                "sent_at": log.sent_at,
+                "error_message": log.error_message,
+                "meeting_title": log.meeting_title,
+                "meeting_guest": log.meeting_guest
             })
-            
+        
+        return jsonify({
+            "success": True,
+            "logs": log_list
+        })
+        
     except Exception as e:
         logger.error(f"Erro ao buscar logs: {e}")
         return jsonify({
@@ -3559,15 +3841,15 @@ def delete_whatsapp_instance():
 def get_confirmation_status():
     """Retorna status de confirmação de todas as reuniões"""
     try:
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT id, titulo, convidado, data_hora, status_confirmacao,
                        (SELECT COUNT(*) FROM client_responses WHERE meeting_id = reunioes.id) as response_count
                 FROM reunioes 
-                WHERE datetime(data_hora) >= datetime('now')
-                ORDER BY data_hora
-            ''')
+                WHERE data_hora_ts >= ?
+                ORDER BY data_hora_ts
+            ''', (int(time.time()),))
             
             meetings = cursor.fetchall()
             
@@ -3604,19 +3886,10 @@ def verificar_reunioes_futuras():
             agora = datetime.now()
             intervalo = agora + timedelta(minutes=10)
             
-            with sqlite3.connect(DATABASE) as conn:
-                cursor = conn.cursor()
-                cursor.execute('''
-                    SELECT * FROM reunioes 
-                    WHERE datetime(data_hora) BETWEEN datetime(?) AND datetime(?)
-                ''', (agora.isoformat(), intervalo.isoformat()))
-                
-                reunioes = cursor.fetchall()
-                
-                for r in reunioes:
-                    local_info = f" no local '{r[8]}'" if len(r) > 8 and r[8] else ""
-                    status_info = f" (Status: {r[9]})" if len(r) > 9 else ""
-                    logger.info(f"[Notificação] Reunião '{r[1]}' com {r[2]} às {r[3]}{local_info}{status_info}")
+            for r in meetings_repo.between(to_epoch(agora), to_epoch(intervalo)):
+                local_info = f" no local '{r.local_reuniao}'" if r.local_reuniao else ""
+                status_info = f" (Status: {r.status_confirmacao})"
+                logger.info(f"[Notificação] Reunião '{r.titulo}' com {r.convidado} às {r.data_hora}{local_info}{status_info}")
                     
         except Exception as e:
             logger.error(f"Erro no agente de notificação: {e}")
@@ -3633,22 +3906,22 @@ def cleanup_old_logs():
             # Remove logs com mais de 30 dias
             cutoff_date = datetime.now() - timedelta(days=30)
             
-            with sqlite3.connect(DATABASE) as conn:
+            with get_connection(DATABASE) as conn:
                 cursor = conn.cursor()
                 
                 # Limpa logs de WhatsApp
                 cursor.execute('''
                     DELETE FROM whatsapp_logs 
-                    WHERE sent_at < ?
-                ''', (cutoff_date.isoformat(),))
+                    WHERE sent_at_ts < ?
+                ''', (to_epoch(cutoff_date),))
                 
                 deleted_logs = cursor.rowcount
                 
                 # Limpa respostas antigas
                 cursor.execute('''
                     DELETE FROM client_responses 
-                    WHERE received_at < ?
-                ''', (cutoff_date.isoformat(),))
+                    WHERE received_at_ts < ?
+                ''', (to_epoch(cutoff_date),))
                 
                 deleted_responses = cursor.rowcount
                 conn.commit()
@@ -4152,7 +4425,7 @@ def sync_from_fixed_spreadsheet():
                 return False, f'❌ Coluna obrigatória não encontrada: {required}. Disponíveis: {list(df.columns)}'
         
         # CORREÇÃO: Usa transação completa
-        conn = sqlite3.connect('sistema.db')
+        conn = get_connection('sistema.db')
         cursor = conn.cursor()
         
         try:
@@ -4332,7 +4605,7 @@ def sync_from_fixed_spreadsheet():
 def clean_existing_duplicates():
     """Remove duplicatas existentes baseado em nome + nascimento"""
     try:
-        conn = sqlite3.connect('sistema.db')
+        conn = get_connection('sistema.db')
         cursor = conn.cursor()
         
         logger.info("🔍 Buscando duplicatas...")
@@ -4459,59 +4732,67 @@ def get_spreadsheet_info():
             'error': str(e)
         }
 
+def _migracao_aniversarios_tabelas_base(conn):
+    """v1: tabelas do sistema de aniversários + configuração padrão"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS aniversariantes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL,
+            empresa TEXT DEFAULT '',
+            nascimento DATE NOT NULL,
+            whatsapp TEXT NOT NULL,
+            ativo BOOLEAN DEFAULT 1,
+            data_cadastro DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS config_aniversarios (
+            id INTEGER PRIMARY KEY,
+            horario_envio TEXT DEFAULT '09:00',
+            dias_antecedencia INTEGER DEFAULT 0,
+            ativo BOOLEAN DEFAULT 1,
+            template_mensagem TEXT DEFAULT 'Parabéns {nome}! 🎉'
+        )
+    """)
+    
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS logs_aniversarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            aniversariante_id INTEGER,
+            nome_aniversariante TEXT,
+            empresa_aniversariante TEXT,
+            whatsapp TEXT,
+            data_envio DATETIME DEFAULT CURRENT_TIMESTAMP,
+            status TEXT,
+            erro TEXT,
+            FOREIGN KEY (aniversariante_id) REFERENCES aniversariantes (id)
+        )
+    """)
+    
+    # Config padrão se não existir
+    cursor.execute('''
+        INSERT OR IGNORE INTO config_aniversarios (id, template_mensagem) 
+        VALUES (1, 'Olá {nome}! 🎉\n\nParabéns pelo seu aniversário! 🎂\nA equipe deseja muito sucesso!\n\nUm abraço! 🤗')
+    ''')
+
+
+def _migracao_aniversarios_data_envio_epoch(conn):
+    """v2: logs_aniversarios.data_envio_ts indexado"""
+    ensure_epoch_column(conn, 'logs_aniversarios', 'data_envio')
+
+
+MIGRACOES_ANIVERSARIOS = [
+    (1, 'tabelas_base', _migracao_aniversarios_tabelas_base),
+    (2, 'data_envio_epoch', _migracao_aniversarios_data_envio_epoch),
+]
+
+
 def init_birthday_db():
-    """Inicializa banco CORRIGIDO com tratamento de erros"""
+    """Aplica as migrações pendentes do banco de aniversários (sistema.db)"""
     try:
-        conn = sqlite3.connect('sistema.db')
-        cursor = conn.cursor()
-        
-        # CORREÇÃO: Verifica se tabelas existem antes de criar
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS aniversariantes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                nome TEXT NOT NULL,
-                empresa TEXT DEFAULT '',
-                nascimento DATE NOT NULL,
-                whatsapp TEXT NOT NULL,
-                ativo BOOLEAN DEFAULT 1,
-                data_cadastro DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS config_aniversarios (
-                id INTEGER PRIMARY KEY,
-                horario_envio TEXT DEFAULT '09:00',
-                dias_antecedencia INTEGER DEFAULT 0,
-                ativo BOOLEAN DEFAULT 1,
-                template_mensagem TEXT DEFAULT 'Parabéns {nome}! 🎉'
-            )
-        """)
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS logs_aniversarios (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                aniversariante_id INTEGER,
-                nome_aniversariante TEXT,
-                empresa_aniversariante TEXT,
-                whatsapp TEXT,
-                data_envio DATETIME DEFAULT CURRENT_TIMESTAMP,
-                status TEXT,
-                erro TEXT,
-                FOREIGN KEY (aniversariante_id) REFERENCES aniversariantes (id)
-            )
-        """)
-        
-        # Insere config padrão se não existir
-        cursor.execute('SELECT COUNT(*) FROM config_aniversarios')
-        if cursor.fetchone()[0] == 0:
-            cursor.execute('''
-                INSERT INTO config_aniversarios (id, template_mensagem) 
-                VALUES (1, 'Olá {nome}! 🎉\n\nParabéns pelo seu aniversário! 🎂\nA equipe deseja muito sucesso!\n\nUm abraço! 🤗')
-            ''')
-        
-        conn.commit()
-        conn.close()
+        run_migrations('sistema.db', 'aniversarios', MIGRACOES_ANIVERSARIOS)
         logger.info("✅ Banco de aniversários inicializado")
         return True
         
@@ -4522,7 +4803,7 @@ def init_birthday_db():
 
 def get_birthday_config():
     """Obtém a configuração atual do sistema"""
-    conn = sqlite3.connect('sistema.db')
+    conn = get_connection('sistema.db')
     cursor = conn.cursor()
     cursor.execute('SELECT * FROM config_aniversarios WHERE id = 1')
     config = cursor.fetchone()
@@ -4549,7 +4830,7 @@ def api_aniversarios():
     Retorna apenas: nome, empresa, data_aniversario
     """
     try:
-        conn = sqlite3.connect('sistema.db')  # Banco de aniversários
+        conn = get_connection('sistema.db')  # Banco de aniversários
         cursor = conn.cursor()
         
         # Busca todos os aniversariantes ativos
@@ -4621,7 +4902,7 @@ def sync_check():
     Útil para debug
     """
     try:
-        conn = sqlite3.connect('sistema.db')
+        conn = get_connection('sistema.db')
         cursor = conn.cursor()
         
         # Total no banco
@@ -4667,88 +4948,6 @@ def sync_check():
 # API aniversários - MÉTODOS DE ENVIO DE MENSAGENS |
 
 # =====================================================
-# ===============================
-# CORREÇÃO 3: MÉTODO COM RETRY AUTOMÁTICO (RECOMENDADO)
-# ===============================
-# Adicione este método na classe EvolutionAPIManager para melhor compatibilidade
-
-def send_message_with_retry(self, phone: str, message: str, max_retries: int = 3) -> Tuple[bool, str]:
-    """Envia mensagem com retry automático e múltiplos formatos"""
-    
-    # Formatos possíveis da Evolution API
-    formats = [
-        # Formato v2.x mais recente
-        {
-            "name": "v2_textMessage",
-            "data": lambda phone, msg: {
-                "number": phone,
-                "textMessage": {"text": msg}
-            }
-        },
-        # Formato v1.x tradicional (fallback)
-        {
-            "name": "v1_text",
-            "data": lambda phone, msg: {
-                "number": phone,
-                "text": msg
-            }
-        },
-        # Formato alternativo com options
-        {
-            "name": "v2_with_options",
-            "data": lambda phone, msg: {
-                "number": phone,
-                "textMessage": {
-                    "text": msg
-                },
-                "options": {
-                    "delay": 1200,
-                    "presence": "composing"
-                }
-            }
-        }
-    ]
-    
-    normalized_phone = self.normalize_phone_number(phone)
-    logger.info(f"Tentando enviar mensagem para: {normalized_phone}")
-    
-    last_error = ""
-    
-    for fmt in formats:
-        logger.info(f"Tentando formato: {fmt['name']}")
-        
-    for attempt in range(max_retries):
-            try:
-                data = fmt['data'](normalized_phone, message)
-                
-                success, result = self._make_request('POST', f'/message/sendText/{self.instance_name}', data)
-                
-                if success:
-                    logger.info(f"✅ Mensagem enviada com sucesso usando formato {fmt['name']} (tentativa {attempt + 1})")
-                    return True, f"Mensagem enviada com sucesso (formato: {fmt['name']})"
-                
-                error_msg = result.get('error', 'Erro desconhecido')
-                last_error = f"Formato {fmt['name']}: {error_msg}"
-                
-                # Se é erro de formato, pula para próximo formato
-                if any(keyword in str(error_msg).lower() for keyword in ['textmessage', 'text', 'property', 'requires']):
-                    logger.warning(f"Erro de formato detectado no {fmt['name']}, tentando próximo formato...")
-                    break
-                
-                # Se é outro tipo de erro, tenta novamente com mesmo formato
-                if attempt < max_retries - 1:
-                    logger.warning(f"Tentativa {attempt + 1} falhou com {fmt['name']}, tentando novamente...")
-                    time.sleep(1)
-                
-            except Exception as e:
-                last_error = f"Erro interno no formato {fmt['name']}: {str(e)}"
-                logger.error(last_error)
-                if attempt < max_retries - 1:
-                    time.sleep(1)
-    
-    logger.error(f"❌ Falha ao enviar mensagem após tentar todos os formatos")
-    return False, f"Falha após {max_retries} tentativas com todos os formatos. Último erro: {last_error}"
-
 def calculate_age(birth_date):
     """Calcula a idade baseada na data de nascimento"""
     today = datetime.now()
@@ -4767,8 +4966,6 @@ def calculate_age(birth_date):
 @app.route('/disparador')
 def disparador():
     """Página principal do sistema de aniversários"""
-    # Garante que o banco está inicializado quando acessar a página
-    init_birthday_db()
     return render_template('disparo.html', titulo="Sistema de Aniversários")
 
 @app.route('/api/aniversarios/init-db', methods=['POST'])
@@ -4784,10 +4981,7 @@ def init_db_route():
 def dashboard_aniversarios():
     """Dashboard com estatísticas"""
     try:
-        # Garante que o banco está inicializado
-        init_birthday_db()
-        
-        conn = sqlite3.connect('sistema.db')
+        conn = get_connection('sistema.db')
         cursor = conn.cursor()
         
         # Total de aniversariantes
@@ -4818,8 +5012,8 @@ def dashboard_aniversarios():
         # Enviados hoje
         cursor.execute('''
             SELECT COUNT(*) FROM logs_aniversarios 
-            WHERE DATE(data_envio) = DATE('now') AND status = 'success'
-        ''')
+            WHERE data_envio_ts >= ? AND data_envio_ts < ? AND status = 'success'
+        ''', day_bounds())
         enviados_hoje = cursor.fetchone()[0]
         
         # Lista de aniversariantes de hoje
@@ -4827,9 +5021,9 @@ def dashboard_aniversarios():
             SELECT a.*, l.status as enviado 
             FROM aniversariantes a
             LEFT JOIN logs_aniversarios l ON a.id = l.aniversariante_id 
-                AND DATE(l.data_envio) = DATE('now')
+                AND l.data_envio_ts >= ? AND l.data_envio_ts < ?
             WHERE a.ativo = 1 AND strftime('%m-%d', a.nascimento) = ?
-        ''', (today,))
+        ''', (*day_bounds(), today))
         
         aniversariantes_hoje = []
         for row in cursor.fetchall():
@@ -4866,9 +5060,6 @@ def dashboard_aniversarios():
 def sync_spreadsheet():
     """Sincroniza dados da planilha fixa"""
     try:
-        # Garante que o banco está inicializado
-        init_birthday_db()
-        
         success, result = sync_from_fixed_spreadsheet()
         
         if success:
@@ -4891,9 +5082,6 @@ def sync_spreadsheet():
 def upload_spreadsheet():
     """Faz upload da nova planilha fixa"""
     try:
-        # Garante que o banco está inicializado
-        init_birthday_db()
-        
         if 'file' not in request.files:
             return jsonify({'success': False, 'message': 'Nenhum arquivo enviado'})
         
@@ -4936,7 +5124,7 @@ def import_aniversarios():
 def list_aniversarios():
     """Lista todos os aniversariantes"""
     try:
-        conn = sqlite3.connect('sistema.db')
+        conn = get_connection('sistema.db')
         cursor = conn.cursor()
         cursor.execute('''
             SELECT id, nome, empresa, nascimento, whatsapp, ativo
@@ -4979,7 +5167,7 @@ def config_aniversarios():
         try:
             data = request.json
             
-            conn = sqlite3.connect('sistema.db')
+            conn = get_connection('sistema.db')
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -5009,77 +5197,48 @@ def check_today_birthdays():
         if not config.get('ativo', False):
             return jsonify({'success': False, 'message': 'Sistema desativado nas configurações'})
         
-        conn = sqlite3.connect('sistema.db')
-        cursor = conn.cursor()
-        
         # Calcula a data alvo (hoje - dias de antecedência)
         target_date = datetime.now() + timedelta(days=config.get('dias_antecedencia', 0))
         target_date_str = target_date.strftime('%m-%d')
         
-        # Busca aniversariantes do dia
-        cursor.execute('''
-            SELECT a.* FROM aniversariantes a
-            WHERE a.ativo = 1 AND strftime('%m-%d', a.nascimento) = ?
-            AND NOT EXISTS (
-                SELECT 1 FROM logs_aniversarios l 
-                WHERE l.aniversariante_id = a.id 
-                AND DATE(l.data_envio) = DATE('now')
-                AND l.status = 'success'
-            )
-        ''', (target_date_str,))
-        
-        aniversariantes = cursor.fetchall()
-        sent_count = 0
+        # Busca aniversariantes do dia ainda sem envio com sucesso hoje
+        aniversariantes = aniversariantes_repo.due(target_date_str, *day_bounds())
         
         template = config.get('template_mensagem', 'Parabéns {nome}! 🎉')
+        hoje = datetime.now().strftime('%Y-%m-%d')
         
+        itens = []
         for aniversariante in aniversariantes:
             try:
-                id_aniv, nome, empresa, nascimento, whatsapp, ativo, _ = aniversariante
-                
                 # Calcula idade
-                idade = calculate_age(nascimento)
+                idade = calculate_age(aniversariante.nascimento)
                 
                 # Monta mensagem
                 message = template.format(
-                    nome=nome,
-                    empresa=empresa or 'nossa equipe',
+                    nome=aniversariante.nome,
+                    empresa=aniversariante.empresa or 'nossa equipe',
                     idade=idade
                 )
                 
-                # CORREÇÃO AQUI: Usar a função renomeada
-                success, response = send_birthday_whatsapp_message(whatsapp, message)
-                
-                # Registra log
-                cursor.execute('''
-                    INSERT INTO logs_aniversarios 
-                    (aniversariante_id, nome_aniversariante, empresa_aniversariante, whatsapp, data_envio, status, erro)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    id_aniv, nome, empresa, whatsapp, datetime.now(),
-                    'success' if success else 'error',
-                    None if success else str(response)
-                ))
-                
-                if success:
-                    sent_count += 1
+                # Um envio por aniversariante por dia, mesmo que a verificação rode de novo
+                itens.append({
+                    'phone': aniversariante.whatsapp,
+                    'message': message,
+                    'ref_id': aniversariante.id,
+                    'dedupe_key': f"aniversario:{aniversariante.id}:{hoje}",
+                    'context': {'nome': aniversariante.nome, 'empresa': aniversariante.empresa}
+                })
                     
             except Exception as e:
-                # Registra erro no log
-                cursor.execute('''
-                    INSERT INTO logs_aniversarios 
-                    (aniversariante_id, nome_aniversariante, whatsapp, data_envio, status, erro)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (id_aniv, nome, whatsapp, datetime.now(), 'error', str(e)))
+                logger.error(f"Erro ao preparar mensagem de aniversário: {e}")
         
-        conn.commit()
-        conn.close()
+        queued_count = outbox.enqueue_many('aniversario', itens) if itens else 0
         
-        if sent_count > 0:
+        if queued_count > 0:
             return jsonify({
                 'success': True,
-                'sent_count': sent_count,
-                'message': f'{sent_count} mensagens enviadas com sucesso!'
+                'sent_count': queued_count,
+                'message': f'{queued_count} mensagens na fila de envio!'
             })
         else:
             return jsonify({
@@ -5095,16 +5254,16 @@ def check_today_birthdays():
 def test_message(id):
     """Envia mensagem de teste para um aniversariante específico"""
     try:
-        conn = sqlite3.connect('sistema.db')
+        conn = get_connection('sistema.db')
         cursor = conn.cursor()
         
-        cursor.execute('SELECT * FROM aniversariantes WHERE id = ?', (id,))
-        aniversariante = cursor.fetchone()
+        aniversariante = aniversariantes_repo.get(id)
         
         if not aniversariante:
             return jsonify({'success': False, 'message': 'Aniversariante não encontrado'})
         
-        _, nome, empresa, nascimento, whatsapp, _, _ = aniversariante
+        nome, empresa, nascimento, whatsapp = (aniversariante.nome, aniversariante.empresa,
+                                               aniversariante.nascimento, aniversariante.whatsapp)
         
         config = get_birthday_config()
         template = config.get('template_mensagem', 'Mensagem de teste para {nome}! 🧪')
@@ -5146,7 +5305,7 @@ def test_message(id):
 def delete_aniversariante(id):
     """Exclui um aniversariante"""
     try:
-        conn = sqlite3.connect('sistema.db')
+        conn = get_connection('sistema.db')
         cursor = conn.cursor()
         
         cursor.execute('SELECT nome FROM aniversariantes WHERE id = ?', (id,))
@@ -5173,29 +5332,7 @@ def delete_aniversariante(id):
 def logs_aniversarios():
     """Lista logs de envio"""
     try:
-        conn = sqlite3.connect('sistema.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM logs_aniversarios 
-            ORDER BY data_envio DESC 
-            LIMIT 100
-        ''')
-        
-        logs = []
-        for row in cursor.fetchall():
-            logs.append({
-                'id': row[0],
-                'aniversariante_id': row[1],
-                'nome_aniversariante': row[2],
-                'empresa_aniversariante': row[3],
-                'whatsapp': row[4],
-                'data_envio': row[5],
-                'status': row[6],
-                'erro': row[7]
-            })
-        
-        conn.close()
+        logs = [log._asdict() for log in aniversariantes_repo.recent_logs(100)]
         
         return jsonify({'success': True, 'logs': logs})
         
@@ -5267,7 +5404,7 @@ def add_aniversariante():
             }), 400
         
         # Verifica duplicata (mesmo nome + nascimento)
-        conn = sqlite3.connect('sistema.db')
+        conn = get_connection('sistema.db')
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -5565,7 +5702,7 @@ def health_check():
     """Endpoint de saúde MELHORADO com auto-correção"""
     try:
         # Verifica banco
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT COUNT(*) FROM reunioes')
             total_meetings = cursor.fetchone()[0]
@@ -5574,12 +5711,13 @@ def health_check():
                 SELECT COUNT(*) FROM reunioes 
                 WHERE telefone_cliente IS NOT NULL 
                 AND telefone_cliente != ''
-                AND datetime(data_hora) >= datetime('now', '-7 days')
+                AND data_hora_ts >= ?
                 AND status_confirmacao IN ('pending', 'unclear')
-            ''')
+            ''', (int(time.time()) - 7 * 86400,))
             meetings_needing_monitor = cursor.fetchone()[0]
         
         # Verifica monitoramento
+        whatsapp_monitor.refresh_registry()
         monitoring_active = whatsapp_monitor.monitoring
         monitored_count = len(whatsapp_monitor.monitored_phones)
         
@@ -5616,6 +5754,9 @@ def health_check():
                 "auto_corrected": auto_corrected
             },
             "evolution_api": evolution_status,
+            "evolution_connection": evolution_manager.connection.snapshot(),
+            "evolution_circuit": evolution_manager.client.breaker.snapshot(),
+            "sqlite": get_database_stats(),
             "timestamp": datetime.now().isoformat()
         })
         
@@ -5633,7 +5774,7 @@ def calendario():
     """Rota para exibir o calendário com reuniões"""
     try:
         # Conectar ao banco de dados
-        conn = sqlite3.connect('reunioes.db')
+        conn = get_connection('reunioes.db')
         conn.row_factory = sqlite3.Row  # Para acessar colunas por nome
         cursor = conn.cursor()
         
@@ -5736,87 +5877,15 @@ def calendario():
 def api_reunioes():
     """API para retornar reuniões E EVENTOS em formato JSON para o calendário"""
     try:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # ========== BUSCA REUNIÕES (🆕 ADICIONADO numero_pessoas) ==========
-        cursor.execute('''
-            SELECT 
-                id,
-                titulo,
-                convidado,
-                data_hora,
-                assunto,
-                nome_cliente,
-                telefone_cliente,
-                local_reuniao,
-                link,
-                status_confirmacao,
-                numero_pessoas
-            FROM reunioes
-            ORDER BY data_hora ASC
-        ''')
-        
-        reunioes = cursor.fetchall()
-        
-        # ========== BUSCA EVENTOS ==========
-        cursor.execute('''
-            SELECT 
-                id,
-                titulo,
-                tipo,
-                data_inicio,
-                data_fim,
-                local,
-                descricao,
-                participantes,
-                cor
-            FROM eventos
-            ORDER BY data_inicio ASC
-        ''')
-        
-        eventos = cursor.fetchall()
-        conn.close()
-        
-        # Converte reuniões (🆕 ADICIONADO numero_pessoas no dicionário)
-        reunioes_list = []
-        for reuniao in reunioes:
-            reunioes_list.append({
-                'id': reuniao[0],
-                'tipo_item': 'reuniao',
-                'titulo': reuniao[1],
-                'convidado': reuniao[2],
-                'data_hora': reuniao[3],
-                'assunto': reuniao[4] or '',
-                'nome_cliente': reuniao[5] or '',
-                'telefone_cliente': reuniao[6] or '',
-                'local_reuniao': reuniao[7] or '',
-                'link': reuniao[8] or '',
-                'confirmation_status': reuniao[9] or 'pending',
-                'numero_pessoas': reuniao[10] if len(reuniao) > 10 and reuniao[10] is not None else None  # 🆕 ADICIONE ESTA LINHA
-            })
-        
-        # Converte eventos
-        eventos_list = []
-        for evento in eventos:
-            eventos_list.append({
-                'id': evento[0],
-                'tipo_item': 'evento',
-                'titulo': evento[1],
-                'tipo': evento[2],
-                'data_inicio': evento[3],
-                'data_fim': evento[4],
-                'local': evento[5] or '',
-                'descricao': evento[6] or '',
-                'participantes': evento[7] or '',
-                'cor': evento[8] or 'amarelo'
-            })
+        # Arrays JSON montados pelo SQLite (mesmos defaults de antes: '' e 'pending'/'amarelo')
+        reunioes_json = meetings_repo.to_json(MeetingRepository.CALENDAR_JSON)
+        eventos_json = eventos_repo.to_json(EventRepository.CALENDAR_JSON)
         
         # RETORNA AMBOS
-        return jsonify({
-            'reunioes': reunioes_list,
-            'eventos': eventos_list
-        })
+        return app.response_class(
+            f'{{"reunioes": {reunioes_json}, "eventos": {eventos_json}}}',
+            mimetype='application/json'
+        )
         
     except Exception as e:
         logger.error(f"Erro ao buscar dados para API: {e}")
@@ -5836,7 +5905,7 @@ def api_meetings_recent_updates():
         # Busca reuniões atualizadas nos últimos 5 minutos
         five_minutes_ago = datetime.now() - timedelta(minutes=5)
         
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -5886,7 +5955,7 @@ def api_meetings_recent_updates():
 def api_eventos_list():
     """Lista todos os eventos"""
     try:
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT 
@@ -5990,7 +6059,7 @@ def api_eventos_criar():
             cor = 'amarelo'
         
         # Insere no banco
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 INSERT INTO eventos 
@@ -6027,7 +6096,7 @@ def api_eventos_editar(evento_id):
             return jsonify({'success': False, 'message': 'Dados não fornecidos'}), 400
         
         # Verifica se evento existe
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             cursor.execute('SELECT id FROM eventos WHERE id = ?', (evento_id,))
             
@@ -6103,7 +6172,7 @@ def api_eventos_editar(evento_id):
 def api_eventos_excluir(evento_id):
     """Exclui um evento"""
     try:
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             
             # Verifica se existe
@@ -6142,7 +6211,7 @@ def api_eventos_excluir(evento_id):
 def api_eventos_get(evento_id):
     """Obtém detalhes de um evento específico"""
     try:
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 SELECT 
@@ -6194,7 +6263,7 @@ def api_meeting_status(meeting_id):
     Retorna status de uma reunião específica
     """
     try:
-        with sqlite3.connect(DATABASE) as conn:
+        with get_connection(DATABASE) as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -6243,19 +6312,10 @@ def api_meeting_status(meeting_id):
 def get_evento(evento_id):
     """Busca dados de um evento específico"""
     try:
-        conn = sqlite3.connect(REUNIOES_DB)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM eventos WHERE id = ?
-        ''', (evento_id,))
-        
-        row = cursor.fetchone()
-        conn.close()
+        row = eventos_repo.get(evento_id)
         
         if row:
-            evento = dict(row)
+            evento = row._asdict()
             return jsonify({
                 'success': True,
                 'evento': evento
@@ -6294,7 +6354,16 @@ def auto_start_monitoring_on_startup():
     try:
         logger.info("🚀 Iniciando auto-monitoramento na startup...")
         
-        with sqlite3.connect(DATABASE) as conn:
+        # Partida a quente: o registro persistente já tem os telefones ativos
+        whatsapp_monitor.purge_expired()
+        whatsapp_monitor.refresh_registry(force=True)
+        if whatsapp_monitor.monitored_phones:
+            if not whatsapp_monitor.monitoring:
+                whatsapp_monitor.start_monitoring()
+            logger.info(f"✅ Monitoramento restaurado do registro: {len(whatsapp_monitor.monitored_phones)} telefones")
+            return
+        
+        with get_connection(DATABASE) as conn:
             cursor = conn.cursor()
             
             # Busca reuniões que precisam ser monitoradas
@@ -6303,10 +6372,9 @@ def auto_start_monitoring_on_startup():
                 FROM reunioes 
                 WHERE telefone_cliente IS NOT NULL 
                 AND telefone_cliente != ''
-                AND datetime(data_hora) >= datetime('now', '-7 days')
-                AND datetime(data_hora) <= datetime('now', '+30 days')
+                AND data_hora_ts BETWEEN ? AND ?
                 AND status_confirmacao IN ('pending', 'unclear')
-            ''')
+            ''', (int(time.time()) - 7 * 86400, int(time.time()) + 30 * 86400))
             
             meetings = cursor.fetchall()
             monitored_count = 0
@@ -6389,6 +6457,14 @@ if __name__ == '__main__':
         except Exception as e:
             logger.warning(f"⚠️ Erro ao iniciar thread de limpeza: {e}")
         
+        # Workers da fila do webhook
+        webhook_log_writer.start()
+        if WEBHOOK_QUEUE_CONFIG['async_mode']:
+            webhook_queue.start()
+        
+        # Dispatcher da outbox (confirmações, aniversários, campanhas, relatórios)
+        outbox.start()
+        
         # 8. Informações do sistema
         logger.info("=" * 70)
         logger.info("🎉 APLICAÇÃO INICIALIZADA COM SUCESSO!")
@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+📈 TESTE DE CARGA DOS ENVIOS (contra o evolution_stub.py)
+Arquivo: carga_envios.py
+
+Mede vazão (envios/s), latência p50/p99 e o tratamento de falhas (retries,
+429, dead letters, circuit breaker) da camada de envio: outbox + sender HTTP.
+
+  confirmacao   outbox 'confirmacao'  → sendText
+  aniversario   outbox 'aniversario'  → sendText (dedupe por dia)
+  campanha      outbox 'campanha'     → sendMedia com imagem
+  direto        EvolutionClient puro, N threads (teto do cliente HTTP)
+  webhook       POST em /webhook/evolution do app (ingestão de respostas)
+
+Os cenários de outbox enfileiram itens sintéticos (mesmos kinds e dedupe_keys
+do app) e enviam com mensagens_clientes.EvolutionAPIManager. Os produtores do
+app.py (AutoMessageSender com o template, check_today_birthdays com a busca de
+aniversariantes) não são exercitados: medem-se a fila, o dispatcher e o HTTP.
+
+A outbox roda num banco temporário, então nenhum dado real é tocado.
+
+Execute (com o stub rodando):
+    python evolution_stub.py --port 8090 --latencia-ms 80 --erro 0.05 --limite-rps 30
+    python carga_envios.py --cenario confirmacao aniversario campanha --total 500 --workers 8 --rps 50
+    python carga_envios.py --cenario webhook --app-url http://localhost:3000 --total 2000
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Dict, List, Tuple
+
+import requests
+
+from outbox import Outbox, OUTBOX_CONFIG
+from evolution_client import get_evolution_client
+from mensagens_clientes import EvolutionAPIManager
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - Pillow é opcional
+    Image = None
+
+# ====================================
+# CONFIGURAÇÕES
+# ====================================
+STUB_URL = os.getenv('EVOLUTION_BASE_URL', 'http://127.0.0.1:8090')
+API_KEY = os.getenv('EVOLUTION_API_KEY', 'olvjg1k1ldmbhyl8owi6')
+INSTANCE = os.getenv('EVOLUTION_INSTANCE', 'marco_reunioes_bot')
+CENARIOS = ('confirmacao', 'aniversario', 'campanha', 'direto', 'webhook')
+
+
+# ====================================
+# AUXILIARES
+# ====================================
+def percentile(values: List[float], pct: float) -> float:
+    """Percentil por ordenação (nearest-rank)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def telefone(i: int) -> str:
+    return f"55219{i:08d}"
+
+
+def classifica_erro(result: str) -> str:
+    text = str(result)
+    for marker, label in (('429', 'http_429'), ('HTTP 5', 'http_5xx'), ('circuito aberto', 'circuito_aberto'),
+                          ('Timeout', 'timeout'), ('conexão', 'conexao'), ('exists', 'numero_inexistente')):
+        if marker in text:
+            return label
+    return 'outro'
+
+
+class Cronometro:
+    """Envolve um sender da outbox medindo a latência de cada chamada HTTP"""
+
+    def __init__(self, sender):
+        self.sender = sender
+        self._lock = threading.Lock()
+        self.latencias: List[float] = []
+        self.erros: Dict[str, int] = {}
+
+    def __call__(self, item: Dict) -> Tuple[bool, str]:
+        started = time.perf_counter()
+        success, result = self.sender(item)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencias.append(elapsed)
+            if not success:
+                label = classifica_erro(result)
+                self.erros[label] = self.erros.get(label, 0) + 1
+        return success, result
+
+
+def gerar_imagem(path: str) -> str:
+    """Imagem de teste (~1600px) para a campanha; sem Pillow usa bytes fixos"""
+    if Image is not None:
+        Image.new('RGB', (1600, 1200), (30, 120, 200)).save(path, 'JPEG', quality=82)
+    else:
+        with open(path, 'wb') as f:
+            f.write(b'\xff\xd8\xff\xe0' + os.urandom(200_000) + b'\xff\xd9')
+    return path
+
+
+def stub_stats() -> Dict:
+    try:
+        return requests.get(f"{STUB_URL}/stub/stats", timeout=5).json()
+    except (requests.exceptions.RequestException, ValueError):
+        return {}
+
+
+# ====================================
+# CENÁRIOS COM OUTBOX
+# ====================================
+def cenario_outbox(kind: str, total: int, manager: EvolutionAPIManager, imagem: str = None,
+                   timeout: float = 600.0) -> Dict:
+    """Enfileira `total` envios de um tipo e espera a outbox esvaziar"""
+    db_path = os.path.join(tempfile.mkdtemp(prefix='carga_'), 'outbox.db')
+    box = Outbox(db_path)
+
+    def enviar(item: Dict) -> Tuple[bool, str]:
+        return manager.send_message(item['phone'], item['message'], image_path=item.get('media_path'))
+
+    cronometro = Cronometro(enviar)
+    box.register(kind, cronometro)
+
+    hoje = date.today().isoformat()
+    items = []
+    for i in range(total):
+        item = {'phone': telefone(i), 'message': f"Carga {kind} #{i}: reunião amanhã às 10h"}
+        if kind == 'confirmacao':
+            item.update(ref_id=i, dedupe_key=f"confirmacao:{i}")
+        elif kind == 'aniversario':
+            item.update(ref_id=i, dedupe_key=f"aniversario:{i}:{hoje}")
+        else:
+            item.update(ref_id=1, dedupe_key=f"campanha:1:{telefone(i)}", media_path=imagem,
+                        context={'nome': f"Cliente {i}"})
+        items.append(item)
+
+    started = time.perf_counter()
+    box.enqueue_many(kind, items)
+    # Reenfileirar não pode duplicar
+    duplicados = box.enqueue_many(kind, items[: min(10, total)])
+    box.start()
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with box._conn() as conn:
+            abertos = conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE state IN ('pending', 'sending')").fetchone()[0]
+        if not abertos:
+            break
+        time.sleep(0.2)
+    wall = time.perf_counter() - started
+    box.stop()
+
+    with box._conn() as conn:
+        estados = dict(conn.execute('SELECT state, COUNT(*) FROM outbox GROUP BY state').fetchall())
+        retentados = conn.execute('SELECT COUNT(*) FROM outbox WHERE attempts > 1').fetchone()[0]
+        fim_a_fim = [row[0] for row in conn.execute(
+            "SELECT sent_at - created_at FROM outbox WHERE state = 'sent'").fetchall()]
+
+    enviados = estados.get('sent', 0)
+    return {
+        'cenario': kind,
+        'total': total,
+        'enviados': enviados,
+        'dead': estados.get('dead', 0),
+        'pendentes': estados.get('pending', 0) + estados.get('sending', 0),
+        'retentados': retentados,
+        'duplicados_aceitos': duplicados,
+        'tempo_s': wall,
+        'envios_por_s': enviados / wall if wall else 0.0,
+        'http_p50_ms': percentile(cronometro.latencias, 50) * 1000,
+        'http_p99_ms': percentile(cronometro.latencias, 99) * 1000,
+        'fim_a_fim_p50_s': percentile(fim_a_fim, 50),
+        'fim_a_fim_p99_s': percentile(fim_a_fim, 99),
+        'chamadas_http': len(cronometro.latencias),
+        'erros': cronometro.erros,
+        'dispatcher': dict(box.stats),
+    }
+
+
+# ====================================
+# CENÁRIOS DIRETOS
+# ====================================
+def cenario_direto(total: int, concorrencia: int) -> Dict:
+    """Vazão máxima do EvolutionClient (pool de conexões) sem outbox"""
+    client = get_evolution_client(STUB_URL, API_KEY)
+    latencias: List[float] = []
+    erros: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def enviar(i: int):
+        started = time.perf_counter()
+        try:
+            resp = client.post(f"/message/sendText/{INSTANCE}",
+                               json={'number': telefone(i), 'textMessage': {'text': f"Carga direta #{i}"}})
+            ok, label = resp.status_code in (200, 201), f"http_{resp.status_code}"
+        except requests.exceptions.RequestException as e:
+            ok, label = False, classifica_erro(f"{type(e).__name__} {e}")
+        with lock:
+            latencias.append(time.perf_counter() - started)
+            if not ok:
+                erros[label] = erros.get(label, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as pool:
+        list(pool.map(enviar, range(total)))
+    wall = time.perf_counter() - started
+    falhas = sum(erros.values())
+    return {
+        'cenario': 'direto',
+        'total': total,
+        'enviados': total - falhas,
+        'tempo_s': wall,
+        'envios_por_s': (total - falhas) / wall if wall else 0.0,
+        'http_p50_ms': percentile(latencias, 50) * 1000,
+        'http_p99_ms': percentile(latencias, 99) * 1000,
+        'erros': erros,
+    }
+
+
+def cenario_webhook(total: int, concorrencia: int, app_url: str) -> Dict:
+    """Ingestão: POSTs messages.upsert no webhook do app (como a Evolution faria)"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concorrencia, pool_maxsize=concorrencia)
+    session.mount('http://', adapter)
+    latencias: List[float] = []
+    erros: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def postar(i: int):
+        payload = {
+            "event": "messages.upsert",
+            "instance": INSTANCE,
+            "data": {
+                "key": {"remoteJid": f"{telefone(i % 50)}@s.whatsapp.net", "fromMe": False, "id": f"CARGA{i:012d}"},
+                "message": {"conversation": "sim, confirmo"},
+                "messageTimestamp": int(time.time())
+            }
+        }
+        started = time.perf_counter()
+        try:
+            resp = session.post(f"{app_url}/webhook/evolution", json=payload, headers={'apikey': API_KEY}, timeout=30)
+            ok, label = resp.status_code < 400, f"http_{resp.status_code}"
+        except requests.exceptions.RequestException as e:
+            ok, label = False, classifica_erro(f"{type(e).__name__} {e}")
+        with lock:
+            latencias.append(time.perf_counter() - started)
+            if not ok:
+                erros[label] = erros.get(label, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as pool:
+        list(pool.map(postar, range(total)))
+    wall = time.perf_counter() - started
+    falhas = sum(erros.values())
+    return {
+        'cenario': 'webhook',
+        'total': total,
+        'enviados': total - falhas,
+        'tempo_s': wall,
+        'envios_por_s': (total - falhas) / wall if wall else 0.0,
+        'http_p50_ms': percentile(latencias, 50) * 1000,
+        'http_p99_ms': percentile(latencias, 99) * 1000,
+        'erros': erros,
+    }
+
+
+# ====================================
+# RELATÓRIO
+# ====================================
+def imprimir(resultado: Dict):
+    print("=" * 60)
+    origem = " (itens sintéticos na outbox)" if 'fim_a_fim_p50_s' in resultado else ""
+    print(f"📊 Cenário: {resultado['cenario']}{origem}")
+    print(f"   ✅ Concluídos: {resultado['enviados']}/{resultado['total']} em {resultado['tempo_s']:.2f}s "
+          f"→ {resultado['envios_por_s']:.1f}/s")
+    print(f"   ⏱️ HTTP p50 {resultado['http_p50_ms']:.1f} ms | p99 {resultado['http_p99_ms']:.1f} ms")
+    if 'fim_a_fim_p50_s' in resultado:
+        print(f"   📬 Fim a fim (enfileirado → enviado) p50 {resultado['fim_a_fim_p50_s']:.2f}s | "
+              f"p99 {resultado['fim_a_fim_p99_s']:.2f}s")
+        print(f"   🔄 Retentados: {resultado['retentados']} | ☠️ Dead: {resultado['dead']} | "
+              f"⏳ Pendentes: {resultado['pendentes']} | 🔁 Duplicados aceitos: {resultado['duplicados_aceitos']}")
+        print(f"   📞 Chamadas HTTP: {resultado['chamadas_http']}")
+    if resultado['erros']:
+        print(f"   ❌ Erros: {resultado['erros']}")
+
+
+def main():
+    global STUB_URL
+
+    parser = argparse.ArgumentParser(description="Teste de carga dos envios WhatsApp")
+    parser.add_argument('--cenario', nargs='+', default=['confirmacao'], choices=CENARIOS)
+    parser.add_argument('--total', type=int, default=200)
+    parser.add_argument('--stub-url', default=STUB_URL)
+    parser.add_argument('--app-url', default='http://localhost:3000')
+    parser.add_argument('--concorrencia', type=int, default=16, help="threads dos cenários direto/webhook")
+    parser.add_argument('--workers', type=int, default=OUTBOX_CONFIG['workers'])
+    parser.add_argument('--rps', type=float, default=50.0, help="limite de envios/s da outbox")
+    parser.add_argument('--backoff-base', type=float, default=0.5)
+    parser.add_argument('--max-attempts', type=int, default=OUTBOX_CONFIG['max_attempts'])
+    parser.add_argument('--imagem', help="imagem da campanha (padrão: gera uma JPEG de teste)")
+    parser.add_argument('--timeout', type=float, default=600.0)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    STUB_URL = args.stub_url.rstrip('/')
+
+    # Antes de instanciar a Outbox (o TokenBucket lê a configuração no __init__)
+    OUTBOX_CONFIG.update({
+        'workers': args.workers,
+        'batch_size': max(args.workers * 2, OUTBOX_CONFIG['batch_size']),
+        'mensagens_por_segundo': args.rps,
+        'rajada': max(1, int(args.rps)),
+        'poll_interval': 0.2,
+        'backoff_base': args.backoff_base,
+        'backoff_max': max(args.backoff_base * 8, 1.0),
+        'max_attempts': args.max_attempts,
+    })
+
+    manager = EvolutionAPIManager(STUB_URL, API_KEY, session=INSTANCE)
+    imagem = args.imagem
+    if 'campanha' in args.cenario and not imagem:
+        imagem = gerar_imagem(os.path.join(tempfile.mkdtemp(prefix='carga_'), 'campanha.jpg'))
+
+    print(f"🧪 Stub: {STUB_URL} | outbox: {args.workers} workers, {args.rps:.0f}/s, "
+          f"backoff {args.backoff_base}s, {args.max_attempts} tentativas")
+    resultados = []
+    for cenario in args.cenario:
+        if cenario == 'direto':
+            resultado = cenario_direto(args.total, args.concorrencia)
+        elif cenario == 'webhook':
+            resultado = cenario_webhook(args.total, args.concorrencia, args.app_url.rstrip('/'))
+        else:
+            resultado = cenario_outbox(cenario, args.total, manager, imagem=imagem, timeout=args.timeout)
+        imprimir(resultado)
+        resultados.append(resultado)
+
+    print("=" * 60)
+    print(f"🔌 Circuit breaker: {manager.client.breaker.snapshot()}")
+    stats = stub_stats()
+    if stats:
+        print(f"🧪 Stub: {stats.get('endpoints')} | webhooks {stats.get('webhooks')}")
+    return 0 if all(r['enviados'] for r in resultados) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
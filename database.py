@@ -0,0 +1,242 @@
+# database.py
+"""
+Acesso ao SQLite: conexões reaproveitadas por thread + PRAGMAs de desempenho
+
+Em vez de abrir um `sqlite3.connect(...)` novo a cada função (várias por
+requisição), cada thread mantém uma conexão por arquivo de banco, configurada
+uma única vez:
+
+    journal_mode=WAL        leitores não bloqueiam o escritor
+    synchronous=NORMAL      seguro com WAL, sem fsync a cada commit
+    busy_timeout            espera o lock em vez de "database is locked"
+    cache_size / mmap_size  mais páginas em memória
+    temp_store=MEMORY       ORDER BY / índices temporários em RAM
+
+`get_connection(path)` devolve um handle leve sobre essa conexão com a mesma
+interface do sqlite3.Connection, então o código existente continua igual:
+
+    with get_connection(DATABASE) as conn:   # commit/rollback como antes
+        conn.row_factory = sqlite3.Row        # vale só para este handle
+        ...
+    conn.close()                              # não fecha a conexão da thread
+
+`PRAGMA optimize` roda periodicamente em cada conexão.
+
+Colunas de data em texto ganham uma irmã `<coluna>_ts` (INTEGER, epoch UTC)
+indexada e mantida por trigger (`ensure_epoch_column`), para que filtros por
+intervalo sejam predicados simples (`data_hora_ts BETWEEN ? AND ?`) em vez de
+`datetime(data_hora)`, que impede o uso de índice.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional, Tuple, Union
+
+from dateutil import parser as date_parser
+
+logger = logging.getLogger(__name__)
+
+DB_CONFIG = {
+    'busy_timeout_ms': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '15000')),
+    'cache_size_kb': int(os.getenv('SQLITE_CACHE_SIZE_KB', '20000')),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+    'optimize_interval': float(os.getenv('SQLITE_OPTIMIZE_INTERVAL', '3600')),
+}
+
+_local = threading.local()
+_wal_ready = set()
+_wal_lock = threading.Lock()
+_stats = {'opened': 0, 'handed_out': 0, 'optimized': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key: str):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+def _apply_pragmas(conn: sqlite3.Connection, path: str):
+    """PRAGMAs por conexão; journal_mode é persistente no arquivo, então só uma vez por processo"""
+    key = os.path.abspath(path)
+    with _wal_lock:
+        if key not in _wal_ready:
+            try:
+                conn.execute('PRAGMA journal_mode=WAL')
+            except sqlite3.OperationalError as e:
+                logger.warning(f"⚠️ Não foi possível ativar WAL em {path}: {e}")
+            _wal_ready.add(key)
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f"PRAGMA busy_timeout={DB_CONFIG['busy_timeout_ms']}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CONFIG['cache_size_kb']}")
+    conn.execute(f"PRAGMA mmap_size={DB_CONFIG['mmap_size']}")
+    conn.execute('PRAGMA temp_store=MEMORY')
+
+
+def open_connection(path: str, **kwargs) -> sqlite3.Connection:
+    """Conexão nova e exclusiva do chamador, já configurada (jobs em lote, leitura + escrita simultâneas)"""
+    kwargs.setdefault('timeout', DB_CONFIG['busy_timeout_ms'] / 1000)
+    conn = sqlite3.connect(path, **kwargs)
+    _apply_pragmas(conn, path)
+    _count('opened')
+    return conn
+
+
+def _maybe_optimize(entry: Dict[str, Any]):
+    now = time.monotonic()
+    if now - entry['optimized_at'] < DB_CONFIG['optimize_interval']:
+        return
+    entry['optimized_at'] = now
+    conn = entry['conn']
+    if conn.in_transaction:
+        return
+    try:
+        conn.execute('PRAGMA optimize')
+        _count('optimized')
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️ PRAGMA optimize falhou: {e}")
+
+
+class ConnectionHandle:
+    """Handle sobre a conexão da thread: row_factory próprio e close() que não fecha a conexão"""
+
+    __slots__ = ('_conn', 'row_factory')
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+        self.row_factory = None
+
+    def cursor(self) -> sqlite3.Cursor:
+        cursor = self._conn.cursor()
+        cursor.row_factory = self.row_factory
+        return cursor
+
+    def execute(self, sql: str, parameters: Any = ()) -> sqlite3.Cursor:
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql: str, seq_of_parameters: Any) -> sqlite3.Cursor:
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, script: str) -> sqlite3.Cursor:
+        return self.cursor().executescript(script)
+
+    def close(self):
+        """Descarta o que não foi commitado, como fechar uma conexão faria"""
+        if self._conn.in_transaction:
+            self._conn.rollback()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    def __getattr__(self, name: str):
+        # commit, rollback, total_changes, in_transaction, create_function, ...
+        return getattr(self._conn, name)
+
+
+def get_connection(path: str) -> ConnectionHandle:
+    """Conexão reaproveitada desta thread para `path` (aberta e configurada na primeira vez)"""
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    key = os.path.abspath(path)
+    entry = connections.get(key)
+    if entry is None:
+        entry = connections[key] = {'conn': open_connection(path), 'optimized_at': time.monotonic()}
+    else:
+        _maybe_optimize(entry)
+    _count('handed_out')
+    return ConnectionHandle(entry['conn'])
+
+
+def release_thread_connections():
+    """Desfaz transações deixadas abertas nesta thread (fim de requisição: commit esquecido ou exceção)"""
+    connections = getattr(_local, 'connections', None) or {}
+    for entry in connections.values():
+        conn = entry['conn']
+        if conn.in_transaction:
+            logger.warning("⚠️ Transação SQLite deixada aberta; desfazendo")
+            conn.rollback()
+
+
+def close_thread_connections():
+    """Fecha as conexões da thread atual (fim de threads de longa duração, testes)"""
+    connections = getattr(_local, 'connections', None) or {}
+    for entry in connections.values():
+        try:
+            entry['conn'].close()
+        except sqlite3.Error:
+            pass
+    connections.clear()
+
+
+# ==================== TIMESTAMPS EPOCH ====================
+def _epoch_expr(ref: str, source_is_utc: bool) -> str:
+    # Texto sem fuso é hora local do servidor: o modificador 'utc' converte
+    # (e é ignorado quando o texto já traz fuso). CURRENT_TIMESTAMP já é UTC.
+    modifier = '' if source_is_utc else ", 'utc'"
+    return f"CAST(strftime('%s', {ref}{modifier}) AS INTEGER)"
+
+
+def ensure_epoch_column(conn, table: str, column: str, source_is_utc: bool = False) -> bool:
+    """Cria `<column>_ts` + índice + triggers de INSERT/UPDATE e preenche as linhas existentes
+
+    Idempotente. Retorna True se a coluna foi criada agora.
+    """
+    ts_column = f"{column}_ts"
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+    created = ts_column not in columns
+    if created:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {ts_column} INTEGER")
+        cursor = conn.execute(f"UPDATE {table} SET {ts_column} = {_epoch_expr(column, source_is_utc)}")
+        logger.info(f"✅ Coluna {table}.{ts_column} criada ({cursor.rowcount} linhas preenchidas)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_{ts_column} ON {table} ({ts_column})")
+    new_value = _epoch_expr(f"NEW.{column}", source_is_utc)
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_{ts_column}_insert AFTER INSERT ON {table}
+        BEGIN
+            UPDATE {table} SET {ts_column} = {new_value} WHERE rowid = NEW.rowid;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_{ts_column}_update AFTER UPDATE OF {column} ON {table}
+        BEGIN
+            UPDATE {table} SET {ts_column} = {new_value} WHERE rowid = NEW.rowid;
+        END
+    ''')
+    return created
+
+
+def to_epoch(value: Union[datetime, date, str, int, float, None]) -> Optional[int]:
+    """Converte datetime/date/texto ISO em epoch UTC; datas sem fuso são hora local"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            value = date_parser.parse(value)
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return int(value.timestamp())
+
+
+def day_bounds(day: Optional[date] = None) -> Tuple[int, int]:
+    """(início, fim) em epoch do dia local, fim exclusivo: `ts >= início AND ts < fim`"""
+    day = day or date.today()
+    start = datetime(day.year, day.month, day.day)
+    return int(start.timestamp()), int((start + timedelta(days=1)).timestamp())
+
+
+def get_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['config'] = dict(DB_CONFIG)
+    return stats
@@ -14,11 +14,15 @@ import json
 import logging
 from datetime import datetime, timedelta, date
 from typing import Dict, List, Any, Tuple
-import requests
 import re
 from dataclasses import dataclass
 from enum import Enum
 
+from evolution_client import get_evolution_client
+from outbox import get_outbox
+from database import get_connection, ensure_epoch_column, day_bounds
+from migrations import run_migrations, column_exists
+
 # Configuração de logging
 logging.basicConfig(
     level=logging.INFO,
@@ -58,12 +62,9 @@ class EvolutionAPIReports:
         self.api_key = config['api_key']
         self.instance_name = config['instance_name']
         
-        self.session = requests.Session()
-        self.session.headers.update({
-            'Content-Type': 'application/json',
-            'apikey': self.api_key,
-            'Accept': 'application/json'
-        })
+        # Cliente HTTP compartilhado com o app (pool keep-alive + métricas)
+        self.client = get_evolution_client(self.base_url, self.api_key)
+        self.session = self.client.session
 
     def normalize_phone_number(self, phone: str) -> str:
         """Normalização de telefone"""
@@ -90,17 +91,7 @@ class EvolutionAPIReports:
             normalized_phone = self.normalize_phone_number(phone)
             logger.info(f"📤 Enviando relatório para {normalized_phone}")
             
-            payload = {
-                "number": normalized_phone,
-                "textMessage": {
-                    "text": message
-                }
-            }
-            
-            endpoint = f'/message/sendText/{self.instance_name}'
-            url = f"{self.base_url}{endpoint}"
-            
-            response = self.session.post(url, json=payload, timeout=30)
+            response = self.client.send_text(self.instance_name, normalized_phone, message)
             
             if response.status_code in [200, 201]:
                 logger.info(f"✅ Relatório enviado com sucesso para {normalized_phone}")
@@ -115,25 +106,34 @@ class EvolutionAPIReports:
             logger.error(f"💥 {error_msg}")
             return False, error_msg
 
+# Processo separado do app: garante a coluna epoch de reunioes mesmo se o app ainda não migrou
+MIGRACOES_REUNIOES_RELATORIO = [
+    (1, 'reunioes_data_hora_epoch', lambda conn: ensure_epoch_column(conn, 'reunioes', 'data_hora')),
+]
+
 class RelatorioDados:
     """Classe para buscar dados das reuniões"""
     
     def __init__(self, database_path: str = 'reunioes.db'):
         self.database_path = database_path
+        try:
+            run_migrations(self.database_path, 'relatorios_reunioes', MIGRACOES_REUNIOES_RELATORIO)
+        except sqlite3.Error as e:
+            logger.warning(f"⚠️ Não foi possível preparar reunioes.data_hora_ts: {e}")
 
     def get_reunioes_periodo(self, data_inicio: date, data_fim: date) -> List[Dict]:
         """Busca reuniões em um período específico"""
         try:
-            with sqlite3.connect(self.database_path) as conn:
+            with get_connection(self.database_path) as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
                     SELECT id, titulo, convidado, data_hora, assunto, link, 
                            nome_cliente, telefone_cliente, local_reuniao, status_confirmacao
                     FROM reunioes 
-                    WHERE DATE(data_hora) BETWEEN ? AND ?
-                    ORDER BY data_hora
-                ''', (data_inicio.isoformat(), data_fim.isoformat()))
+                    WHERE data_hora_ts >= ? AND data_hora_ts < ?
+                    ORDER BY data_hora_ts
+                ''', (day_bounds(data_inicio)[0], day_bounds(data_fim)[1]))
                 
                 reunioes = []
                 for row in cursor.fetchall():
@@ -282,6 +282,14 @@ class GeradorRelatorios:
         self.evolution_api = evolution_api
         self.relatorio_dados = relatorio_dados
         self.template_manager = TemplateManager()
+        
+        # Relatórios saem pela outbox do banco principal (durável, com retry)
+        self.outbox = get_outbox(relatorio_dados.database_path)
+        self.outbox.register('relatorio', self._enviar_item)
+
+    def _enviar_item(self, item: Dict) -> Tuple[bool, str]:
+        """Sender da outbox para o tipo 'relatorio'"""
+        return self.evolution_api.send_message(item['phone'], item['message'])
 
     def gerar_relatorio_semanal_completo(self, data_inicio: date = None, data_fim: date = None) -> str:
         """Gera relatório semanal completo"""
@@ -436,27 +444,29 @@ class GeradorRelatorios:
             # Envia para cada destinatário
             resultados = {
                 'success': True,
-                'enviados': 0,
+                'enfileirados': 0,
                 'falhas': 0,
+                'outbox_ids': [],
                 'detalhes': [],
                 'relatorio_gerado': relatorio[:200] + '...' if len(relatorio) > 200 else relatorio
             }
             
+            # Enfileira para cada destinatário; a outbox cuida da vazão e das novas tentativas
+            periodo = datetime.now().strftime('%Y-%m-%d %H')
             for telefone in destinatarios:
                 try:
-                    success, message = self.evolution_api.send_message(telefone, relatorio)
+                    outbox_id = self.outbox.enqueue(
+                        'relatorio', telefone, relatorio,
+                        dedupe_key=f"relatorio:{tipo_relatorio.value}:{telefone}:{periodo}"
+                    )
                     
-                    if success:
-                        resultados['enviados'] += 1
-                        resultados['detalhes'].append(f"✅ {telefone}: Enviado")
-                        logger.info(f"✅ Relatório enviado para {telefone}")
+                    resultados['enfileirados'] += 1
+                    if outbox_id:
+                        resultados['outbox_ids'].append(outbox_id)
+                    if outbox_id:
+                        resultados['detalhes'].append(f"📥 {telefone}: Na fila de envio")
                     else:
-                        resultados['falhas'] += 1
-                        resultados['detalhes'].append(f"❌ {telefone}: {message}")
-                        logger.error(f"❌ Falha para {telefone}: {message}")
-                        
-                    # Delay entre envios
-                    time.sleep(2)
+                        resultados['detalhes'].append(f"📥 {telefone}: Já estava na fila")
                     
                 except Exception as e:
                     resultados['falhas'] += 1
@@ -467,7 +477,7 @@ class GeradorRelatorios:
             if resultados['falhas'] > 0:
                 resultados['success'] = False
                 
-            logger.info(f"📊 Relatório finalizado: {resultados['enviados']} enviados, {resultados['falhas']} falhas")
+            logger.info(f"📊 Relatório finalizado: {resultados['enfileirados']} na fila, {resultados['falhas']} falhas")
             
             return resultados
             
@@ -475,12 +485,54 @@ class GeradorRelatorios:
             logger.error(f"💥 Erro crítico no envio de relatório: {e}")
             return {
                 'success': False,
-                'enviados': 0,
+                'enfileirados': 0,
                 'falhas': len(destinatarios),
                 'error': str(e),
                 'detalhes': [f"💥 Erro crítico: {str(e)}"]
             }
 
+def _migracao_relatorios_tabelas_base(conn):
+    """v1: configurações e logs dos relatórios"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS configuracoes_relatorios (
+            id TEXT PRIMARY KEY,
+            nome TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            destinatarios TEXT NOT NULL,
+            horario_envio TEXT NOT NULL,
+            dias_semana TEXT NOT NULL,
+            ativo BOOLEAN DEFAULT 1,
+            template_personalizado TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS logs_relatorios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            configuracao_id TEXT,
+            data_envio DATETIME DEFAULT CURRENT_TIMESTAMP,
+            tipo_relatorio TEXT,
+            destinatarios_alvo TEXT,
+            enviados INTEGER,
+            falhas INTEGER,
+            status TEXT,
+            detalhes TEXT,
+            FOREIGN KEY (configuracao_id) REFERENCES configuracoes_relatorios (id)
+        )
+    ''')
+
+def _migracao_relatorios_enfileirados(conn):
+    """v2: o envio agora só enfileira na outbox; 'enviados' fica como histórico"""
+    if not column_exists(conn, 'logs_relatorios', 'enfileirados'):
+        conn.execute('ALTER TABLE logs_relatorios ADD COLUMN enfileirados INTEGER')
+
+MIGRACOES_RELATORIOS = [
+    (1, 'tabelas_base', _migracao_relatorios_tabelas_base),
+    (2, 'enfileirados', _migracao_relatorios_enfileirados),
+]
+
 class ConfiguradorRelatorios:
     """Gerencia configurações de relatórios automáticos"""
     
@@ -489,46 +541,11 @@ class ConfiguradorRelatorios:
         self.init_db()
 
     def init_db(self):
-        """Inicializa banco de configurações"""
+        """Aplica as migrações pendentes do banco de configurações"""
         try:
-            with sqlite3.connect(self.database_path) as conn:
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS configuracoes_relatorios (
-                        id TEXT PRIMARY KEY,
-                        nome TEXT NOT NULL,
-                        tipo TEXT NOT NULL,
-                        destinatarios TEXT NOT NULL,
-                        horario_envio TEXT NOT NULL,
-                        dias_semana TEXT NOT NULL,
-                        ativo BOOLEAN DEFAULT 1,
-                        template_personalizado TEXT,
-                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                    )
-                ''')
-                
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS logs_relatorios (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        configuracao_id TEXT,
-                        data_envio DATETIME DEFAULT CURRENT_TIMESTAMP,
-                        tipo_relatorio TEXT,
-                        destinatarios_alvo TEXT,
-                        enviados INTEGER,
-                        falhas INTEGER,
-                        status TEXT,
-                        detalhes TEXT,
-                        FOREIGN KEY (configuracao_id) REFERENCES configuracoes_relatorios (id)
-                    )
-                ''')
-                
-                conn.commit()
-                
-                # Insere configurações padrão se não existirem
-                self._criar_configuracoes_padrao()
-                
+            run_migrations(self.database_path, 'relatorios', MIGRACOES_RELATORIOS)
+            # Insere configurações padrão se não existirem
+            self._criar_configuracoes_padrao()
         except Exception as e:
             logger.error(f"Erro ao inicializar banco de configurações: {e}")
 
@@ -565,7 +582,7 @@ class ConfiguradorRelatorios:
                 }
             ]
             
-            with sqlite3.connect(self.database_path) as conn:
+            with get_connection(self.database_path) as conn:
                 cursor = conn.cursor()
                 
                 for config in configuracoes_padrao:
@@ -592,7 +609,7 @@ class ConfiguradorRelatorios:
     def obter_configuracoes_ativas(self) -> List[ConfiguracaoRelatorio]:
         """Obtém todas as configurações ativas"""
         try:
-            with sqlite3.connect(self.database_path) as conn:
+            with get_connection(self.database_path) as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
@@ -624,7 +641,7 @@ class ConfiguradorRelatorios:
     def salvar_configuracao(self, config: ConfiguracaoRelatorio) -> bool:
         """Salva ou atualiza uma configuração"""
         try:
-            with sqlite3.connect(self.database_path) as conn:
+            with get_connection(self.database_path) as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
@@ -653,17 +670,17 @@ class ConfiguradorRelatorios:
     def log_envio_relatorio(self, config_id: str, resultados: Dict[str, Any]):
         """Registra log de envio de relatório"""
         try:
-            with sqlite3.connect(self.database_path) as conn:
+            with get_connection(self.database_path) as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
                     INSERT INTO logs_relatorios 
-                    (configuracao_id, destinatarios_alvo, enviados, falhas, status, detalhes)
+                    (configuracao_id, destinatarios_alvo, enfileirados, falhas, status, detalhes)
                     VALUES (?, ?, ?, ?, ?, ?)
                 ''', (
                     config_id,
                     len(resultados.get('detalhes', [])),
-                    resultados.get('enviados', 0),
+                    resultados.get('enfileirados', 0),
                     resultados.get('falhas', 0),
                     'success' if resultados.get('success') else 'failed',
                     json.dumps(resultados.get('detalhes', []))
@@ -748,7 +765,7 @@ class SchedulerRelatorios:
             # Log do erro
             error_result = {
                 'success': False,
-                'enviados': 0,
+                'enfileirados': 0,
                 'falhas': len(config.destinatarios),
                 'detalhes': [f"Erro interno: {str(e)}"]
             }
@@ -882,6 +899,14 @@ class GeradorRelatorios:
         self.evolution_api = evolution_api
         self.relatorio_dados = relatorio_dados
         self.template_manager = TemplateManager()
+        
+        # Relatórios saem pela outbox do banco principal (durável, com retry)
+        self.outbox = get_outbox(relatorio_dados.database_path)
+        self.outbox.register('relatorio', self._enviar_item)
+
+    def _enviar_item(self, item: Dict) -> Tuple[bool, str]:
+        """Sender da outbox para o tipo 'relatorio'"""
+        return self.evolution_api.send_message(item['phone'], item['message'])
 
     def gerar_relatorio_semanal_completo(self, data_inicio: date = None, data_fim: date = None) -> str:
         """Gera relatório semanal completo - CORRIGIDO"""
@@ -1036,27 +1061,29 @@ class GeradorRelatorios:
             # Envia para cada destinatário
             resultados = {
                 'success': True,
-                'enviados': 0,
+                'enfileirados': 0,
                 'falhas': 0,
+                'outbox_ids': [],
                 'detalhes': [],
                 'relatorio_gerado': relatorio[:200] + '...' if len(relatorio) > 200 else relatorio
             }
             
+            # Enfileira para cada destinatário; a outbox cuida da vazão e das novas tentativas
+            periodo = datetime.now().strftime('%Y-%m-%d %H')
             for telefone in destinatarios:
                 try:
-                    success, message = self.evolution_api.send_message(telefone, relatorio)
+                    outbox_id = self.outbox.enqueue(
+                        'relatorio', telefone, relatorio,
+                        dedupe_key=f"relatorio:{tipo_relatorio.value}:{telefone}:{periodo}"
+                    )
                     
-                    if success:
-                        resultados['enviados'] += 1
-                        resultados['detalhes'].append(f"✅ {telefone}: Enviado")
-                        logger.info(f"✅ Relatório enviado para {telefone}")
+                    resultados['enfileirados'] += 1
+                    if outbox_id:
+                        resultados['outbox_ids'].append(outbox_id)
+                    if outbox_id:
+                        resultados['detalhes'].append(f"📥 {telefone}: Na fila de envio")
                     else:
-                        resultados['falhas'] += 1
-                        resultados['detalhes'].append(f"❌ {telefone}: {message}")
-                        logger.error(f"❌ Falha para {telefone}: {message}")
-                        
-                    # Delay entre envios
-                    time.sleep(2)
+                        resultados['detalhes'].append(f"📥 {telefone}: Já estava na fila")
                     
                 except Exception as e:
                     resultados['falhas'] += 1
@@ -1067,7 +1094,7 @@ class GeradorRelatorios:
             if resultados['falhas'] > 0:
                 resultados['success'] = False
                 
-            logger.info(f"📊 Relatório finalizado: {resultados['enviados']} enviados, {resultados['falhas']} falhas")
+            logger.info(f"📊 Relatório finalizado: {resultados['enfileirados']} na fila, {resultados['falhas']} falhas")
             
             return resultados
             
@@ -1075,7 +1102,7 @@ class GeradorRelatorios:
             logger.error(f"💥 Erro crítico no envio de relatório: {e}")
             return {
                 'success': False,
-                'enviados': 0,
+                'enfileirados': 0,
                 'falhas': len(destinatarios),
                 'error': str(e),
                 'detalhes': [f"💥 Erro crítico: {str(e)}"]
@@ -1099,6 +1126,7 @@ def main():
         gerador = GeradorRelatorios(evolution_api, relatorio_dados)
         configurador = ConfiguradorRelatorios()
         scheduler = SchedulerRelatorios(gerador, configurador)
+        gerador.outbox.start()
         
         print("✅ Componentes inicializados")
         
@@ -1121,6 +1149,23 @@ def main():
         print(f"💥 Erro crítico: {e}")
         logger.error(f"Erro crítico na inicialização: {e}")
 
+def aguardar_envios_outbox(outbox, outbox_ids: List[int], timeout: float = 60) -> Dict[int, Tuple[str, Any]]:
+    """Aguarda os envios saírem de pending/sending e mostra o resultado de cada um"""
+    limite = time.time() + timeout
+    estados = outbox.states(outbox_ids)
+    while time.time() < limite and any(estado in ('pending', 'sending') for estado, _ in estados.values()):
+        time.sleep(0.5)
+        estados = outbox.states(outbox_ids)
+    
+    for outbox_id, (estado, erro) in estados.items():
+        if estado == 'sent':
+            print(f"✅ Outbox {outbox_id}: entregue")
+        elif estado == 'dead':
+            print(f"❌ Outbox {outbox_id}: falhou - {erro}")
+        else:
+            print(f"⏳ Outbox {outbox_id}: ainda {estado} após {timeout:.0f}s" + (f" (último erro: {erro})" if erro else ""))
+    return estados
+
 def testar_relatorio_manual():
     """Função para testar geração manual de relatórios"""
     print("🧪 Teste Manual de Relatórios")
@@ -1135,6 +1180,8 @@ def testar_relatorio_manual():
         evolution_api = EvolutionAPIReports(EVOLUTION_CONFIG)
         relatorio_dados = RelatorioDados('reunioes.db')
         gerador = GeradorRelatorios(evolution_api, relatorio_dados)
+        # Sem o dispatcher a opção 4 só deixaria o relatório parado na fila
+        gerador.outbox.start()
         
         # Menu de testes
         while True:
@@ -1174,6 +1221,7 @@ def testar_relatorio_manual():
                         [telefone]
                     )
                     print(f"Resultado: {resultados}")
+                    aguardar_envios_outbox(gerador.outbox, resultados.get('outbox_ids', []))
                 
             elif escolha == "0":
                 break
@@ -1248,7 +1296,7 @@ def testar_relatorio_manual():
             # Log do erro
             error_result = {
                 'success': False,
-                'enviados': 0,
+                'enfileirados': 0,
                 'falhas': len(config.destinatarios),
                 'detalhes': [f"Erro interno: {str(e)}"]
             }
@@ -1300,6 +1348,7 @@ def main():
         gerador = GeradorRelatorios(evolution_api, relatorio_dados)
         configurador = ConfiguradorRelatorios()
         scheduler = SchedulerRelatorios(gerador, configurador)
+        gerador.outbox.start()
         
         print("✅ Componentes inicializados")
         
@@ -1336,6 +1385,8 @@ def testar_relatorio_manual():
         evolution_api = EvolutionAPIReports(EVOLUTION_CONFIG)
         relatorio_dados = RelatorioDados('reunioes.db')
         gerador = GeradorRelatorios(evolution_api, relatorio_dados)
+        # Sem o dispatcher a opção 4 só deixaria o relatório parado na fila
+        gerador.outbox.start()
         
         # Menu de testes
         while True:
@@ -1375,6 +1426,7 @@ def testar_relatorio_manual():
                         [telefone]
                     )
                     print(f"Resultado: {resultados}")
+                    aguardar_envios_outbox(gerador.outbox, resultados.get('outbox_ids', []))
                 
             elif escolha == "0":
                 break
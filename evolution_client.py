@@ -0,0 +1,488 @@
+# evolution_client.py
+"""
+Cliente HTTP compartilhado da Evolution API (WhatsApp)
+
+Um único requests.Session por servidor/chave, com pool de conexões keep-alive,
+timeouts padronizados e contadores de latência por endpoint. Usado por app.py,
+mensagens_clientes.py e disparo_relatorio_semanal.py.
+
+O estado da conexão da instância fica em cache (ConnectionStateCache), atualizado
+em background pelo endpoint leve connectionState.
+
+Um circuit breaker por cliente (fechado / aberto / meio-aberto) faz as chamadas
+falharem na hora enquanto o servidor estiver fora, em vez de esperar o timeout.
+"""
+
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Envio assíncrono (opcional)
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+# Timeouts (conexão, leitura) em segundos, compartilhados por todos os módulos
+TIMEOUTS = {
+    'default': (5, 15),
+    'status': (5, 8),
+    'text': (5, 15),
+    'media': (5, 30),
+}
+
+# Pool de conexões HTTP
+POOL_CONFIG = {
+    'pool_connections': 4,
+    'pool_maxsize': 32,
+}
+
+# Cache do estado da conexão (segundos)
+CONNECTION_STATE_CONFIG = {
+    'ttl': float(os.getenv('EVOLUTION_STATE_TTL', '30')),
+    'probe_interval': float(os.getenv('EVOLUTION_STATE_PROBE_INTERVAL', '15')),
+}
+
+CONNECTED_STATES = ('open', 'connected')
+
+# Circuit breaker: abre após N falhas seguidas (erro de rede/timeout/HTTP 5xx)
+CIRCUIT_BREAKER_CONFIG = {
+    'failure_threshold': int(os.getenv('EVOLUTION_CB_FAILURES', '5')),
+    'cooldown': float(os.getenv('EVOLUTION_CB_COOLDOWN', '30')),
+}
+
+# Remove o nome da instância do endpoint para agrupar as métricas
+_ENDPOINT_GROUPS = [
+    (re.compile(r'^(/message/\w+)/.+$'), r'\1'),
+    (re.compile(r'^(/instance/(?:connectionState|connect|restart|logout|delete))/.+$'), r'\1'),
+    (re.compile(r'^(/chat/\w+)/.+$'), r'\1'),
+]
+
+
+def endpoint_group(endpoint: str) -> str:
+    """'/message/sendText/minha_instancia' → '/message/sendText'"""
+    path = endpoint.split('?', 1)[0]
+    for pattern, replacement in _ENDPOINT_GROUPS:
+        if pattern.match(path):
+            return pattern.sub(replacement, path)
+    return path
+
+
+class EndpointMetrics:
+    """Contadores de latência por endpoint (thread-safe)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def record(self, endpoint: str, elapsed: float, ok: bool, status_code: Optional[int] = None):
+        with self._lock:
+            item = self._data.get(endpoint)
+            if item is None:
+                item = self._data[endpoint] = {
+                    'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'last_ms': 0.0, 'last_status': None
+                }
+            elapsed_ms = elapsed * 1000
+            item['count'] += 1
+            item['total_ms'] += elapsed_ms
+            item['max_ms'] = max(item['max_ms'], elapsed_ms)
+            item['last_ms'] = elapsed_ms
+            item['last_status'] = status_code
+            if not ok:
+                item['errors'] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                endpoint: {
+                    'count': item['count'],
+                    'errors': item['errors'],
+                    'avg_ms': round(item['total_ms'] / item['count'], 2) if item['count'] else 0.0,
+                    'max_ms': round(item['max_ms'], 2),
+                    'last_ms': round(item['last_ms'], 2),
+                    'last_status': item['last_status']
+                }
+                for endpoint, item in self._data.items()
+            }
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Chamada recusada sem rede: circuito aberto (subclasse de ConnectionError para os handlers existentes)"""
+
+
+class CircuitBreaker:
+    """Circuit breaker thread-safe: closed → open (após falhas) → half_open (uma chamada de teste)"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = None, cooldown: float = None):
+        self.failure_threshold = failure_threshold or CIRCUIT_BREAKER_CONFIG['failure_threshold']
+        self.cooldown = cooldown or CIRCUIT_BREAKER_CONFIG['cooldown']
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self.opens = 0
+        self.rejected = 0
+        self.last_failure = None
+
+    def allow(self) -> bool:
+        """True se a chamada pode ir para a rede"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    self.rejected += 1
+                    return False
+                self.state = self.HALF_OPEN
+                logger.info("🟡 Circuit breaker meio-aberto: testando a Evolution API")
+            # HALF_OPEN: só uma chamada de teste por vez
+            if self._trial_in_flight:
+                self.rejected += 1
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("🟢 Circuit breaker fechado: Evolution API respondendo")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self, reason: str = None):
+        with self._lock:
+            self.failures += 1
+            self.last_failure = reason[:200] if reason else None
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.opens += 1
+                    logger.warning(f"🔴 Circuit breaker aberto após {self.failures} falhas: {reason}")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def retry_after(self) -> float:
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(self.cooldown - (time.monotonic() - self.opened_at), 0.0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        retry_after = self.retry_after()
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'failure_threshold': self.failure_threshold,
+                'cooldown_s': self.cooldown,
+                'retry_after_s': round(retry_after, 1),
+                'opens': self.opens,
+                'rejected': self.rejected,
+                'last_failure': self.last_failure
+            }
+
+
+class EvolutionClient:
+    """Cliente HTTP da Evolution API com pool de conexões compartilhado"""
+
+    def __init__(self, base_url: str, api_key: str, pool_connections: int = None, pool_maxsize: int = None):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.metrics = EndpointMetrics()
+        self.breaker = CircuitBreaker()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections or POOL_CONFIG['pool_connections'],
+            pool_maxsize=pool_maxsize or POOL_CONFIG['pool_maxsize'],
+            max_retries=0,
+            pool_block=False
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({
+            'apikey': self.api_key,
+            'Accept': 'application/json',
+            'Connection': 'keep-alive'
+        })
+
+    def request(self, method: str, endpoint: str, timeout: Any = None, **kwargs) -> requests.Response:
+        """Executa a requisição e registra a latência; exceções do requests sobem ao chamador
+
+        Com o circuito aberto levanta CircuitOpenError imediatamente, sem tocar a rede.
+        """
+        url = f"{self.base_url}{endpoint}"
+        group = endpoint_group(endpoint)
+        if not self.breaker.allow():
+            self.metrics.record(group, 0.0, False)
+            raise CircuitOpenError(
+                f"Evolution API indisponível (circuito aberto, nova tentativa em {self.breaker.retry_after():.0f}s)"
+            )
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method.upper(), url, timeout=timeout or TIMEOUTS['default'], **kwargs)
+        except Exception as e:
+            self.breaker.record_failure(f"{type(e).__name__}: {e}")
+            if isinstance(e, requests.exceptions.RequestException):
+                self.metrics.record(group, time.perf_counter() - started, False)
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure(f"HTTP {response.status_code}")
+        else:
+            self.breaker.record_success()
+        self.metrics.record(group, time.perf_counter() - started, response.status_code < 400, response.status_code)
+        return response
+
+    def get(self, endpoint: str, **kwargs) -> requests.Response:
+        return self.request('GET', endpoint, **kwargs)
+
+    def post(self, endpoint: str, **kwargs) -> requests.Response:
+        return self.request('POST', endpoint, **kwargs)
+
+    def send_text(self, instance_name: str, number: str, text: str) -> requests.Response:
+        """POST /message/sendText/{instância} no formato v2 (textMessage)"""
+        return self.post(
+            f'/message/sendText/{instance_name}',
+            json={"number": number, "textMessage": {"text": text}},
+            timeout=TIMEOUTS['text']
+        )
+
+    def connection_state(self, instance_name: str) -> requests.Response:
+        return self.get(f'/instance/connectionState/{instance_name}', timeout=TIMEOUTS['status'])
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'base_url': self.base_url,
+            'circuit_breaker': self.breaker.snapshot(),
+            'endpoints': self.metrics.snapshot()
+        }
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_evolution_client(base_url: str, api_key: str) -> EvolutionClient:
+    """Retorna o cliente compartilhado para (base_url, api_key), criando se necessário"""
+    key = (base_url.rstrip('/'), api_key)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = EvolutionClient(base_url, api_key)
+            logger.info(f"🔌 Cliente Evolution API criado para {key[0]}")
+        return client
+
+
+def get_all_stats() -> List[Dict[str, Any]]:
+    """Métricas de todos os clientes criados neste processo"""
+    with _clients_lock:
+        clients = list(_clients.values())
+        states = list(_connection_states.values())
+    stats = [client.get_stats() for client in clients]
+    for cache in states:
+        for item in stats:
+            if item['base_url'] == cache.client.base_url:
+                item.setdefault('connection_states', []).append(cache.snapshot())
+    return stats
+
+
+# ===============================
+# === ESTADO DA CONEXÃO =========
+# ===============================
+
+class ConnectionStateCache:
+    """Estado da instância em cache, renovado por um prober em background
+
+    `get()` é O(1) e não faz chamada remota (exceto na primeira leitura).
+    Um envio com erro chama `force_refresh()` para acordar o prober na hora.
+    """
+
+    def __init__(self, client: EvolutionClient, instance_name: str,
+                 ttl: float = None, probe_interval: float = None):
+        self.client = client
+        self.instance_name = instance_name
+        self.ttl = ttl or CONNECTION_STATE_CONFIG['ttl']
+        self.probe_interval = probe_interval or CONNECTION_STATE_CONFIG['probe_interval']
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._connected = False
+        self._state = 'unknown'
+        self._checked_at = 0.0
+        self._error = None
+        self.probes = 0
+
+    @staticmethod
+    def parse_state(data: Any) -> str:
+        """Aceita {"instance": {"state": ...}} (v2) e {"state": ...} (v1)"""
+        if isinstance(data, dict):
+            return data.get('state') or (data.get('instance') or {}).get('state') or 'unknown'
+        return 'unknown'
+
+    def probe(self) -> Tuple[bool, str]:
+        """Consulta connectionState agora e atualiza o cache"""
+        with self._probe_lock:
+            error = None
+            try:
+                response = self.client.connection_state(self.instance_name)
+                if response.status_code == 200:
+                    state = self.parse_state(response.json())
+                elif response.status_code == 404:
+                    state, error = 'not_found', f"Instância '{self.instance_name}' não existe"
+                else:
+                    state, error = 'error', f"HTTP {response.status_code}"
+            except (requests.exceptions.RequestException, ValueError) as e:
+                state, error = 'error', f"Erro de conexão: {e}"
+
+            connected = str(state).lower() in CONNECTED_STATES
+            with self._lock:
+                changed = connected != self._connected or state != self._state
+                self._connected, self._state, self._error = connected, state, error
+                self._checked_at = time.time()
+                self.probes += 1
+            if changed:
+                log = logger.info if connected else logger.warning
+                log(f"{'✅' if connected else '⚠️'} Instância '{self.instance_name}': {state}" + (f" ({error})" if error else ""))
+            return connected, state
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name=f"evolution-state-{self.instance_name}", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.probe_interval)
+            self._wake.clear()
+            self.probe()
+
+    def get(self) -> Tuple[bool, str]:
+        """(conectado, estado) do cache; sonda de forma síncrona só se nunca sondou ou expirou sem prober"""
+        self.start()
+        with self._lock:
+            fresh = self._checked_at and (time.time() - self._checked_at) < self.ttl
+            prober_alive = self._thread is not None and self._thread.is_alive()
+            if fresh or (self._checked_at and prober_alive):
+                return self._connected, self._state
+        return self.probe()
+
+    def force_refresh(self, wait: bool = False) -> Optional[Tuple[bool, str]]:
+        """Acorda o prober imediatamente (ou sonda agora com wait=True)"""
+        if wait:
+            return self.probe()
+        self._wake.set()
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'instance': self.instance_name,
+                'connected': self._connected,
+                'state': self._state,
+                'error': self._error,
+                'age_s': round(time.time() - self._checked_at, 1) if self._checked_at else None,
+                'ttl_s': self.ttl,
+                'probe_interval_s': self.probe_interval,
+                'probes': self.probes
+            }
+
+
+_connection_states = {}
+
+
+def get_connection_state(client: EvolutionClient, instance_name: str) -> ConnectionStateCache:
+    """Cache compartilhado do estado de (cliente, instância)"""
+    key = (id(client), instance_name)
+    with _clients_lock:
+        cache = _connection_states.get(key)
+        if cache is None:
+            cache = _connection_states[key] = ConnectionStateCache(client, instance_name)
+        return cache
+
+
+# ===============================
+# === VARIANTE ASSÍNCRONA =======
+# ===============================
+
+class AsyncEvolutionClient:
+    """Envio concorrente de muitas mensagens sobre poucas conexões persistentes
+
+    Requer aiohttp (opcional). As métricas são registradas no mesmo
+    EndpointMetrics do cliente síncrono para o mesmo servidor.
+    """
+
+    def __init__(self, base_url: str, api_key: str, max_connections: int = 8):
+        if aiohttp is None:
+            raise RuntimeError("aiohttp não instalado - use EvolutionClient (síncrono)")
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.max_connections = max_connections
+        shared = get_evolution_client(base_url, api_key)
+        self.metrics = shared.metrics
+        self.breaker = shared.breaker
+
+    async def _post(self, http, semaphore, endpoint: str, payload: Dict, timeout: Tuple[int, int]) -> Tuple[bool, str]:
+        group = endpoint_group(endpoint)
+        async with semaphore:
+            if not self.breaker.allow():
+                self.metrics.record(group, 0.0, False)
+                return False, "Evolution API indisponível (circuito aberto)"
+            started = time.perf_counter()
+            try:
+                async with http.post(
+                    f"{self.base_url}{endpoint}",
+                    json=payload,
+                    timeout=aiohttp.ClientTimeout(connect=timeout[0], total=sum(timeout))
+                ) as response:
+                    body = await response.text()
+                    ok = response.status in (200, 201)
+                    if response.status >= 500:
+                        self.breaker.record_failure(f"HTTP {response.status}")
+                    else:
+                        self.breaker.record_success()
+                    self.metrics.record(group, time.perf_counter() - started, ok, response.status)
+                    return ok, body if not ok else "Mensagem enviada com sucesso"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.breaker.record_failure(f"{type(e).__name__}: {e}")
+                self.metrics.record(group, time.perf_counter() - started, False)
+                return False, f"Erro de conexão: {e}"
+
+    async def send_text_many(self, instance_name: str, messages: List[Tuple[str, str]],
+                             concurrency: int = 16) -> List[Tuple[bool, str]]:
+        """Envia [(número, texto), ...] mantendo no máximo `concurrency` requisições em voo"""
+        connector = aiohttp.TCPConnector(limit=self.max_connections, keepalive_timeout=30)
+        semaphore = asyncio.Semaphore(concurrency)
+        headers = {'apikey': self.api_key, 'Accept': 'application/json'}
+        endpoint = f'/message/sendText/{instance_name}'
+        async with aiohttp.ClientSession(connector=connector, headers=headers) as http:
+            return await asyncio.gather(*[
+                self._post(http, semaphore, endpoint,
+                           {"number": number, "textMessage": {"text": text}}, TIMEOUTS['text'])
+                for number, text in messages
+            ])
+
+    def send_text_many_sync(self, instance_name: str, messages: List[Tuple[str, str]],
+                            concurrency: int = 16) -> List[Tuple[bool, str]]:
+        """Atalho para chamar send_text_many a partir de código síncrono"""
+        return asyncio.run(self.send_text_many(instance_name, messages, concurrency))
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+🧪 EVOLUTION API LOCAL (STUB) PARA TESTES DE CARGA
+Arquivo: evolution_stub.py
+
+Imita os endpoints da Evolution API que o sistema usa, sem WhatsApp real:
+  POST /message/sendText/<instancia>
+  POST /message/sendMedia/<instancia>   (JSON base64/url ou multipart)
+  GET  /instance/fetchInstances
+  GET  /instance/connectionState/<instancia>
+  GET|POST /chat/whatsappNumbers/<instancia>
+
+Latência, taxa de erro e limite de requisições (429) são configuráveis, e o stub
+pode devolver eventos messages.upsert para /webhook/evolution simulando respostas
+dos clientes.
+
+Execute:
+    python evolution_stub.py --port 8090 --latencia-ms 80 --erro 0.02 --limite-rps 20 \\
+        --webhook-url http://localhost:3000/webhook/evolution --taxa-resposta 0.3
+
+E aponte o app para ele:
+    EVOLUTION_BASE_URL=http://localhost:8090 python app.py
+
+Rotas de controle:
+  GET  /stub/stats                 contadores por endpoint
+  POST /stub/config                altera a configuração em tempo de execução (JSON)
+  POST /stub/reset                 zera os contadores
+  POST /stub/webhook               dispara um evento {"phone": ..., "text": ...} para o webhook
+"""
+
+import argparse
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+
+import requests
+from flask import Flask, jsonify, request
+
+logger = logging.getLogger("evolution_stub")
+
+# ====================================
+# CONFIGURAÇÕES (alteráveis por linha de comando ou /stub/config)
+# ====================================
+STUB_CONFIG = {
+    'api_key': 'olvjg1k1ldmbhyl8owi6',
+    'instance_name': 'marco_reunioes_bot',
+    'estado': 'open',             # open | connecting | close
+    'latencia_ms': 50.0,          # latência base de cada resposta
+    'jitter_ms': 20.0,            # variação aleatória somada à latência
+    'taxa_erro': 0.0,             # fração de envios que falham com HTTP 500
+    'limite_rps': 0.0,            # envios/s acima disso recebem 429 (0 = sem limite)
+    'retry_after': 1,             # cabeçalho Retry-After das respostas 429
+    'numeros_inexistentes': [],   # números que "não existem no WhatsApp"
+    'webhook_url': '',
+    'taxa_resposta': 0.0,         # fração dos envios que gera uma resposta no webhook
+    'atraso_resposta_s': 1.0,
+    'respostas': ['sim, confirmo', 'confirmado', 'não vou poder ir', 'pode remarcar?'],
+}
+
+app = Flask(__name__)
+
+
+# ====================================
+# ESTATÍSTICAS
+# ====================================
+class StubStats:
+    """Contadores thread-safe por endpoint e resultado"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.counts = defaultdict(lambda: defaultdict(int))
+            self.bytes_recebidos = 0
+            self.webhooks = {'enviados': 0, 'falhas': 0}
+
+    def record(self, endpoint: str, status: int, body_size: int = 0):
+        with self._lock:
+            self.counts[endpoint][str(status)] += 1
+            self.bytes_recebidos += body_size
+
+    def record_webhook(self, ok: bool):
+        with self._lock:
+            self.webhooks['enviados' if ok else 'falhas'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'uptime_s': round(time.time() - self.started_at, 1),
+                'endpoints': {endpoint: dict(status) for endpoint, status in self.counts.items()},
+                'bytes_recebidos': self.bytes_recebidos,
+                'webhooks': dict(self.webhooks),
+            }
+
+
+stats = StubStats()
+
+
+class RateLimiter:
+    """Janela deslizante de 1s: acima de `limite_rps` envios, responde 429"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hits = deque()
+
+    def allow(self) -> bool:
+        limit = STUB_CONFIG['limite_rps']
+        if not limit:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            while self._hits and now - self._hits[0] >= 1.0:
+                self._hits.popleft()
+            if len(self._hits) >= limit:
+                return False
+            self._hits.append(now)
+            return True
+
+
+rate_limiter = RateLimiter()
+
+
+# ====================================
+# WEBHOOK (respostas simuladas)
+# ====================================
+class WebhookEmitter:
+    """Thread única que posta eventos messages.upsert no webhook do app"""
+
+    def __init__(self):
+        self._queue = queue.PriorityQueue()
+        self._session = requests.Session()
+        self._thread = threading.Thread(target=self._run, name="stub-webhook", daemon=True)
+        self._thread.start()
+
+    def emit(self, phone: str, text: str, delay: float = 0.0):
+        self._queue.put((time.monotonic() + delay, uuid.uuid4().hex, phone, text))
+
+    @staticmethod
+    def payload(phone: str, text: str, message_id: str) -> dict:
+        return {
+            "event": "messages.upsert",
+            "instance": STUB_CONFIG['instance_name'],
+            "data": {
+                "key": {
+                    "remoteJid": f"{phone}@s.whatsapp.net",
+                    "fromMe": False,
+                    "id": message_id.upper()[:20]
+                },
+                "pushName": "Stub",
+                "message": {"conversation": text},
+                "messageTimestamp": int(time.time())
+            }
+        }
+
+    def _run(self):
+        while True:
+            due_at, message_id, phone, text = self._queue.get()
+            wait = due_at - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            url = STUB_CONFIG['webhook_url']
+            if not url:
+                continue
+            try:
+                resp = self._session.post(url, json=self.payload(phone, text, message_id),
+                                          headers={'apikey': STUB_CONFIG['api_key']}, timeout=10)
+                stats.record_webhook(resp.status_code < 400)
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"⚠️ Webhook falhou: {e}")
+                stats.record_webhook(False)
+
+
+webhook = WebhookEmitter()
+
+
+# ====================================
+# AUXILIARES
+# ====================================
+def _simulate_latency():
+    delay_ms = STUB_CONFIG['latencia_ms'] + random.uniform(0, STUB_CONFIG['jitter_ms'])
+    if delay_ms > 0:
+        time.sleep(delay_ms / 1000.0)
+
+
+def _digits(value: str) -> str:
+    return ''.join(ch for ch in str(value or '') if ch.isdigit())
+
+
+def _check_auth(endpoint: str):
+    if request.headers.get('apikey') != STUB_CONFIG['api_key']:
+        stats.record(endpoint, 401)
+        return jsonify({"status": 401, "error": "Unauthorized"}), 401
+    return None
+
+
+def _check_instance(endpoint: str, instance: str):
+    if instance != STUB_CONFIG['instance_name']:
+        stats.record(endpoint, 404)
+        return jsonify({"status": 404, "error": "Not Found",
+                        "response": {"message": [f'The "{instance}" instance does not exist']}}), 404
+    return None
+
+
+def _send_common(endpoint: str, instance: str, number: str):
+    """Validações compartilhadas por sendText/sendMedia; retorna resposta de erro ou None"""
+    body_size = request.content_length or 0
+    error = _check_auth(endpoint) or _check_instance(endpoint, instance)
+    if error:
+        return error
+    if not rate_limiter.allow():
+        stats.record(endpoint, 429, body_size)
+        resp = jsonify({"status": 429, "error": "Too Many Requests"})
+        resp.headers['Retry-After'] = str(STUB_CONFIG['retry_after'])
+        return resp, 429
+
+    _simulate_latency()
+
+    if STUB_CONFIG['estado'] != 'open':
+        stats.record(endpoint, 400, body_size)
+        return jsonify({"status": 400, "error": "Bad Request",
+                        "response": {"message": ["Connection Closed"]}}), 400
+    if _digits(number) in STUB_CONFIG['numeros_inexistentes']:
+        stats.record(endpoint, 400, body_size)
+        return jsonify({"status": 400, "error": "Bad Request",
+                        "response": {"message": [{"exists": False, "number": number}]}}), 400
+    if random.random() < STUB_CONFIG['taxa_erro']:
+        stats.record(endpoint, 500, body_size)
+        return jsonify({"status": 500, "error": "Internal Server Error"}), 500
+
+    stats.record(endpoint, 201, body_size)
+    return None
+
+
+def _message_response(number: str, message: dict):
+    message_id = uuid.uuid4().hex.upper()[:20]
+    phone = _digits(number)
+    if STUB_CONFIG['webhook_url'] and random.random() < STUB_CONFIG['taxa_resposta']:
+        webhook.emit(phone, random.choice(STUB_CONFIG['respostas']), STUB_CONFIG['atraso_resposta_s'])
+    return jsonify({
+        "key": {"remoteJid": f"{phone}@s.whatsapp.net", "fromMe": True, "id": message_id},
+        "message": message,
+        "messageTimestamp": str(int(time.time())),
+        "status": "PENDING"
+    }), 201
+
+
+# ====================================
+# ENDPOINTS DA EVOLUTION API
+# ====================================
+@app.post('/message/sendText/<instance>')
+def send_text(instance):
+    data = request.get_json(silent=True) or {}
+    number = data.get('number', '')
+    error = _send_common('sendText', instance, number)
+    if error:
+        return error
+    # Clientes do repo enviam o formato v2 {"textMessage": {"text": ...}}; "text" solto é o v1
+    text = (data.get('textMessage') or {}).get('text') or data.get('text', '')
+    return _message_response(number, {"conversation": text})
+
+
+@app.post('/message/sendMedia/<instance>')
+def send_media(instance):
+    if request.files:
+        data = request.form.to_dict()
+    else:
+        data = request.get_json(silent=True) or {}
+    number = data.get('number', '')
+    error = _send_common('sendMedia', instance, number)
+    if error:
+        return error
+    # JSON (base64/url) vem aninhado em "mediaMessage"; multipart manda os campos soltos
+    media = data.get('mediaMessage') if isinstance(data.get('mediaMessage'), dict) else data
+    return _message_response(number, {"imageMessage": {"caption": media.get('caption', ''),
+                                                       "mimetype": media.get('mimetype', 'image/jpeg')}})
+
+
+@app.get('/instance/fetchInstances')
+def fetch_instances():
+    error = _check_auth('fetchInstances')
+    if error:
+        return error
+    _simulate_latency()
+    stats.record('fetchInstances', 200)
+    return jsonify([{
+        "instance": {
+            "instanceName": STUB_CONFIG['instance_name'],
+            "instanceId": "00000000-0000-0000-0000-000000000000",
+            "owner": "5500000000000@s.whatsapp.net",
+            "profileName": "Evolution Stub",
+            "status": STUB_CONFIG['estado'],
+        },
+        # Formato v2
+        "name": STUB_CONFIG['instance_name'],
+        "instanceName": STUB_CONFIG['instance_name'],
+        "connectionStatus": STUB_CONFIG['estado'],
+        "status": STUB_CONFIG['estado'],
+    }])
+
+
+@app.get('/instance/connectionState/<instance>')
+def connection_state(instance):
+    error = _check_auth('connectionState') or _check_instance('connectionState', instance)
+    if error:
+        return error
+    _simulate_latency()
+    stats.record('connectionState', 200)
+    return jsonify({"instance": {"instanceName": instance, "state": STUB_CONFIG['estado']}})
+
+
+@app.route('/chat/whatsappNumbers/<instance>', methods=['GET', 'POST'])
+def whatsapp_numbers(instance):
+    error = _check_auth('whatsappNumbers') or _check_instance('whatsappNumbers', instance)
+    if error:
+        return error
+    data = request.get_json(silent=True) or {}
+    numbers = data.get('numbers') or request.args.getlist('numbers') or []
+    _simulate_latency()
+    stats.record('whatsappNumbers', 200)
+    return jsonify([{
+        "exists": _digits(number) not in STUB_CONFIG['numeros_inexistentes'],
+        "jid": f"{_digits(number)}@s.whatsapp.net",
+        "number": number
+    } for number in numbers])
+
+
+# ====================================
+# CONTROLE DO STUB
+# ====================================
+@app.get('/stub/stats')
+def stub_stats():
+    return jsonify(stats.snapshot())
+
+
+@app.route('/stub/config', methods=['GET', 'POST'])
+def stub_config():
+    if request.method == 'POST':
+        changes = request.get_json(silent=True) or {}
+        unknown = [key for key in changes if key not in STUB_CONFIG]
+        if unknown:
+            return jsonify({"success": False, "error": f"Chaves desconhecidas: {unknown}"}), 400
+        STUB_CONFIG.update(changes)
+        logger.info(f"⚙️ Configuração alterada: {changes}")
+    return jsonify(STUB_CONFIG)
+
+
+@app.post('/stub/reset')
+def stub_reset():
+    stats.reset()
+    return jsonify({"success": True})
+
+
+@app.post('/stub/webhook')
+def stub_webhook():
+    data = request.get_json(silent=True) or {}
+    if not data.get('phone'):
+        return jsonify({"success": False, "error": "phone é obrigatório"}), 400
+    webhook.emit(_digits(data['phone']), data.get('text') or random.choice(STUB_CONFIG['respostas']),
+                 float(data.get('delay', 0)))
+    return jsonify({"success": True})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evolution API local para testes de carga")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--api-key', default=STUB_CONFIG['api_key'])
+    parser.add_argument('--instancia', default=STUB_CONFIG['instance_name'])
+    parser.add_argument('--estado', default=STUB_CONFIG['estado'], choices=['open', 'connecting', 'close'])
+    parser.add_argument('--latencia-ms', type=float, default=STUB_CONFIG['latencia_ms'])
+    parser.add_argument('--jitter-ms', type=float, default=STUB_CONFIG['jitter_ms'])
+    parser.add_argument('--erro', type=float, default=STUB_CONFIG['taxa_erro'], help="fração de HTTP 500 (0-1)")
+    parser.add_argument('--limite-rps', type=float, default=STUB_CONFIG['limite_rps'], help="envios/s antes do 429")
+    parser.add_argument('--inexistentes', default='', help="números separados por vírgula que não existem")
+    parser.add_argument('--webhook-url', default=STUB_CONFIG['webhook_url'])
+    parser.add_argument('--taxa-resposta', type=float, default=STUB_CONFIG['taxa_resposta'])
+    parser.add_argument('--atraso-resposta', type=float, default=STUB_CONFIG['atraso_resposta_s'])
+    args = parser.parse_args()
+
+    STUB_CONFIG.update({
+        'api_key': args.api_key,
+        'instance_name': args.instancia,
+        'estado': args.estado,
+        'latencia_ms': args.latencia_ms,
+        'jitter_ms': args.jitter_ms,
+        'taxa_erro': args.erro,
+        'limite_rps': args.limite_rps,
+        'numeros_inexistentes': [_digits(n) for n in args.inexistentes.split(',') if _digits(n)],
+        'webhook_url': args.webhook_url,
+        'taxa_resposta': args.taxa_resposta,
+        'atraso_resposta_s': args.atraso_resposta,
+    })
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    logger.info(f"🧪 Evolution stub em http://{args.host}:{args.port} (instância {args.instancia})")
+    logger.info(f"⚙️ {json.dumps(STUB_CONFIG, ensure_ascii=False)}")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,18 +3,29 @@
 # Descrição: Gerencia clientes via Excel (clientes.xlsx) e envio de mensagens programadas (SQLite)
 # Requisitos: Flask, pandas, openpyxl, werkzeug, requests
 
+import io
 import os
-import uuid
+import sys
+import time
 import json
-import sqlite3
+import hashlib
+import mmap
+import base64
 import logging
+import threading
 import requests
+from collections import OrderedDict
 from datetime import datetime
 from typing import Tuple, List, Dict, Optional
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, send_from_directory
 from werkzeug.utils import secure_filename
 
+from evolution_client import get_evolution_client, get_connection_state, CircuitOpenError, TIMEOUTS
+from outbox import get_outbox, OUTBOX_CONFIG
+from database import get_connection
+from migrations import run_migrations, column_exists
+
 # Excel support
 try:
     import pandas as pd
@@ -27,16 +38,183 @@ except Exception:
     Workbook = None
     load_workbook = None
 
+# Normalização de imagens (opcional)
+try:
+    from PIL import Image, ImageOps
+except Exception:
+    Image = None
+    ImageOps = None
+
 # ===================== CONFIGURAÇÕES =====================
 logger = logging.getLogger(__name__)
 UPLOAD_FOLDER = 'uploads/mensagens_programadas'
+# Originais (com EXIF/GPS) ficam fora de UPLOAD_FOLDER, que é servida publicamente em /media
+ORIGINAIS_FOLDER = 'uploads/mensagens_originais'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 DATABASE = 'reunioes.db'
 EXCEL_ARQUIVO = 'clientes.xlsx'
 
+# Envio de imagens de campanha:
+#   'url'       - JSON só com a URL pública da imagem (a Evolution baixa de /api/clientes-msg/media);
+#                 padrão quando MEDIA_URL_PUBLICA está definida: a imagem não sobe uma vez por destinatário
+#   'base64'    - JSON com o base64 calculado uma única vez (padrão sem URL pública)
+#   'multipart' - arquivo em memória (mmap) reaproveitado, mas enviado inteiro a cada destinatário
+MEDIA_CONFIG = {
+    'modo': os.getenv('MEDIA_ENVIO_MODO') or ('url' if os.getenv('MEDIA_URL_PUBLICA') else 'base64'),
+    'url_publica': os.getenv('MEDIA_URL_PUBLICA', ''),
+    'cache_itens': 16
+}
+_aviso_multipart = False
+
+# Vazão própria das campanhas na outbox: reivindicadas depois de confirmações/aniversários,
+# sem ocupar mais que `workers` envios em voo (a vazão global da outbox continua como teto)
+CAMPANHA_CONFIG = {
+    'mensagens_por_segundo': float(os.getenv('CAMPANHA_MSGS_POR_SEGUNDO', '1.0')),
+    'rajada': int(os.getenv('CAMPANHA_RAJADA', '5')),
+    'workers': int(os.getenv('CAMPANHA_WORKERS', '2')),
+}
+
+# Imagens ficam em UPLOAD_FOLDER/<sha256 do upload>.<ext>; órfãs mais novas que isto não são coletadas
+MIDIA_GC_IDADE_MINIMA = int(os.getenv('MIDIA_GC_IDADE_MINIMA', '3600'))
+
+# Normalização no upload: reduz para no máximo `max_dimensao` px, recodifica sem EXIF
+IMAGEM_CONFIG = {
+    'max_dimensao': int(os.getenv('IMAGEM_MAX_DIMENSAO', '1600')),
+    'formato': os.getenv('IMAGEM_FORMATO', 'jpeg').lower(),  # 'jpeg' ou 'webp'
+    'qualidade': int(os.getenv('IMAGEM_QUALIDADE', '82')),
+    'manter_original': os.getenv('IMAGEM_MANTER_ORIGINAL', 'false').lower() == 'true'
+}
+
+MIME_TYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'gif': 'image/gif',
+    'webp': 'image/webp'
+}
+
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 
+# ===================== NORMALIZAÇÃO DE IMAGENS =====================
+def normalizar_imagem(dados: bytes) -> Tuple[bool, str, Optional[bytes], Optional[str]]:
+    """Reduz, recodifica (JPEG/WebP) e remove metadados. Retorna (ok, msg, bytes, extensão)."""
+    if Image is None:
+        return False, "Pillow não instalado", None, None
+    try:
+        max_dim = IMAGEM_CONFIG['max_dimensao']
+        img = Image.open(io.BytesIO(dados))
+        if img.format == 'JPEG':
+            # Decodifica já reduzido (escala 1/2, 1/4, 1/8) quando possível
+            img.draft('RGB', (max_dim, max_dim))
+        # GIF animado: usa só o primeiro quadro
+        img.seek(0)
+        # Aplica a rotação do EXIF antes de descartá-lo
+        img = ImageOps.exif_transpose(img)
+
+        formato = 'WEBP' if IMAGEM_CONFIG['formato'] == 'webp' else 'JPEG'
+        if formato == 'JPEG' and img.mode != 'RGB':
+            if img.mode in ('RGBA', 'LA', 'P'):
+                img = img.convert('RGBA')
+                fundo = Image.new('RGB', img.size, (255, 255, 255))
+                fundo.paste(img, mask=img.getchannel('A'))
+                img = fundo
+            else:
+                img = img.convert('RGB')
+        elif formato == 'WEBP' and img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() or img.mode == 'P' else 'RGB')
+
+        img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+
+        saida = io.BytesIO()
+        if formato == 'JPEG':
+            img.save(saida, 'JPEG', quality=IMAGEM_CONFIG['qualidade'], optimize=True, progressive=True)
+            ext = 'jpg'
+        else:
+            img.save(saida, 'WEBP', quality=IMAGEM_CONFIG['qualidade'], method=6)
+            ext = 'webp'
+        return True, f"{img.size[0]}x{img.size[1]}", saida.getvalue(), ext
+    except Exception as e:
+        logger.warning(f"Não foi possível normalizar imagem: {e}")
+        return False, str(e), None, None
+
+
+# ===================== CACHE DE MÍDIA =====================
+class MediaPayload:
+    """Imagem lida uma vez (mmap) e reaproveitada em todos os envios da campanha."""
+    __slots__ = ('path', 'filename', 'mime_type', 'size', 'signature', '_map', '_b64', '_lock')
+
+    def __init__(self, path: str, signature: Tuple[int, int]):
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.mime_type = MIME_TYPES.get(path.lower().rsplit('.', 1)[-1], 'image/jpeg')
+        self.signature = signature
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self._map)
+        self._b64 = None
+        self._lock = threading.Lock()
+
+    @property
+    def content(self) -> memoryview:
+        """Bytes da imagem sem cópia (aceito pelo multipart do requests)."""
+        return memoryview(self._map)
+
+    @property
+    def base64(self) -> str:
+        if self._b64 is None:
+            with self._lock:
+                if self._b64 is None:
+                    self._b64 = base64.b64encode(self._map).decode('ascii')
+        return self._b64
+
+
+class MediaCache:
+    """LRU de MediaPayload por caminho; invalida se o arquivo mudar (mtime/tamanho)."""
+    def __init__(self, max_items: int = 16):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str) -> MediaPayload:
+        st = os.stat(path)
+        signature = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            item = self._items.get(path)
+            if item is not None and item.signature == signature:
+                self._items.move_to_end(path)
+                self.hits += 1
+                return item
+        item = MediaPayload(path, signature)
+        with self._lock:
+            self.misses += 1
+            self._items[path] = item
+            self._items.move_to_end(path)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+        return item
+
+
+media_cache = MediaCache(MEDIA_CONFIG['cache_itens'])
+
+
+def _modo_envio_midia() -> str:
+    """Modo efetivo de envio de imagem; avisa (uma vez) quando cai para multipart"""
+    global _aviso_multipart
+    modo = MEDIA_CONFIG['modo']
+    if modo == 'url' and not MEDIA_CONFIG['url_publica']:
+        modo = 'multipart'
+        motivo = "MEDIA_ENVIO_MODO=url sem MEDIA_URL_PUBLICA"
+    else:
+        motivo = "MEDIA_ENVIO_MODO=multipart"
+    if modo == 'multipart' and not _aviso_multipart:
+        _aviso_multipart = True
+        logger.warning(f"⚠️ Imagens em multipart ({motivo}): o arquivo inteiro sobe para a Evolution a cada destinatário")
+    return modo
+
+
 # ===================== EVOLUTION API MANAGER =====================
 class EvolutionAPIManager:
     """Gerencia a comunicação com a Evolution API (WhatsApp)."""
@@ -44,7 +222,10 @@ class EvolutionAPIManager:
         self.base_url = base_url.rstrip('/')
         self.api_key = api_key
         self.session = session
-        self.headers = {"apikey": self.api_key, "Content-Type": "application/json"}
+        # Cliente HTTP compartilhado: reaproveita conexões entre destinatários
+        self.client = get_evolution_client(self.base_url, self.api_key)
+        # Estado da conexão em cache, compartilhado com o app principal
+        self.connection = get_connection_state(self.client, self.session)
 
     def normalize_phone_number(self, phone: str) -> str:
         """Formata número para padrão brasileiro com DDI."""
@@ -55,130 +236,31 @@ class EvolutionAPIManager:
         return clean
 
     def check_connection_status(self) -> Tuple[bool, str]:
-        """Verifica se o WhatsApp está conectado."""
-        try:
-            # Tenta endpoint de status da instância específica primeiro
-            url = f"{self.base_url}/instance/connectionState/{self.session}"
-            logger.info(f"Verificando conexão em: {url}")
-            
-            resp = requests.get(url, headers=self.headers, timeout=8)
-            
-            if resp.status_code == 200:
-                data = resp.json()
-                logger.info(f"Resposta connectionState: {data}")
-                
-                # Verifica o estado na resposta
-                state = data.get("state") or data.get("instance", {}).get("state", "unknown")
-                is_connected = state in ["open", "connected"]
-                
-                if is_connected:
-                    return True, state
-            
-            # Se falhar, tenta o endpoint fetchInstances
-            url_fetch = f"{self.base_url}/instance/fetchInstances"
-            logger.info(f"Tentando fetchInstances em: {url_fetch}")
-            
-            resp = requests.get(url_fetch, headers=self.headers, timeout=8)
-            
-            if resp.status_code == 200:
-                data = resp.json()
-                logger.info(f"Resposta fetchInstances: {json.dumps(data, indent=2)}")
-                
-                # Se data for uma lista
-                if isinstance(data, list):
-                    for inst in data:
-                        # Tenta diferentes formatos de resposta da API
-                        instance_name = (
-                            inst.get("instanceName") or 
-                            inst.get("instance", {}).get("instanceName") or
-                            inst.get("name")
-                        )
-                        
-                        logger.info(f"Comparando: '{instance_name}' com '{self.session}'")
-                        
-                        if instance_name == self.session:
-                            # Verifica diferentes formatos de estado
-                            state = (
-                                inst.get("state") or 
-                                inst.get("instance", {}).get("state") or
-                                inst.get("status", "unknown")
-                            )
-                            logger.info(f"Estado encontrado: {state}")
-                            is_connected = state in ["open", "connected", "Open", "Connected"]
-                            return is_connected, state
-                
-                # Se data for um objeto
-                elif isinstance(data, dict):
-                    instance_name = (
-                        data.get("instanceName") or 
-                        data.get("instance", {}).get("instanceName") or
-                        data.get("name")
-                    )
-                    
-                    if instance_name == self.session:
-                        state = (
-                            data.get("state") or 
-                            data.get("instance", {}).get("state") or
-                            data.get("status", "unknown")
-                        )
-                        is_connected = state in ["open", "connected", "Open", "Connected"]
-                        return is_connected, state
-                
-                # Instância não encontrada - lista as disponíveis
-                if isinstance(data, list):
-                    available = [
-                        inst.get("instanceName") or inst.get("name") 
-                        for inst in data
-                    ]
-                    logger.warning(f"Instâncias disponíveis: {available}")
-                    return False, f"Instância '{self.session}' não encontrada. Disponíveis: {', '.join(available)}"
-                
-                return False, f"Instância '{self.session}' não encontrada"
-            
-            return False, f"Erro HTTP {resp.status_code}"
-            
-        except requests.exceptions.Timeout:
-            logger.exception("Timeout ao verificar status")
-            return False, "Timeout na conexão com Evolution API"
-        except requests.exceptions.ConnectionError:
-            logger.exception("Erro de conexão")
-            return False, "Não foi possível conectar com Evolution API"
-        except Exception as e:
-            logger.exception("Erro inesperado ao verificar status")
-            return False, str(e)
+        """Verifica se o WhatsApp está conectado (cache compartilhado, sem chamada remota)."""
+        return self.connection.get()
 
-    def send_message(self, phone: str, message: str, image_path: Optional[str] = None) -> Tuple[bool, str]:
+    def send_message(self, phone: str, message: str, image_path: Optional[str] = None,
+                     stats: Optional[Dict] = None) -> Tuple[bool, str]:
         """
         Envia texto ou imagem via Evolution API - VERSÃO CORRIGIDA COMPLETA
         Suporta envio automático de reuniões E mensagens programadas
+        Se `stats` for passado, recebe 'bytes' com o tamanho do corpo enviado.
         """
         try:
             phone_formatted = self.normalize_phone_number(phone)
             
             if image_path and os.path.exists(image_path):
-                # ========== ENVIO DE IMAGEM (CORRIGIDO) ==========
-                url = f"{self.base_url}/message/sendMedia/{self.session}"
-                logger.info(f"📤 Enviando IMAGEM para {phone_formatted}")
-                logger.info(f"   📄 Arquivo: {image_path} ({os.path.getsize(image_path)} bytes)")
+                # ========== ENVIO DE IMAGEM (arquivo lido uma vez por campanha) ==========
+                media = media_cache.get(image_path)
+                modo = _modo_envio_midia()
+                logger.info(f"📤 Enviando IMAGEM para {phone_formatted} ({media.filename}, {media.size} bytes, modo {modo})")
                 
-                # Detecta MIME type correto
-                ext = image_path.lower().split('.')[-1]
-                mime_types = {
-                    'png': 'image/png',
-                    'jpg': 'image/jpeg',
-                    'jpeg': 'image/jpeg',
-                    'gif': 'image/gif',
-                    'webp': 'image/webp'
-                }
-                mime_type = mime_types.get(ext, 'image/jpeg')
-                
-                # FORMATO CORRETO PARA IMAGEM
-                with open(image_path, 'rb') as img_file:
+                if modo == 'multipart':
                     files = {
                         'mediaMessage': (  # ✅ Nome correto: 'mediaMessage'
-                            os.path.basename(image_path),
-                            img_file,
-                            mime_type
+                            media.filename,
+                            media.content,
+                            media.mime_type
                         )
                     }
                     
@@ -188,13 +270,32 @@ class EvolutionAPIManager:
                         'mediatype': 'image'  # ✅ Campo obrigatório!
                     }
                     
-                    headers = {"apikey": self.api_key}  # SEM Content-Type!
-                    
-                    resp = requests.post(url, headers=headers, data=data, files=files, timeout=30)
+                    # multipart: o requests monta o Content-Type com o boundary
+                    resp = self.client.post(
+                        f"/message/sendMedia/{self.session}",
+                        data=data, files=files, timeout=TIMEOUTS['media']
+                    )
+                else:
+                    if modo == 'url':
+                        media_ref = f"{MEDIA_CONFIG['url_publica'].rstrip('/')}/api/clientes-msg/media/{media.filename}"
+                    else:
+                        media_ref = media.base64
+                    payload = {
+                        "number": phone_formatted,
+                        "mediaMessage": {
+                            "mediatype": "image",
+                            "fileName": media.filename,
+                            "caption": message,
+                            "media": media_ref
+                        }
+                    }
+                    resp = self.client.post(
+                        f"/message/sendMedia/{self.session}",
+                        json=payload, timeout=TIMEOUTS['media']
+                    )
                 
             else:
                 # ========== ENVIO DE TEXTO (FORMATO V2) ==========
-                url = f"{self.base_url}/message/sendText/{self.session}"
                 logger.info(f"📤 Enviando TEXTO para {phone_formatted}")
                 
                 # FORMATO CORRETO PARA TEXTO
@@ -205,17 +306,17 @@ class EvolutionAPIManager:
                     }
                 }
                 
-                headers = {
-                    "apikey": self.api_key,
-                    "Content-Type": "application/json"
-                }
-                
                 logger.info(f"   📦 Payload: {json.dumps(payload)[:100]}...")
                 
-                resp = requests.post(url, json=payload, headers=headers, timeout=10)
+                resp = self.client.post(
+                    f"/message/sendText/{self.session}",
+                    json=payload, timeout=TIMEOUTS['text']
+                )
 
             # ========== PROCESSA RESPOSTA ==========
             logger.info(f"📊 Status: {resp.status_code}")
+            if stats is not None:
+                stats['bytes'] = stats.get('bytes', 0) + len(resp.request.body or b'')
             
             try:
                 response_json = resp.json()
@@ -229,13 +330,20 @@ class EvolutionAPIManager:
             else:
                 error_msg = f"Erro HTTP {resp.status_code}: {resp.text[:200]}"
                 logger.error(error_msg)
+                # Erro real de envio: reavalia o estado da conexão agora
+                self.connection.force_refresh()
                 return False, error_msg
                 
+        except CircuitOpenError as e:
+            logger.warning(f"⛔ {e}")
+            return False, str(e)
         except requests.exceptions.Timeout:
             logger.exception("Timeout ao enviar")
+            self.connection.force_refresh()
             return False, "Timeout ao enviar mensagem"
         except requests.exceptions.ConnectionError:
             logger.exception("Erro de conexão")
+            self.connection.force_refresh()
             return False, "Erro de conexão"
         except FileNotFoundError:
             logger.exception("Arquivo não encontrado")
@@ -311,47 +419,71 @@ def append_cliente_excel(nome: str, empresa: str, whatsapp: str) -> Tuple[bool,
         return False, str(e), None
 
 
+# ===================== MIGRAÇÕES =====================
+def _migracao_tabelas_base(conn):
+    """v1: mensagens programadas e seus logs (idempotente para bancos antigos)."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS mensagens_programadas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            titulo TEXT NOT NULL,
+            texto TEXT NOT NULL,
+            imagem_path TEXT,
+            data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP,
+            data_envio DATETIME,
+            status TEXT DEFAULT 'pendente',
+            total_destinatarios INTEGER DEFAULT 0,
+            total_enviados INTEGER DEFAULT 0,
+            total_erros INTEGER DEFAULT 0
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS logs_mensagens_programadas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            mensagem_id INTEGER NOT NULL,
+            nome_destinatario TEXT,
+            telefone TEXT,
+            status TEXT NOT NULL,
+            erro TEXT,
+            data_envio DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (mensagem_id) REFERENCES mensagens_programadas (id)
+        )
+    ''')
+
+
+def _migracao_bytes_enviados(conn):
+    """v2: bytes enviados por destinatário."""
+    if not column_exists(conn, 'logs_mensagens_programadas', 'bytes_enviados'):
+        conn.execute("ALTER TABLE logs_mensagens_programadas ADD COLUMN bytes_enviados INTEGER DEFAULT 0")
+
+
+MIGRACOES_MENSAGENS = [
+    (1, 'tabelas_base', _migracao_tabelas_base),
+    (2, 'bytes_enviados', _migracao_bytes_enviados),
+]
+
+
 # ===================== CORE =====================
 class MensagemClientes:
     def __init__(self, evolution_manager):
         self.evolution_manager = evolution_manager
         self.init_database()
         ensure_excel()
+        # Envios de campanha passam pela outbox (durável, com retry e vazão limitada)
+        self.outbox = get_outbox(DATABASE)
+        self.outbox.register('campanha', self._enviar_item, self._resultado_item,
+                             rate=CAMPANHA_CONFIG['mensagens_por_segundo'],
+                             burst=CAMPANHA_CONFIG['rajada'],
+                             workers=CAMPANHA_CONFIG['workers'])
+        # Bytes enviados por item da outbox (somando as tentativas) até o resultado final
+        self._bytes_envio = {}
+        self._bytes_lock = threading.Lock()
 
     def _conn(self):
-        return sqlite3.connect(DATABASE)
+        return get_connection(DATABASE)
 
     def init_database(self):
-        """Inicializa as tabelas do banco de dados."""
-        with self._conn() as conn:
-            c = conn.cursor()
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS mensagens_programadas (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    titulo TEXT NOT NULL,
-                    texto TEXT NOT NULL,
-                    imagem_path TEXT,
-                    data_criacao DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    data_envio DATETIME,
-                    status TEXT DEFAULT 'pendente',
-                    total_destinatarios INTEGER DEFAULT 0,
-                    total_enviados INTEGER DEFAULT 0,
-                    total_erros INTEGER DEFAULT 0
-                )
-            ''')
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS logs_mensagens_programadas (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    mensagem_id INTEGER NOT NULL,
-                    nome_destinatario TEXT,
-                    telefone TEXT,
-                    status TEXT NOT NULL,
-                    erro TEXT,
-                    data_envio DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (mensagem_id) REFERENCES mensagens_programadas (id)
-                )
-            ''')
-            conn.commit()
+        """Aplica as migrações pendentes das tabelas de mensagens (uma vez por processo)."""
+        run_migrations(DATABASE, 'mensagens_clientes', MIGRACOES_MENSAGENS)
 
     def salvar_imagem(self, file) -> Tuple[bool, str, Optional[str]]:
         """Salva imagem enviada e retorna o caminho."""
@@ -367,18 +499,122 @@ class MensagemClientes:
         if ext not in ALLOWED_EXTENSIONS:
             return False, f"Extensão não permitida. Use: {', '.join(ALLOWED_EXTENSIONS)}", None
         
-        # Gera nome único
-        unique_filename = f"{uuid.uuid4().hex}_{filename}"
-        filepath = os.path.join(UPLOAD_FOLDER, unique_filename)
-        
         try:
-            file.save(filepath)
-            logger.info(f"Imagem salva: {filepath}")
-            return True, "Imagem salva", filepath
+            dados = file.read()
+            
+            # Armazenamento por conteúdo: o mesmo upload vira sempre o mesmo arquivo
+            sha = hashlib.sha256(dados).hexdigest()
+            existente = self._blob_existente(sha)
+            if existente:
+                # Renova o mtime para o GC não coletar antes da mensagem ser criada
+                os.utime(existente, None)
+                logger.info(f"♻️ Imagem já armazenada: {existente}")
+                return True, "Imagem já armazenada", existente
+            
+            # Normaliza uma vez no upload; todos os destinatários recebem a versão otimizada
+            ok, info, normalizada, nova_ext = normalizar_imagem(dados)
+            if not ok:
+                filepath = os.path.join(UPLOAD_FOLDER, f"{sha}.{ext}")
+                self._gravar_blob(filepath, dados)
+                logger.info(f"Imagem salva sem normalização ({info}): {filepath}")
+                return True, "Imagem salva", filepath
+            
+            if IMAGEM_CONFIG['manter_original']:
+                os.makedirs(ORIGINAIS_FOLDER, exist_ok=True)
+                self._gravar_blob(os.path.join(ORIGINAIS_FOLDER, f"{sha}.{ext}"), dados)
+            
+            filepath = os.path.join(UPLOAD_FOLDER, f"{sha}.{nova_ext}")
+            self._gravar_blob(filepath, normalizada)
+            logger.info(f"Imagem salva: {filepath} ({info}, {len(dados)} → {len(normalizada)} bytes)")
+            return True, f"Imagem salva ({len(dados) // 1024} KB → {len(normalizada) // 1024} KB)", filepath
         except Exception as e:
             logger.exception("Erro ao salvar imagem")
             return False, str(e), None
 
+    @staticmethod
+    def _blob_existente(sha: str) -> Optional[str]:
+        # Só blobs completos: o "<sha>.<ext>.<pid>.tmp" de uma gravação em andamento não conta
+        for ext in sorted(ALLOWED_EXTENSIONS):
+            filepath = os.path.join(UPLOAD_FOLDER, f"{sha}.{ext}")
+            if os.path.isfile(filepath):
+                return filepath
+        return None
+
+    @staticmethod
+    def _gravar_blob(filepath: str, conteudo: bytes):
+        """Grava via arquivo temporário + rename para nunca expor um blob pela metade."""
+        tmp = f"{filepath}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(conteudo)
+        os.replace(tmp, filepath)
+
+    def referencias_midias(self) -> Dict[str, int]:
+        """Contagem de referências por arquivo (mensagens_programadas.imagem_path + outbox pendente)."""
+        with self._conn() as conn:
+            rows = conn.execute('''
+                SELECT imagem_path, COUNT(*) FROM mensagens_programadas
+                WHERE imagem_path IS NOT NULL AND imagem_path != ''
+                GROUP BY imagem_path
+                UNION ALL
+                SELECT media_path, COUNT(*) FROM outbox
+                WHERE media_path IS NOT NULL AND state IN ('pending', 'sending')
+                GROUP BY media_path
+            ''').fetchall()
+        refs = {}
+        for path, total in rows:
+            chave = os.path.basename(path)
+            refs[chave] = refs.get(chave, 0) + total
+        return refs
+
+    def coletar_midias_orfas(self, dry_run: bool = False, idade_minima: int = None) -> Dict:
+        """Remove imagens sem referência (e originais cujo blob foi removido)."""
+        idade_minima = MIDIA_GC_IDADE_MINIMA if idade_minima is None else idade_minima
+        refs = self.referencias_midias()
+        agora = time.time()
+        removidos, bytes_liberados, mantidos = [], 0, 0
+
+        pastas = [UPLOAD_FOLDER, ORIGINAIS_FOLDER]
+        for pasta in pastas:
+            if not os.path.isdir(pasta):
+                continue
+            for entrada in os.scandir(pasta):
+                if not entrada.is_file():
+                    continue
+                nome = entrada.name
+                idade_arquivo = idade_minima
+                if nome.endswith('.tmp'):
+                    # Gravação em andamento (_gravar_blob); só sobra de gravação interrompida é coletada
+                    referenciado = False
+                    idade_arquivo = max(idade_minima, MIDIA_GC_IDADE_MINIMA)
+                elif pasta == UPLOAD_FOLDER:
+                    referenciado = refs.get(nome, 0) > 0
+                else:
+                    # Original fica enquanto existir algum blob referenciado com o mesmo hash
+                    sha = nome.split('.', 1)[0]
+                    referenciado = any(r.startswith(f"{sha}.") and total > 0 for r, total in refs.items())
+                st = entrada.stat()
+                if referenciado or agora - st.st_mtime < idade_arquivo:
+                    mantidos += 1
+                    continue
+                if not dry_run:
+                    try:
+                        os.remove(entrada.path)
+                    except OSError as e:
+                        logger.warning(f"Não foi possível remover {entrada.path}: {e}")
+                        continue
+                removidos.append(entrada.path)
+                bytes_liberados += st.st_size
+
+        acao = "seriam removidos" if dry_run else "removidos"
+        logger.info(f"🧹 GC de mídias: {len(removidos)} arquivos {acao} ({bytes_liberados} bytes), {mantidos} mantidos")
+        return {
+            "dry_run": dry_run,
+            "removidos": removidos,
+            "bytes_liberados": bytes_liberados,
+            "mantidos": mantidos,
+            "referenciados": len(refs)
+        }
+
     def criar_mensagem(self, titulo: str, texto: str, total_destinatarios: int, imagem_path: Optional[str] = None):
         """Cria uma nova mensagem programada."""
         with self._conn() as conn:
@@ -394,73 +630,135 @@ class MensagemClientes:
             return True, "Mensagem criada", msg_id
 
     def enviar_mensagem(self, mensagem_id: int, destinatarios: List[Dict]):
-        """Envia mensagem para lista de destinatários."""
+        """Enfileira a campanha na outbox e retorna imediatamente (id da campanha = id da mensagem)."""
         with self._conn() as conn:
             c = conn.cursor()
             c.execute('SELECT titulo, texto, imagem_path FROM mensagens_programadas WHERE id=?', (mensagem_id,))
             row = c.fetchone()
-            if not row:
-                return False, "Mensagem não encontrada", {}
-            titulo, texto, imagem_path = row
+        if not row:
+            return False, "Mensagem não encontrada", {}
+        titulo, texto, imagem_path = row
 
-            # Verifica conexão
-            connected, status = self.evolution_manager.check_connection_status()
-            if not connected:
-                logger.warning(f"WhatsApp não conectado. Status: {status}")
-                return False, f"WhatsApp não conectado ({status})", {}
+        itens = []
+        for d in destinatarios:
+            nome = d.get("nome", "")
+            # Aceita tanto 'whatsapp' quanto 'whatzap'
+            telefone = self.evolution_manager.normalize_phone_number(
+                d.get("whatsapp") or d.get("whatzap", "")
+            )
+            # Substitui {nome} na mensagem
+            itens.append({
+                "phone": telefone,
+                "message": f"*{titulo}*\n\n{texto.replace('{nome}', nome)}",
+                "ref_id": mensagem_id,
+                "dedupe_key": f"campanha:{mensagem_id}:{telefone}",
+                "media_path": imagem_path,
+                "context": {"nome": nome}
+            })
 
-            stats = {"total": len(destinatarios), "sucesso": 0, "falha": 0, "detalhes": []}
-            
-            for d in destinatarios:
-                nome = d.get("nome", "")
-                # Aceita tanto 'whatsapp' quanto 'whatzap'
-                telefone = self.evolution_manager.normalize_phone_number(
-                    d.get("whatsapp") or d.get("whatzap", "")
-                )
-                
-                # Substitui {nome} na mensagem
-                msg = f"*{titulo}*\n\n{texto.replace('{nome}', nome)}"
-                
-                # Envia mensagem
-                success, result = self.evolution_manager.send_message(telefone, msg, imagem_path)
-                
-                if success:
-                    stats["sucesso"] += 1
-                    status_envio, erro = "success", None
-                    logger.info(f"Mensagem enviada para {nome} ({telefone})")
-                else:
-                    stats["falha"] += 1
-                    status_envio, erro = "error", result
-                    stats["detalhes"].append(f"{nome}: {result}")
-                    logger.error(f"Falha ao enviar para {nome} ({telefone}): {result}")
-
-                # Registra log
-                c.execute('''
-                    INSERT INTO logs_mensagens_programadas
-                        (mensagem_id, nome_destinatario, telefone, status, erro)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (mensagem_id, nome, telefone, status_envio, erro))
-            
+        with self._conn() as conn:
+            conn.execute("UPDATE mensagens_programadas SET status='enviando' WHERE id=?", (mensagem_id,))
             conn.commit()
+        novos = self.outbox.enqueue_many('campanha', itens)
 
-            # Define status final
-            if stats["falha"] == 0:
-                status_final = "enviada"
-            elif stats["sucesso"] > 0:
-                status_final = "enviada_com_erros"
-            else:
-                status_final = "falhou"
+        logger.info(f"Campanha {mensagem_id} enfileirada: {novos} de {len(itens)} destinatários")
+        return True, f"Envio iniciado para {len(itens)} destinatários", self.status_campanha(mensagem_id)
 
-            # Atualiza mensagem
-            c.execute('''
+    def _enviar_item(self, item: Dict) -> Tuple[bool, str]:
+        """Sender da outbox para o tipo 'campanha'."""
+        stats = {}
+        try:
+            return self.evolution_manager.send_message(item["phone"], item["message"], item["media_path"], stats=stats)
+        finally:
+            with self._bytes_lock:
+                self._bytes_envio[item["id"]] = self._bytes_envio.get(item["id"], 0) + stats.get('bytes', 0)
+
+    def _resultado_item(self, item: Dict, success: bool, result: str):
+        """Resultado final de um envio: grava o log e fecha a campanha quando não há pendentes."""
+        mensagem_id = item["ref_id"]
+        nome = item["context"].get("nome", "")
+        with self._bytes_lock:
+            bytes_enviados = self._bytes_envio.pop(item["id"], 0)
+        with self._conn() as conn:
+            conn.execute('''
+                INSERT INTO logs_mensagens_programadas
+                    (mensagem_id, nome_destinatario, telefone, status, erro, bytes_enviados)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (mensagem_id, nome, item["phone"], "success" if success else "error", None if success else result, bytes_enviados))
+            conn.commit()
+
+        counts = self.outbox.counts('campanha', mensagem_id)
+        if counts["pending"] or counts["sending"]:
+            return
+
+        # Define status final
+        if counts["dead"] == 0:
+            status_final = "enviada"
+        elif counts["sent"] > 0:
+            status_final = "enviada_com_erros"
+        else:
+            status_final = "falhou"
+
+        # Atualiza mensagem
+        with self._conn() as conn:
+            conn.execute('''
                 UPDATE mensagens_programadas
                    SET status=?, total_enviados=?, total_erros=?, data_envio=?
                  WHERE id=?
-            ''', (status_final, stats["sucesso"], stats["falha"], datetime.now().isoformat(), mensagem_id))
+            ''', (status_final, counts["sent"], counts["dead"], datetime.now().isoformat(), mensagem_id))
             conn.commit()
 
-            logger.info(f"Envio concluído. Sucesso: {stats['sucesso']}/{stats['total']}")
-            return True, f"Enviadas {stats['sucesso']}/{stats['total']}", stats
+        logger.info(f"Campanha {mensagem_id} concluída. Sucesso: {counts['sent']}/{sum(counts.values())}, "
+                    f"{self._bytes_campanha(mensagem_id)} bytes enviados à Evolution API")
+
+    def _bytes_campanha(self, mensagem_id: int) -> int:
+        with self._conn() as conn:
+            row = conn.execute(
+                'SELECT COALESCE(SUM(bytes_enviados), 0) FROM logs_mensagens_programadas WHERE mensagem_id=?',
+                (mensagem_id,)
+            ).fetchone()
+        return row[0]
+
+    def status_campanha(self, mensagem_id: int) -> Optional[Dict]:
+        """Progresso da campanha (enviados/falhas/restantes/ETA) a partir da outbox."""
+        with self._conn() as conn:
+            row = conn.execute('''
+                SELECT status, total_destinatarios, total_enviados, total_erros
+                FROM mensagens_programadas WHERE id=?
+            ''', (mensagem_id,)).fetchone()
+        if not row:
+            return None
+        status, total_destinatarios, total_enviados, total_erros = row
+
+        counts = self.outbox.counts('campanha', mensagem_id)
+        total = sum(counts.values())
+        if not total:
+            # Campanha anterior à outbox: usa os totais gravados
+            return {
+                "campanha_id": mensagem_id, "status": status, "total": total_destinatarios or 0,
+                "sucesso": total_enviados or 0, "falha": total_erros or 0,
+                "restantes": 0, "eta_segundos": 0, "detalhes": [],
+                "bytes_enviados": self._bytes_campanha(mensagem_id)
+            }
+
+        restantes = counts["pending"] + counts["sending"]
+        # Campanhas saem em ordem: o ETA conta o que ainda está na fila desta e das anteriores
+        fila = self.outbox.backlog('campanha', mensagem_id) if restantes else 0
+        taxa = min(CAMPANHA_CONFIG['mensagens_por_segundo'], OUTBOX_CONFIG['mensagens_por_segundo'])
+        return {
+            "campanha_id": mensagem_id,
+            "status": status,
+            "total": total,
+            "sucesso": counts["sent"],
+            "falha": counts["dead"],
+            "restantes": restantes,
+            "eta_segundos": round(fila / taxa, 1),
+            "bytes_enviados": self._bytes_campanha(mensagem_id),
+            "detalhes": [
+                f"{d['context'].get('nome', d['phone'])}: {d['last_error']}"
+                for d in self.outbox.dead_letters('campanha', mensagem_id)
+            ]
+        }
 
     def listar_mensagens(self):
         """Lista todas as mensagens programadas com formato compatível com frontend."""
@@ -594,11 +892,32 @@ def create_mensagens_clientes_blueprint(evolution_manager):
                 return jsonify(success=False, message=msg), 400
 
             ok2, msg2, stats = svc.enviar_mensagem(mensagem_id, selecionados)
-            return jsonify(success=ok2, message=msg2, stats=stats)
+            return jsonify(success=ok2, message=msg2, campanha_id=mensagem_id, stats=stats), (202 if ok2 else 200)
         except Exception as e:
             logger.exception("Erro ao enviar mensagem")
             return jsonify(success=False, message=str(e)), 500
 
+    @bp.get('/mensagens/<int:mensagem_id>/status')
+    def status_envio(mensagem_id):
+        """Progresso do envio de uma campanha (enviados/falhas/restantes/ETA)."""
+        try:
+            status = svc.status_campanha(mensagem_id)
+            if status is None:
+                return jsonify(success=False, message="Mensagem não encontrada"), 404
+            return jsonify(success=True, stats=status)
+        except Exception as e:
+            logger.exception("Erro ao consultar status do envio")
+            return jsonify(success=False, message=str(e)), 500
+
+    @bp.get('/media/<filename>')
+    def media(filename):
+        """Serve as imagens de campanha para a Evolution API (modo 'url')."""
+        # Só blobs normalizados do nível de UPLOAD_FOLDER: sem subpastas nem .tmp
+        ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+        if '/' in filename or ext not in ALLOWED_EXTENSIONS:
+            return jsonify(success=False, message="Arquivo não encontrado"), 404
+        return send_from_directory(os.path.abspath(UPLOAD_FOLDER), filename)
+
     @bp.get('/historico')
     def historico():
         """Retorna histórico de mensagens enviadas."""
@@ -617,4 +936,16 @@ def create_mensagens_clientes_blueprint(evolution_manager):
             logger.exception("Erro ao listar logs")
             return jsonify(success=False, message=str(e), logs=[]), 500
 
-    return bp
\ No newline at end of file
+    return bp
+
+
+# ===================== LINHA DE COMANDO =====================
+if __name__ == '__main__':
+    # python mensagens_clientes.py gc-midias [--dry-run]
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) > 1 and sys.argv[1] == 'gc-midias':
+        svc = MensagemClientes(evolution_manager=None)
+        resultado = svc.coletar_midias_orfas(dry_run='--dry-run' in sys.argv)
+        print(json.dumps(resultado, indent=2, ensure_ascii=False))
+    else:
+        print("Uso: python mensagens_clientes.py gc-midias [--dry-run]")
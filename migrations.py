@@ -0,0 +1,111 @@
+# migrations.py
+"""
+Migrações de schema versionadas
+
+Cada componente (agenda, aniversários, mensagens, relatórios, outbox) declara uma lista
+ordenada de passos `(versão, nome, função)`. `run_migrations` aplica, uma vez na
+inicialização, só os passos acima da versão gravada em `schema_version`; cada
+passo roda numa transação junto com o registro da nova versão, então uma falha
+no meio não deixa o banco numa versão "meio aplicada".
+
+Os passos recebem a conexão e não devem chamar commit(): o runner controla a
+transação (DDL no SQLite é transacional). Bancos antigos, criados antes deste
+runner, não têm `schema_version`; por isso o passo 1 de cada componente é
+idempotente (CREATE IF NOT EXISTS / coluna só se faltar).
+
+Depois do boot, nenhum caminho de requisição precisa inspecionar o schema.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Tuple
+
+from database import open_connection
+
+logger = logging.getLogger(__name__)
+
+Migration = Tuple[int, str, Callable[[sqlite3.Connection], None]]
+
+# (banco, componente) já migrados neste processo
+_migrated = set()
+_migrated_lock = threading.Lock()
+
+
+def _init_version_table(conn: sqlite3.Connection):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            component TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            name TEXT,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def current_version(conn: sqlite3.Connection, component: str) -> int:
+    row = conn.execute('SELECT version FROM schema_version WHERE component = ?', (component,)).fetchone()
+    return row[0] if row else 0
+
+
+def column_exists(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    """Para passos idempotentes de bancos anteriores ao runner"""
+    return column in [row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def run_migrations(db_path: str, component: str, migrations: List[Migration]) -> int:
+    """Aplica os passos pendentes de `component` em `db_path`; retorna quantos foram aplicados"""
+    key = (os.path.abspath(db_path), component)
+    with _migrated_lock:
+        if key in _migrated:
+            return 0
+
+        steps = sorted(migrations, key=lambda step: step[0])
+        versions = [step[0] for step in steps]
+        if len(set(versions)) != len(versions):
+            raise ValueError(f"Versões de migração duplicadas em {component}: {versions}")
+
+        # Conexão própria em autocommit: o runner abre e fecha cada transação
+        conn = open_connection(db_path, isolation_level=None)
+        applied = 0
+        try:
+            _init_version_table(conn)
+            version = current_version(conn, component)
+            for step_version, name, step in steps:
+                if step_version <= version:
+                    continue
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    step(conn)
+                    conn.execute('''
+                        INSERT INTO schema_version (component, version, name, applied_at)
+                        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                        ON CONFLICT(component) DO UPDATE SET
+                            version = excluded.version, name = excluded.name, applied_at = excluded.applied_at
+                    ''', (component, step_version, name))
+                    conn.execute('COMMIT')
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    logger.error(f"❌ Migração {component} v{step_version} ({name}) falhou em {db_path}")
+                    raise
+                version = step_version
+                applied += 1
+                logger.info(f"✅ Migração {component} v{step_version} aplicada: {name}")
+        finally:
+            conn.close()
+
+        _migrated.add(key)
+        if applied:
+            logger.info(f"📦 Schema {component} em {db_path}: versão {version}")
+        return applied
+
+
+def get_schema_versions(db_path: str) -> Dict[str, int]:
+    """Versão atual de cada componente gravada no banco"""
+    conn = open_connection(db_path)
+    try:
+        _init_version_table(conn)
+        return dict(conn.execute('SELECT component, version FROM schema_version').fetchall())
+    finally:
+        conn.close()
@@ -0,0 +1,515 @@
+# outbox.py
+"""
+Fila de saída durável (outbox) para mensagens WhatsApp
+
+Todo envio (confirmações, aniversários, campanhas, relatórios) é gravado na
+tabela `outbox` antes de sair. Um único dispatcher por processo reivindica as
+linhas vencidas em lote e as entrega num pool limitado (`workers` envios em voo),
+com vazão limitada, reagendando falhas com backoff exponencial + jitter. Os
+horários de vencimento ficam num heap em memória, então o dispatcher dorme até
+o próximo envio devido em vez de criar uma thread adormecida por mensagem.
+Reinício do processo ou queda da Evolution API não perdem mensagens;
+`dedupe_key` impede que o mesmo envio seja enfileirado duas vezes.
+
+Tipos em massa (campanhas) podem ter vazão e concorrência próprias em
+`register(..., rate=, burst=, workers=)`: são reivindicados depois dos tipos
+sem limite próprio, então uma campanha grande não atrasa confirmações. A vazão
+global continua valendo como teto da instância.
+
+Entrega é "pelo menos uma vez": se o processo morrer entre o POST e a
+gravação do resultado, a linha volta para a fila quando o lease expira.
+"""
+
+import heapq
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from database import open_connection
+from migrations import run_migrations
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_CONFIG = {
+    'mensagens_por_segundo': float(os.getenv('OUTBOX_MSGS_POR_SEGUNDO', '1.0')),
+    'rajada': int(os.getenv('OUTBOX_RAJADA', '5')),
+    'workers': int(os.getenv('OUTBOX_WORKERS', '4')),
+    'batch_size': int(os.getenv('OUTBOX_BATCH_SIZE', '20')),
+    'poll_interval': float(os.getenv('OUTBOX_POLL_INTERVAL', '2.0')),
+    'lease_seconds': 120,
+    'max_attempts': int(os.getenv('OUTBOX_MAX_ATTEMPTS', '6')),
+    'backoff_base': 5.0,
+    'backoff_max': 900.0,
+}
+
+# Erros que não adianta repetir
+PERMANENT_ERRORS = (
+    'não existe no whatsapp',
+    '"exists":false',
+    'arquivo não encontrado',
+)
+
+STATES = ('pending', 'sending', 'sent', 'dead')
+
+
+class TokenBucket:
+    """Token bucket thread-safe: `rate` fichas por segundo, até `burst` acumuladas."""
+    def __init__(self, rate: float, burst: int):
+        self.rate = max(rate, 0.001)
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Bloqueia até haver uma ficha disponível."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_time = (1 - self._tokens) / self.rate
+            time.sleep(wait_time)
+
+    def available(self) -> int:
+        """Fichas inteiras disponíveis agora (sem consumir)"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            return int(self._tokens)
+
+    def take(self, n: int):
+        """Consome `n` fichas já verificadas com `available` (um único consumidor)"""
+        with self._lock:
+            self._tokens -= n
+
+    def next_in(self) -> float:
+        """Segundos até haver uma ficha inteira"""
+        with self._lock:
+            return max(1 - self._tokens, 0) / self.rate
+
+
+def backoff_delay(attempts: int) -> float:
+    """Backoff exponencial com jitter: metade fixa + metade aleatória."""
+    delay = min(OUTBOX_CONFIG['backoff_max'], OUTBOX_CONFIG['backoff_base'] * (2 ** max(attempts - 1, 0)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def is_permanent_error(error: str) -> bool:
+    error = (error or '').lower()
+    return any(marker in error for marker in PERMANENT_ERRORS)
+
+
+def _migracao_outbox_tabela(conn):
+    """v1: tabela outbox e índices de vencimento/referência"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            ref_id INTEGER,
+            dedupe_key TEXT UNIQUE,
+            phone TEXT NOT NULL,
+            message TEXT NOT NULL,
+            media_path TEXT,
+            context TEXT,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            next_attempt_at REAL NOT NULL,
+            lease_until REAL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            sent_at REAL
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(state, next_attempt_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_ref ON outbox(kind, ref_id, state)')
+
+
+MIGRACOES_OUTBOX = [
+    (1, 'tabela_outbox', _migracao_outbox_tabela),
+]
+
+
+class Outbox:
+    """Tabela outbox + dispatcher em background"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._handlers: Dict[str, Tuple[Callable, Optional[Callable]]] = {}
+        self._handlers_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = None
+        self._rate_limiter = TokenBucket(OUTBOX_CONFIG['mensagens_por_segundo'], OUTBOX_CONFIG['rajada'])
+        # Limites próprios por tipo: {kind: (TokenBucket, workers)}
+        self._limits: Dict[str, Tuple[TokenBucket, int]] = {}
+        self._kind_in_flight: Dict[str, int] = {}
+        # Heap de horários de vencimento conhecidos neste processo
+        self._due = []
+        self._due_lock = threading.Lock()
+        # Envios em voo no pool (limitado a OUTBOX_CONFIG['workers'])
+        self._in_flight = 0
+        self._slots = threading.Condition()
+        self._local = threading.local()
+        self.stats = {'claimed': 0, 'sent': 0, 'retried': 0, 'dead': 0, 'last_error': None}
+        self.init_table()
+
+    def _conn(self):
+        """Conexão reaproveitada por thread (dispatcher, workers e produtores)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = open_connection(self.db_path, timeout=15)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _schedule(self, due_at: float):
+        """Registra um vencimento e acorda o dispatcher se ele vier antes do atual"""
+        with self._due_lock:
+            wake = not self._due or due_at < self._due[0]
+            heapq.heappush(self._due, due_at)
+        if wake:
+            self._wake.set()
+
+    def _next_wait(self) -> float:
+        """Segundos até o próximo vencimento (limitado ao poll_interval, por causa de outros processos)"""
+        now = time.time()
+        with self._due_lock:
+            while self._due and self._due[0] <= now:
+                heapq.heappop(self._due)
+            if self._due:
+                return min(self._due[0] - now, OUTBOX_CONFIG['poll_interval'])
+        return OUTBOX_CONFIG['poll_interval']
+
+    def init_table(self):
+        """Aplica as migrações pendentes da outbox no banco"""
+        run_migrations(self.db_path, 'outbox', MIGRACOES_OUTBOX)
+
+    # ---------- Produtores ----------
+    def register(self, kind: str, sender: Callable[[Dict], Tuple[bool, str]],
+                 on_result: Optional[Callable[[Dict, bool, str], None]] = None,
+                 rate: Optional[float] = None, burst: Optional[int] = None, workers: Optional[int] = None):
+        """Registra o envio de um tipo; o dispatcher só reivindica tipos registrados.
+
+        Com `rate`/`workers` o tipo tem vazão e envios em voo próprios (além dos globais)
+        e é reivindicado depois dos tipos sem limite.
+        """
+        with self._handlers_lock:
+            self._handlers[kind] = (sender, on_result)
+            if rate or workers:
+                bucket = TokenBucket(rate or OUTBOX_CONFIG['mensagens_por_segundo'], burst or OUTBOX_CONFIG['rajada'])
+                self._limits[kind] = (bucket, max(1, workers or OUTBOX_CONFIG['workers']))
+            else:
+                self._limits.pop(kind, None)
+
+    def _row(self, kind: str, phone: str, message: str, ref_id: Optional[int] = None,
+             dedupe_key: Optional[str] = None, media_path: Optional[str] = None,
+             context: Optional[Dict] = None, delay_seconds: float = 0, now: float = None) -> Tuple:
+        now = now or time.time()
+        return (kind, ref_id, dedupe_key, phone, message, media_path,
+                json.dumps(context, ensure_ascii=False) if context else None,
+                OUTBOX_CONFIG['max_attempts'], now + delay_seconds, now, now)
+
+    _INSERT = '''
+        INSERT INTO outbox (kind, ref_id, dedupe_key, phone, message, media_path, context,
+                            max_attempts, next_attempt_at, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(dedupe_key) DO NOTHING
+    '''
+
+    def enqueue(self, kind: str, phone: str, message: str, **kwargs) -> Optional[int]:
+        """Enfileira um envio. Retorna o id, ou None se `dedupe_key` já existia"""
+        row = self._row(kind, phone, message, **kwargs)
+        with self._conn() as conn:
+            cursor = conn.execute(self._INSERT, row)
+            outbox_id = cursor.lastrowid if cursor.rowcount else None
+        if outbox_id:
+            logger.info(f"📥 Outbox: {kind} para {phone} enfileirado (id {outbox_id})")
+            self._schedule(row[8])
+        return outbox_id
+
+    def enqueue_many(self, kind: str, items: Iterable[Dict]) -> int:
+        """Enfileira vários envios numa transação; retorna quantos eram novos"""
+        now = time.time()
+        rows = [self._row(kind, now=now, **item) for item in items]
+        with self._conn() as conn:
+            before = conn.total_changes
+            conn.executemany(self._INSERT, rows)
+            inserted = conn.total_changes - before
+        logger.info(f"📥 Outbox: {inserted}/{len(rows)} envios {kind} enfileirados")
+        if rows:
+            self._schedule(min(row[8] for row in rows))
+        return inserted
+
+    # ---------- Dispatcher ----------
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._executor = ThreadPoolExecutor(max_workers=OUTBOX_CONFIG['workers'], thread_name_prefix="outbox")
+        self._thread = threading.Thread(target=self._run, name="outbox-dispatcher", daemon=True)
+        self._thread.start()
+        logger.info(f"📤 Dispatcher da outbox iniciado ({self.db_path})")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            # Só reivindica o que cabe no pool; o resto continua na tabela
+            with self._slots:
+                while self._in_flight >= OUTBOX_CONFIG['workers'] and not self._stop.is_set():
+                    self._slots.wait(1.0)
+                free = OUTBOX_CONFIG['workers'] - self._in_flight
+
+            try:
+                claimed = self.claim_due(min(OUTBOX_CONFIG['batch_size'], free))
+            except sqlite3.Error as e:
+                logger.error(f"❌ Outbox: erro ao reivindicar lote: {e}")
+                claimed = []
+
+            if not claimed:
+                self._wake.wait(self._next_wait())
+                self._wake.clear()
+                continue
+
+            for item in claimed:
+                self._rate_limiter.acquire()
+                self._executor.submit(self._deliver_slot, item)
+
+    def _deliver_slot(self, item: Dict):
+        try:
+            self._deliver(item)
+        finally:
+            with self._slots:
+                self._in_flight -= 1
+                self._kind_in_flight[item['kind']] -= 1
+                self._slots.notify()
+            if item['kind'] in self._limits:
+                # Vaga do tipo liberada: pode haver itens dele esperando
+                self._wake.set()
+
+    def _claimable(self, limit: int) -> List[Tuple[List[str], int]]:
+        """Grupos (tipos, limite) a reivindicar, na ordem: tipos sem limite próprio, depois os limitados"""
+        with self._handlers_lock:
+            kinds = list(self._handlers)
+            limits = dict(self._limits)
+        groups = [([kind for kind in kinds if kind not in limits], limit)]
+        with self._slots:
+            in_flight = dict(self._kind_in_flight)
+        for kind, (bucket, workers) in limits.items():
+            tokens = bucket.available()
+            if not tokens:
+                self._schedule(time.time() + bucket.next_in())
+            groups.append(([kind], min(tokens, workers - in_flight.get(kind, 0))))
+        return [(kinds, n) for kinds, n in groups if kinds and n > 0]
+
+    def claim_due(self, limit: int) -> List[Dict]:
+        """Reivindica atomicamente até `limit` linhas vencidas (ou com lease expirado)"""
+        groups = self._claimable(limit)
+        if not groups:
+            return []
+
+        now = time.time()
+        rows = []
+        conn = self._conn()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for kinds, kind_limit in groups:
+                kind_limit = min(kind_limit, limit - len(rows))
+                if kind_limit <= 0:
+                    break
+                placeholders = ','.join('?' * len(kinds))
+                rows += conn.execute(f'''
+                    SELECT * FROM outbox
+                    WHERE kind IN ({placeholders})
+                      AND ((state = 'pending' AND next_attempt_at <= ?)
+                           OR (state = 'sending' AND lease_until < ?))
+                    ORDER BY next_attempt_at
+                    LIMIT ?
+                ''', (*kinds, now, now, kind_limit)).fetchall()
+            if rows:
+                conn.executemany('''
+                    UPDATE outbox
+                       SET state = 'sending', attempts = attempts + 1, lease_until = ?, updated_at = ?
+                     WHERE id = ?
+                ''', [(now + OUTBOX_CONFIG['lease_seconds'], now, row['id']) for row in rows])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        items = []
+        for row in rows:
+            item = dict(row)
+            item['attempts'] += 1
+            item['context'] = json.loads(item['context']) if item['context'] else {}
+            items.append(item)
+        with self._slots:
+            self._in_flight += len(items)
+            for item in items:
+                self._kind_in_flight[item['kind']] = self._kind_in_flight.get(item['kind'], 0) + 1
+        for kind, (bucket, _) in self._limits.items():
+            bucket.take(sum(1 for item in items if item['kind'] == kind))
+        self.stats['claimed'] += len(items)
+        return items
+
+    def _deliver(self, item: Dict):
+        sender, on_result = self._handlers[item['kind']]
+        try:
+            success, result = sender(item)
+        except Exception as e:
+            success, result = False, f"Erro interno no envio: {e}"
+
+        now = time.time()
+        final = True
+        with self._conn() as conn:
+            if success:
+                conn.execute('''
+                    UPDATE outbox SET state = 'sent', sent_at = ?, updated_at = ?, lease_until = NULL, last_error = NULL
+                    WHERE id = ?
+                ''', (now, now, item['id']))
+                self.stats['sent'] += 1
+            elif is_permanent_error(result) or item['attempts'] >= item['max_attempts']:
+                conn.execute('''
+                    UPDATE outbox SET state = 'dead', updated_at = ?, lease_until = NULL, last_error = ?
+                    WHERE id = ?
+                ''', (now, result, item['id']))
+                self.stats['dead'] += 1
+                logger.error(f"☠️ Outbox {item['id']} ({item['kind']}) desistiu após {item['attempts']} tentativas: {result}")
+            else:
+                delay = backoff_delay(item['attempts'])
+                conn.execute('''
+                    UPDATE outbox SET state = 'pending', next_attempt_at = ?, updated_at = ?, lease_until = NULL, last_error = ?
+                    WHERE id = ?
+                ''', (now + delay, now, result, item['id']))
+                self.stats['retried'] += 1
+                final = False
+                self._schedule(now + delay)
+                logger.warning(f"🔄 Outbox {item['id']} ({item['kind']}) tentativa {item['attempts']} falhou: {result}. Nova tentativa em {delay:.0f}s")
+
+        if not success:
+            self.stats['last_error'] = result
+        if final and on_result:
+            try:
+                on_result(item, success, result)
+            except Exception as e:
+                logger.error(f"❌ Outbox: erro no callback de {item['kind']} {item['id']}: {e}")
+
+    # ---------- Consulta / administração ----------
+    def counts(self, kind: str, ref_id: int) -> Dict[str, int]:
+        """Contagem por estado dos envios de uma referência (ex.: campanha)"""
+        with self._conn() as conn:
+            rows = conn.execute('''
+                SELECT state, COUNT(*) FROM outbox WHERE kind = ? AND ref_id = ? GROUP BY state
+            ''', (kind, ref_id)).fetchall()
+        counts = {state: 0 for state in STATES}
+        counts.update({state: total for state, total in rows})
+        return counts
+
+    def backlog(self, kind: str, up_to_ref_id: Optional[int] = None) -> int:
+        """Envios ainda na fila de um tipo (opcionalmente só das referências até `up_to_ref_id`)"""
+        with self._conn() as conn:
+            return conn.execute('''
+                SELECT COUNT(*) FROM outbox
+                WHERE kind = ? AND state IN ('pending', 'sending') AND (? IS NULL OR ref_id <= ?)
+            ''', (kind, up_to_ref_id, up_to_ref_id)).fetchone()[0]
+
+    def states(self, outbox_ids: Iterable[int]) -> Dict[int, Tuple[str, Optional[str]]]:
+        """Estado e último erro de envios específicos: {id: (state, last_error)}"""
+        outbox_ids = list(outbox_ids)
+        if not outbox_ids:
+            return {}
+        placeholders = ','.join('?' * len(outbox_ids))
+        with self._conn() as conn:
+            rows = conn.execute(f'''
+                SELECT id, state, last_error FROM outbox WHERE id IN ({placeholders})
+            ''', outbox_ids).fetchall()
+        return {row['id']: (row['state'], row['last_error']) for row in rows}
+
+    def dead_letters(self, kind: str = None, ref_id: int = None, limit: int = 20) -> List[Dict]:
+        query = 'SELECT id, kind, ref_id, phone, context, attempts, last_error, updated_at FROM outbox WHERE state = \'dead\''
+        params: List[Any] = []
+        if kind:
+            query += ' AND kind = ?'
+            params.append(kind)
+        if ref_id is not None:
+            query += ' AND ref_id = ?'
+            params.append(ref_id)
+        query += ' ORDER BY updated_at DESC LIMIT ?'
+        params.append(limit)
+        with self._conn() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [dict(row, context=json.loads(row['context']) if row['context'] else {}) for row in rows]
+
+    def requeue(self, outbox_id: int) -> bool:
+        """Devolve uma mensagem 'dead' para a fila com tentativas zeradas"""
+        now = time.time()
+        with self._conn() as conn:
+            cursor = conn.execute('''
+                UPDATE outbox SET state = 'pending', attempts = 0, next_attempt_at = ?, updated_at = ?
+                WHERE id = ? AND state = 'dead'
+            ''', (now, now, outbox_id))
+        if cursor.rowcount:
+            self._schedule(now)
+        return bool(cursor.rowcount)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._conn() as conn:
+            rows = conn.execute('SELECT kind, state, COUNT(*) FROM outbox GROUP BY kind, state').fetchall()
+            next_due, due_now = conn.execute('''
+                SELECT MIN(next_attempt_at), SUM(next_attempt_at <= ?) FROM outbox WHERE state = 'pending'
+            ''', (time.time(),)).fetchone()
+        by_kind: Dict[str, Dict[str, int]] = {}
+        for kind, state, total in rows:
+            by_kind.setdefault(kind, {s: 0 for s in STATES})[state] = total
+        with self._handlers_lock:
+            kinds = sorted(self._handlers)
+            limits = dict(self._limits)
+        return {
+            'db_path': self.db_path,
+            'running': bool(self._thread and self._thread.is_alive()),
+            'registered_kinds': kinds,
+            'by_kind': by_kind,
+            'queue_depth': sum(counts['pending'] for counts in by_kind.values()),
+            'due_now': due_now or 0,
+            'next_due_in_s': round(max(next_due - time.time(), 0), 1) if next_due else None,
+            'in_flight': self._in_flight,
+            'max_concurrency': OUTBOX_CONFIG['workers'],
+            'kind_limits': {
+                kind: {'mensagens_por_segundo': bucket.rate, 'rajada': bucket.burst,
+                       'workers': workers, 'in_flight': self._kind_in_flight.get(kind, 0)}
+                for kind, (bucket, workers) in limits.items()
+            },
+            'scheduled_wakeups': len(self._due),
+            'dispatcher': dict(self.stats),
+            'config': dict(OUTBOX_CONFIG)
+        }
+
+
+_outboxes = {}
+_outboxes_lock = threading.Lock()
+
+
+def get_outbox(db_path: str) -> Outbox:
+    """Retorna a outbox compartilhada do banco, criando se necessário"""
+    key = os.path.abspath(db_path)
+    with _outboxes_lock:
+        outbox = _outboxes.get(key)
+        if outbox is None:
+            outbox = _outboxes[key] = Outbox(db_path)
+        return outbox
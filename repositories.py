@@ -0,0 +1,316 @@
+# repositories.py
+"""
+Repositórios tipados: reuniões, respostas, logs, eventos e aniversários
+
+Cada leitura usa uma lista explícita de colunas e devolve NamedTuples
+(`Meeting`, `Event`, ...), então o código acessa `m.telefone_cliente` em vez de
+`meeting[7] if len(meeting) > 7`. A ordem dos campos segue a ordem das colunas
+nas tabelas, o que mantém compatível quem ainda indexa por posição (templates).
+
+O SQL de cada consulta é montado uma única vez, na importação: com o texto
+sempre idêntico, o cache de statements do sqlite3 (por conexão, e as conexões
+são reaproveitadas por thread em `database.py`) evita recompilar a consulta.
+
+Listagens grandes têm um caminho em lote, `to_json`: o próprio SQLite monta o
+array JSON (json_group_array/json_object) e a rota devolve a string pronta,
+sem criar um dict por linha em Python. Se o SQLite não tiver JSON1, cai para
+o mapeamento em Python com as mesmas expressões.
+"""
+
+import json
+import logging
+import sqlite3
+from typing import Any, List, NamedTuple, Optional, Sequence, Tuple
+
+from database import get_connection
+
+logger = logging.getLogger(__name__)
+
+
+# ==================== REGISTROS ====================
+class Meeting(NamedTuple):
+    id: int
+    titulo: str
+    convidado: str
+    data_hora: str
+    assunto: str
+    link: Optional[str]
+    nome_cliente: Optional[str]
+    telefone_cliente: Optional[str]
+    local_reuniao: Optional[str]
+    status_confirmacao: Optional[str]
+    numero_pessoas: Optional[int]
+    created_at: Optional[str]
+    data_hora_ts: Optional[int]
+
+
+class ClientResponse(NamedTuple):
+    id: int
+    meeting_id: int
+    response_text: Optional[str]
+    status: Optional[str]
+    confidence: Optional[float]
+    analysis_data: Optional[str]
+    received_at: Optional[str]
+    processed_at: Optional[str]
+    message_id: Optional[str]
+
+
+class WhatsAppLog(NamedTuple):
+    """Log de envio com título/convidado da reunião (LEFT JOIN)"""
+    id: int
+    meeting_id: Optional[int]
+    phone: Optional[str]
+    message: Optional[str]
+    status: Optional[str]
+    sent_at: Optional[str]
+    error_message: Optional[str]
+    meeting_title: Optional[str]
+    meeting_guest: Optional[str]
+
+
+class Event(NamedTuple):
+    id: int
+    titulo: str
+    tipo: str
+    data_inicio: str
+    data_fim: str
+    local: Optional[str]
+    descricao: Optional[str]
+    participantes: Optional[str]
+    cor: Optional[str]
+    created_at: Optional[str]
+    updated_at: Optional[str]
+
+
+class BirthdayPerson(NamedTuple):
+    id: int
+    nome: str
+    empresa: Optional[str]
+    nascimento: str
+    whatsapp: str
+    ativo: int
+    data_cadastro: Optional[str]
+
+
+class BirthdayLog(NamedTuple):
+    id: int
+    aniversariante_id: Optional[int]
+    nome_aniversariante: Optional[str]
+    empresa_aniversariante: Optional[str]
+    whatsapp: Optional[str]
+    data_envio: Optional[str]
+    status: Optional[str]
+    erro: Optional[str]
+
+
+# ==================== JSON EM LOTE ====================
+# Uma "view" é a forma JSON de uma listagem: ((chave, expressão SQL), ...)
+JsonView = Tuple[Tuple[str, str], ...]
+
+_json1_available: Optional[bool] = None
+
+
+def _has_json1(conn) -> bool:
+    global _json1_available
+    if _json1_available is None:
+        try:
+            conn.execute("SELECT json_object('a', 1)").fetchone()
+            _json1_available = True
+        except sqlite3.OperationalError:
+            logger.warning("⚠️ SQLite sem JSON1: listagens serializadas em Python")
+            _json1_available = False
+    return _json1_available
+
+
+class JsonQuery:
+    """Consulta de listagem pré-montada nas duas formas (JSON no SQLite e linhas para Python)"""
+
+    __slots__ = ('keys', 'json_sql', 'rows_sql')
+
+    def __init__(self, view: JsonView, source: str):
+        self.keys = tuple(key for key, _ in view)
+        pairs = ', '.join(f"'{key}', {expr}" for key, expr in view)
+        columns = ', '.join(f"{expr} AS \"{key}\"" for key, expr in view)
+        # A subconsulta fixa a ordem antes da agregação
+        self.rows_sql = f"SELECT {columns} {source}"
+        self.json_sql = f"SELECT COALESCE(json_group_array(json_object({pairs})), '[]') FROM (SELECT * {source})"
+
+    def to_json(self, conn, params: Sequence[Any] = ()) -> str:
+        if _has_json1(conn):
+            return conn.execute(self.json_sql, params).fetchone()[0]
+        rows = conn.execute(self.rows_sql, params).fetchall()
+        return json.dumps([dict(zip(self.keys, row)) for row in rows], ensure_ascii=False)
+
+
+def _columns(record: type) -> str:
+    return ', '.join(record._fields)
+
+
+def _mapper(record: type):
+    make = record._make
+    return lambda cursor, row: make(row)
+
+
+class _Repository:
+    """Base: conexão da thread + row_factory do registro"""
+
+    record: type = None
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._row_factory = _mapper(self.record)
+
+    def _conn(self):
+        conn = get_connection(self.db_path)
+        conn.row_factory = self._row_factory
+        return conn
+
+    def _one(self, sql: str, params: Sequence[Any] = ()):
+        return self._conn().execute(sql, params).fetchone()
+
+    def _all(self, sql: str, params: Sequence[Any] = ()) -> list:
+        return self._conn().execute(sql, params).fetchall()
+
+
+# ==================== REUNIÕES ====================
+class MeetingRepository(_Repository):
+    record = Meeting
+
+    _SELECT = f"SELECT {_columns(Meeting)} FROM reunioes"
+    _GET = f"{_SELECT} WHERE id = ?"
+    _ALL = f"{_SELECT} ORDER BY data_hora"
+    _BETWEEN = f"{_SELECT} WHERE data_hora_ts BETWEEN ? AND ? ORDER BY data_hora_ts"
+
+    # /agenda/dados
+    AGENDA_JSON = JsonQuery((
+        ('id', 'id'),
+        ('title', 'titulo'),
+        ('convidado', 'convidado'),
+        ('datetime', 'data_hora'),
+        ('assunto', 'assunto'),
+        ('link', "COALESCE(link, '')"),
+        ('client', "COALESCE(nome_cliente, '')"),
+        ('phone', "COALESCE(telefone_cliente, '')"),
+        ('local', "COALESCE(local_reuniao, '')"),
+        ('status_confirmacao', 'status_confirmacao'),
+        ('numero_pessoas', 'numero_pessoas'),
+    ), "FROM reunioes ORDER BY data_hora")
+
+    # /api/reunioes (calendário)
+    CALENDAR_JSON = JsonQuery((
+        ('id', 'id'),
+        ('tipo_item', "'reuniao'"),
+        ('titulo', 'titulo'),
+        ('convidado', 'convidado'),
+        ('data_hora', 'data_hora'),
+        ('assunto', "COALESCE(assunto, '')"),
+        ('nome_cliente', "COALESCE(nome_cliente, '')"),
+        ('telefone_cliente', "COALESCE(telefone_cliente, '')"),
+        ('local_reuniao', "COALESCE(local_reuniao, '')"),
+        ('link', "COALESCE(link, '')"),
+        ('confirmation_status', "COALESCE(NULLIF(status_confirmacao, ''), 'pending')"),
+        ('numero_pessoas', 'numero_pessoas'),
+    ), "FROM reunioes ORDER BY data_hora ASC")
+
+    def get(self, meeting_id: int) -> Optional[Meeting]:
+        return self._one(self._GET, (meeting_id,))
+
+    def list_all(self) -> List[Meeting]:
+        return self._all(self._ALL)
+
+    def between(self, start_ts: int, end_ts: int) -> List[Meeting]:
+        """Reuniões com data_hora_ts no intervalo (epoch, inclusivo)"""
+        return self._all(self._BETWEEN, (start_ts, end_ts))
+
+    def to_json(self, query: JsonQuery, params: Sequence[Any] = ()) -> str:
+        return query.to_json(get_connection(self.db_path), params)
+
+
+# ==================== RESPOSTAS / LOGS ====================
+class ResponseRepository(_Repository):
+    record = ClientResponse
+
+    _SELECT = f"SELECT {_columns(ClientResponse)} FROM client_responses"
+    _FOR_MEETING = f"{_SELECT} WHERE meeting_id = ? ORDER BY received_at_ts DESC"
+
+    def for_meeting(self, meeting_id: int) -> List[ClientResponse]:
+        return self._all(self._FOR_MEETING, (meeting_id,))
+
+
+class WhatsAppLogRepository(_Repository):
+    record = WhatsAppLog
+
+    _RECENT = """
+        SELECT wl.id, wl.meeting_id, wl.phone, wl.message, wl.status, wl.sent_at, wl.error_message,
+               r.titulo, r.convidado
+        FROM whatsapp_logs wl
+        LEFT JOIN reunioes r ON wl.meeting_id = r.id
+        ORDER BY wl.sent_at_ts DESC
+        LIMIT ?
+    """
+
+    def recent(self, limit: int = 100) -> List[WhatsAppLog]:
+        return self._all(self._RECENT, (limit,))
+
+
+# ==================== EVENTOS ====================
+class EventRepository(_Repository):
+    record = Event
+
+    _SELECT = f"SELECT {_columns(Event)} FROM eventos"
+    _GET = f"{_SELECT} WHERE id = ?"
+
+    CALENDAR_JSON = JsonQuery((
+        ('id', 'id'),
+        ('tipo_item', "'evento'"),
+        ('titulo', 'titulo'),
+        ('tipo', 'tipo'),
+        ('data_inicio', 'data_inicio'),
+        ('data_fim', 'data_fim'),
+        ('local', "COALESCE(local, '')"),
+        ('descricao', "COALESCE(descricao, '')"),
+        ('participantes', "COALESCE(participantes, '')"),
+        ('cor', "COALESCE(NULLIF(cor, ''), 'amarelo')"),
+    ), "FROM eventos ORDER BY data_inicio ASC")
+
+    def get(self, evento_id: int) -> Optional[Event]:
+        return self._one(self._GET, (evento_id,))
+
+    def to_json(self, query: JsonQuery, params: Sequence[Any] = ()) -> str:
+        return query.to_json(get_connection(self.db_path), params)
+
+
+# ==================== ANIVERSÁRIOS ====================
+class BirthdayRepository(_Repository):
+    record = BirthdayPerson
+
+    _SELECT = f"SELECT {_columns(BirthdayPerson)} FROM aniversariantes"
+    _GET = f"{_SELECT} WHERE id = ?"
+    _DUE = f'''
+        {_SELECT} a
+        WHERE a.ativo = 1 AND strftime('%m-%d', a.nascimento) = ?
+        AND NOT EXISTS (
+            SELECT 1 FROM logs_aniversarios l
+            WHERE l.aniversariante_id = a.id
+            AND l.data_envio_ts >= ? AND l.data_envio_ts < ?
+            AND l.status = 'success'
+        )
+    '''
+    _LOGS = f"SELECT {_columns(BirthdayLog)} FROM logs_aniversarios ORDER BY data_envio_ts DESC LIMIT ?"
+
+    def __init__(self, db_path: str):
+        super().__init__(db_path)
+        self._log_row_factory = _mapper(BirthdayLog)
+
+    def get(self, person_id: int) -> Optional[BirthdayPerson]:
+        return self._one(self._GET, (person_id,))
+
+    def due(self, month_day: str, day_start_ts: int, day_end_ts: int) -> List[BirthdayPerson]:
+        """Aniversariantes ativos de `month_day` ('MM-DD') ainda sem envio com sucesso no dia"""
+        return self._all(self._DUE, (month_day, day_start_ts, day_end_ts))
+
+    def recent_logs(self, limit: int = 100) -> List[BirthdayLog]:
+        conn = get_connection(self.db_path)
+        conn.row_factory = self._log_row_factory
+        return conn.execute(self._LOGS, (limit,)).fetchall()
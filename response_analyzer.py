@@ -0,0 +1,411 @@
+# response_analyzer.py
+"""
+Classificação das respostas dos clientes (confirmado / recusado / reagendar)
+e job de reclassificação do histórico de client_responses
+"""
+
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from database import open_connection
+
+logger = logging.getLogger(__name__)
+
+# Tamanho do cache LRU de classificações (chave: texto normalizado)
+ANALYZER_CACHE_SIZE = int(os.getenv('ANALYZER_CACHE_SIZE', '4096'))
+
+
+class KeywordAutomaton:
+    """Automato Aho-Corasick: encontra todas as palavras-chave em uma única passada
+    
+    Equivale a testar `palavra in texto` para cada palavra-chave (inclusive
+    ocorrências sobrepostas), mas percorre o texto uma vez só.
+    """
+    
+    def __init__(self, keywords: List[str]):
+        self.keywords = list(dict.fromkeys(keywords))
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        
+        for index, keyword in enumerate(self.keywords):
+            state = 0
+            for char in keyword:
+                if char not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                    self._goto[state][char] = len(self._goto) - 1
+                state = self._goto[state][char]
+            self._output[state] += (index,)
+        
+        # Links de falha em largura (BFS)
+        pending = list(self._goto[0].values())
+        while pending:
+            next_pending = []
+            for state in pending:
+                for char, target in self._goto[state].items():
+                    fallback = self._fail[state]
+                    while fallback and char not in self._goto[fallback]:
+                        fallback = self._fail[fallback]
+                    self._fail[target] = self._goto[fallback].get(char, 0)
+                    self._output[target] += self._output[self._fail[target]]
+                    next_pending.append(target)
+            pending = next_pending
+    
+    def find_all(self, text: str) -> set:
+        """Retorna os índices (em self.keywords) das palavras presentes no texto"""
+        found = set()
+        goto, fail, output = self._goto, self._fail, self._output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+
+class ResponseAnalyzer:
+    """Analisa respostas de clientes para determinar confirmação - VERSÃO CORRIGIDA v2
+    
+    O vocabulário é compilado uma vez (KeywordAutomaton) com os pesos já
+    calculados; cada mensagem é classificada em uma única passada.
+    """
+    
+    # Listas SEM acentos (o texto é normalizado antes da busca)
+    POSITIVE_KEYWORDS = [
+        'com certeza', 'ate la', 'nos vemos', 'tudo bem', 'pode ser',
+        'confirmado', 'comparecerei', 'perfeito', 'tranquilo', 'concordo',
+        'combinado', 'agendado', 'positivo', 'presente', 'estarei',
+        'aceito', 'fechado', 'certeza', 'bacana', 'obvio', 'claro',
+        'beleza', 'massa', 'confirmo', 'show', 'joia', 'certo',
+        'sim', 'ok', 'vou', 'blz', 'yes', 'sure',
+        '👍', '✅', '🤝', '😊', '👌', '💪'
+    ]
+    
+    NEGATIVE_KEYWORDS = [
+        # FRASES COMPLETAS (PRIORIDADE MÁXIMA) - SEM ACENTOS (normalizado)
+        'nao posso', 'nao consigo', 'nao vou poder', 'nao da', 'nao vai dar',
+        'nao tenho como', 'impossivel', 'inviavel', 'indisponivel',
+        'nao confirmado', 'nao vou confirmar', 'nao posso confirmar',
+        'nao consigo confirmar', 'nao da pra confirmar', 
+        
+        # Negativas contextuais
+        'agenda cheia', 'outro compromisso', 'outro dia', 'outra data',
+        'ocupado', 'conflito', 'cancelar', 'desmarcar', 'impedimento',
+        'sinto muito', 'infelizmente', 'lamento',
+        
+        # Frases médias
+        'nao posso ir', 'nao vou conseguir', 'nao estarei disponivel',
+        'nao vai ser possivel', 'nao tenho disponibilidade',
+        
+        # Palavras individuais (MENOR PRIORIDADE)
+        'jamais', 'nunca', 'nao', 'nope', 'no', 'negativo',
+        
+        # Emojis
+        '👎', '❌', '😞', '🚫', '😔'
+    ]
+    
+    RESCHEDULE_KEYWORDS = [
+        'outro horario', 'semana que vem', 'mais tarde', 'nao sei',
+        'disponibilidade', 'reagendar', 'remarcar', 'mudanca',
+        'proxima', 'possivel', 'alterar', 'trocar', 'duvida',
+        'verificar', 'conferir', 'horarios', 'talvez', 'quando',
+        'incerto', 'agenda', 'depois'
+    ]
+    
+    # Respostas ultra-curtas (<= 5 caracteres) têm peso EXTRA
+    SHORT_POSITIVE = ('sim', 'ok', 'yes', 'claro')
+    SHORT_NEGATIVE = ('nao', 'no', 'nope', 'nunca', 'jamais')
+    SHORT_REPLY_BONUS = 10
+    
+    # Respostas frequentes com acento (as sem acento já vêm das listas acima)
+    COMMON_REPLIES = [
+        'não', 'não posso', 'não vou poder', 'não consigo', 'não sei', 'até lá',
+        'óbvio', 'dúvida', 'horários', 'próxima', 'impossível', 'possível',
+        'sim, confirmo', 'ok, obrigado', 'ok obrigado', 'confirmado!', 'sim!', 'ok!'
+    ]
+    
+    _matcher = None
+    _weights = ()
+    _direct = {}
+    _score_cached = None
+    direct_hits = 0
+    
+    @classmethod
+    def compile_keywords(cls):
+        """Compila as listas de palavras-chave no automato com pesos pré-calculados"""
+        categories = (
+            (0, cls.POSITIVE_KEYWORDS, 2),
+            (1, cls.NEGATIVE_KEYWORDS, 2),
+            (2, cls.RESCHEDULE_KEYWORDS, 1),
+        )
+        matcher = KeywordAutomaton([p for _, keywords, _ in categories for p in keywords])
+        
+        # Peso por palavra e categoria (frases valem mais); repetidas somam como antes
+        weights = [[0, 0, 0] for _ in matcher.keywords]
+        position = {keyword: i for i, keyword in enumerate(matcher.keywords)}
+        for category, keywords, min_weight in categories:
+            for palavra in keywords:
+                weights[position[palavra]][category] += max(min_weight, len(palavra.split()))
+        
+        cls._weights = tuple(tuple(w) for w in weights)
+        cls._matcher = matcher
+        
+        # Cache novo a cada compilação (o vocabulário pode ter mudado)
+        cls._score_cached = staticmethod(lru_cache(maxsize=ANALYZER_CACHE_SIZE)(cls._score))
+        cls.direct_hits = 0
+        
+        # Tabela direta: palavras isoladas, emojis e respostas frequentes, pela
+        # forma crua (minúscula) e pela normalizada
+        direct = {}
+        single_tokens = [k for k in matcher.keywords if len(k.split()) == 1]
+        for reply in single_tokens + list(cls.COMMON_REPLIES):
+            scored = cls._score(cls.normalize_text(reply))
+            direct[reply.strip().lower()] = scored
+            direct[cls.normalize_text(reply)] = scored
+        cls._direct = direct
+    
+    @classmethod
+    def cache_stats(cls) -> Dict[str, Any]:
+        """Contadores do caminho rápido (tabela direta + LRU)"""
+        info = cls._score_cached.cache_info()
+        return {
+            'direct_hits': cls.direct_hits,
+            'direct_entries': len(cls._direct),
+            'lru_hits': info.hits,
+            'lru_misses': info.misses,
+            'lru_size': info.currsize,
+            'lru_max_size': info.maxsize
+        }
+    
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """Normaliza texto removendo acentos e convertendo para minúsculas"""
+        if not text:
+            return ""
+        
+        # Remove acentos
+        normalized = unicodedata.normalize('NFKD', text)
+        normalized = ''.join([c for c in normalized if not unicodedata.combining(c)])
+        
+        # Lowercase
+        return normalized.lower().strip()
+    
+    @staticmethod
+    def _score(message_normalized: str) -> Tuple[str, float, int, int, int]:
+        """Pontua um texto já normalizado: (status, confiança, P, N, R)"""
+        # Uma passada pelo texto com o vocabulário compilado
+        score_positivo = score_negativo = score_reagendamento = 0
+        weights = ResponseAnalyzer._weights
+        for index in ResponseAnalyzer._matcher.find_all(message_normalized):
+            positive, negative, reschedule = weights[index]
+            score_positivo += positive
+            score_negativo += negative
+            score_reagendamento += reschedule
+        
+        # Respostas ultra-curtas têm peso EXTRA
+        if len(message_normalized) <= 5:
+            if message_normalized in ResponseAnalyzer.SHORT_POSITIVE:
+                score_positivo += ResponseAnalyzer.SHORT_REPLY_BONUS
+            elif message_normalized in ResponseAnalyzer.SHORT_NEGATIVE:
+                score_negativo += ResponseAnalyzer.SHORT_REPLY_BONUS
+        
+        # Cálculo de status com thresholds claros
+        total_score = score_positivo + score_negativo + score_reagendamento
+        
+        if total_score == 0:
+            status = 'unclear'
+            confidence = 0.0
+        elif score_positivo > score_negativo and score_positivo > score_reagendamento:
+            status = 'confirmed'
+            # Confiança proporcional: quanto maior o score, mais confiança
+            confidence = min(0.5 + (score_positivo / (total_score + 1)) * 0.5, 1.0)
+        elif score_negativo > score_positivo and score_negativo > score_reagendamento:
+            status = 'declined'
+            confidence = min(0.5 + (score_negativo / (total_score + 1)) * 0.5, 1.0)
+        elif score_reagendamento > 0 and score_reagendamento >= max(score_positivo, score_negativo):
+            status = 'reschedule'
+            confidence = min(0.4 + (score_reagendamento / (total_score + 1)) * 0.4, 0.9)
+        else:
+            status = 'unclear'
+            confidence = 0.2
+        
+        return status, confidence, score_positivo, score_negativo, score_reagendamento
+    
+    @staticmethod
+    def analyze_response(message: str) -> Dict[str, Any]:
+        """Analisa mensagem e retorna status de confirmação - VERSÃO CORRIGIDA"""
+        if not message:
+            return {
+                'status': 'unclear',
+                'confidence': 0.0,
+                'scores': {'positive': 0, 'negative': 0, 'reschedule': 0},
+                'original_message': message
+            }
+        
+        # Caminho rápido: resposta curta conhecida, sem normalizar
+        scored = ResponseAnalyzer._direct.get(message.strip().lower())
+        if scored is None:
+            message_normalized = ResponseAnalyzer.normalize_text(message)
+            scored = ResponseAnalyzer._direct.get(message_normalized)
+            if scored is None:
+                scored = ResponseAnalyzer._score_cached(message_normalized)
+            else:
+                ResponseAnalyzer.direct_hits += 1
+        else:
+            ResponseAnalyzer.direct_hits += 1
+        
+        status, confidence, score_positivo, score_negativo, score_reagendamento = scored
+        logger.debug(f"💭 '{message}' → {status.upper()} ({confidence:.2%}) | P={score_positivo} N={score_negativo} R={score_reagendamento}")
+        
+        return {
+            'status': status,
+            'confidence': confidence,
+            'scores': {
+                'positive': score_positivo,
+                'negative': score_negativo,
+                'reschedule': score_reagendamento
+            },
+            'original_message': message
+        }
+    
+    @staticmethod
+    def analyze_many(texts: Iterable[str]) -> List[Dict[str, Any]]:
+        """Classifica vários textos de uma vez (mesmo resultado de analyze_response)"""
+        analyze = ResponseAnalyzer.analyze_response
+        return [analyze(text) for text in texts]
+
+
+ResponseAnalyzer.compile_keywords()
+
+
+# ===============================
+# === RECLASSIFICAÇÃO EM LOTE ===
+# ===============================
+
+def _analyze_chunk(texts: List[str]) -> List[Dict[str, Any]]:
+    """Executado nos processos do pool (precisa ser função de módulo)"""
+    return ResponseAnalyzer.analyze_many(texts)
+
+
+def _iter_response_chunks(conn: sqlite3.Connection, chunk_size: int):
+    """Percorre client_responses em blocos por id (keyset), sem carregar tudo"""
+    last_id = 0
+    while True:
+        rows = conn.execute('''
+            SELECT id, response_text, status, confidence, analysis_data
+            FROM client_responses
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+        ''', (last_id, chunk_size)).fetchall()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield rows
+
+
+def _is_analyzer_row(analysis_data: Optional[str]) -> bool:
+    """Só reclassifica respostas geradas pelo analisador (não as manuais)"""
+    try:
+        data = json.loads(analysis_data) if analysis_data else None
+    except (TypeError, ValueError):
+        return False
+    return isinstance(data, dict) and 'scores' in data and not data.get('manual')
+
+
+def rescore_client_responses(db_path: str, chunk_size: int = 2000, workers: Optional[int] = None,
+                             dry_run: bool = False, sample_size: int = 50) -> Dict[str, Any]:
+    """Reaplica o ResponseAnalyzer sobre todo o histórico de client_responses
+    
+    Lê a tabela em blocos, classifica os blocos em um pool de processos (spawn:
+    chamado de dentro do Flask, fork copiaria locks das threads de fundo) e grava
+    status/confidence/analysis_data das linhas alteradas com executemany (um
+    commit por bloco). Retorna um relatório com as mudanças de classificação.
+    Respostas manuais (sem 'scores' em analysis_data) não são alteradas.
+    """
+    started = time.monotonic()
+    workers = workers or max(1, (os.cpu_count() or 2) - 1)
+    report = {
+        'scanned': 0,
+        'skipped': 0,
+        'rescored': 0,
+        'updated': 0,
+        'status_changed': 0,
+        'transitions': {},
+        'samples': [],
+        'dry_run': dry_run,
+        'workers': workers,
+        'elapsed_seconds': 0.0
+    }
+    
+    def apply(rows: List[Tuple], analyses: List[Dict[str, Any]], write_conn: sqlite3.Connection):
+        updates = []
+        for (response_id, text, old_status, old_confidence, old_data), analysis in zip(rows, analyses):
+            new_data = json.dumps(analysis)
+            if old_status != analysis['status']:
+                key = f"{old_status}->{analysis['status']}"
+                report['transitions'][key] = report['transitions'].get(key, 0) + 1
+                report['status_changed'] += 1
+                if len(report['samples']) < sample_size:
+                    report['samples'].append({
+                        'id': response_id,
+                        'response_text': text,
+                        'old_status': old_status,
+                        'new_status': analysis['status'],
+                        'old_confidence': old_confidence,
+                        'new_confidence': analysis['confidence']
+                    })
+            if (old_status, old_confidence, old_data) != (analysis['status'], analysis['confidence'], new_data):
+                updates.append((analysis['status'], analysis['confidence'], new_data, response_id))
+        
+        report['rescored'] += len(rows)
+        if updates and not dry_run:
+            write_conn.executemany('''
+                UPDATE client_responses
+                SET status = ?, confidence = ?, analysis_data = ?
+                WHERE id = ?
+            ''', updates)
+            write_conn.commit()
+        report['updated'] += len(updates)
+    
+    # closing(): o context manager do sqlite3 só faz commit/rollback, não fecha a conexão
+    with closing(open_connection(db_path)) as read_conn, closing(open_connection(db_path)) as write_conn, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        in_flight = []
+        for chunk in _iter_response_chunks(read_conn, chunk_size):
+            report['scanned'] += len(chunk)
+            rows = [row for row in chunk if _is_analyzer_row(row[4])]
+            report['skipped'] += len(chunk) - len(rows)
+            if not rows:
+                continue
+            
+            in_flight.append((rows, pool.submit(_analyze_chunk, [row[1] for row in rows])))
+            
+            # Mantém no máximo 2 blocos por processo em andamento
+            while len(in_flight) >= workers * 2:
+                pending_rows, future = in_flight.pop(0)
+                apply(pending_rows, future.result(), write_conn)
+        
+        for pending_rows, future in in_flight:
+            apply(pending_rows, future.result(), write_conn)
+    
+    report['elapsed_seconds'] = round(time.monotonic() - started, 3)
+    logger.info(
+        f"🔁 Reclassificação concluída: {report['rescored']} analisadas, "
+        f"{report['status_changed']} mudaram de status, {report['updated']} atualizadas "
+        f"({report['elapsed_seconds']}s{', simulação' if dry_run else ''})"
+    )
+    return report